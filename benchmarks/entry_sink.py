@@ -0,0 +1,92 @@
+"""
+Measures the rows per second of indexing a dictionary's entries: through db_manager.EntrySink,
+which writes batches into a staging database and merges them into `entries` in key order,
+against the way entries used to be added, one execute() per row with the indexes dropped and created again.
+
+Usage: python benchmarks/entry_sink.py [number of entries] [number of entries of the dictionaries already indexed]
+
+Dropping and creating the indexes again costs in proportion to all the entries, not only the new ones,
+so the comparison depends on how many there are already.
+
+Runs in a temporary home directory, so the real database is left alone. Put that directory on the storage
+of interest (e.g. an SD card) with TMPDIR, as the difference grows with the cost of syncing.
+"""
+import os
+import random
+import sqlite3
+import string
+import sys
+import tempfile
+import time
+
+os.environ['HOME'] = tempfile.mkdtemp(prefix='silverdict-benchmark-')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from app import db_manager
+from app.settings import Settings
+
+
+def random_words(num_words: int) -> list[str]:
+	return [''.join(random.choices(string.ascii_lowercase, k=random.randint(3, 12))) for _ in range(num_words)]
+
+
+def ingest_row_by_row(words: list[str], words_existing: list[str]) -> tuple[float, float]:
+	"""
+	Returns the seconds spent inserting the rows and in total.
+	"""
+	cursor = db_manager.get_cursor()
+	schema = cursor.execute("select type, name, sql from sqlite_master where tbl_name = 'entries'").fetchall()
+	connection = sqlite3.connect(os.path.join(Settings.APP_RESOURCES_ROOT, 'row_by_row.db'))
+	cursor = connection.cursor()
+	for type, name, sql in schema:
+		cursor.execute(sql)
+	cursor.executemany('insert into entries values (?, ?, ?, ?, ?)',
+					   ((word, 0, word, i, 10) for i, word in enumerate(words_existing)))
+	connection.commit()
+	time_start = time.perf_counter()
+	for type, name, sql in schema:
+		if type == 'index':
+			cursor.execute(f'drop index if exists {name}')
+	for i, word in enumerate(words):
+		cursor.execute('insert into entries values (?, ?, ?, ?, ?)', (word, 1, word, i, 10))
+	time_inserted = time.perf_counter()
+	for type, name, sql in schema:
+		if type == 'index':
+			cursor.execute(sql)
+	connection.commit()
+	time_end = time.perf_counter()
+	connection.close()
+	return time_inserted - time_start, time_end - time_start
+
+
+def ingest_with_sink(words: list[str], words_existing: list[str]) -> tuple[float, float]:
+	with db_manager.EntrySink('existing') as sink:
+		for i, word in enumerate(words_existing):
+			sink.add(word, word, i, 10)
+	time_start = time.perf_counter()
+	with db_manager.EntrySink('sink') as sink:
+		for i, word in enumerate(words):
+			sink.add(word, word, i, 10)
+		# The rows are in the staging database from here on, and merged on leaving
+		sink.flush()
+		time_inserted = time.perf_counter()
+	return time_inserted - time_start, time.perf_counter() - time_start
+
+
+def main() -> None:
+	num_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+	num_entries_existing = int(sys.argv[2]) if len(sys.argv) > 2 else num_entries
+	random.seed(1)
+	words = random_words(num_entries)
+	words_existing = random_words(num_entries_existing)
+	db_manager.init_db()
+
+	print(f'{num_entries} entries, {num_entries_existing} already indexed')
+	print(f'{"":14}{"insert (s)":>12}{"total (s)":>12}{"rows/s":>10}')
+	for label, ingest in (('row by row', ingest_row_by_row), ('EntrySink', ingest_with_sink)):
+		time_inserted, time_total = ingest(words, words_existing)
+		print(f'{label:14}{time_inserted:12.1f}{time_total:12.1f}{num_entries / time_total:10.0f}')
+
+
+if __name__ == '__main__':
+	main()
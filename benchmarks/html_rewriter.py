@@ -0,0 +1,133 @@
+"""
+Times the HTML cleaners of MDict and StarDict on large generated articles, in the style of Collins, Oxford
+and StarDict HTML dictionaries, against the cleaners as they were before html_rewriter.py,
+which made a pass per rule and sliced the whole article at every match.
+
+Usage: python benchmarks/html_rewriter.py [git revision of the cleaners to compare against]
+
+The earlier cleaners are read with git show, from the parent of the commit adding html_rewriter.py by default.
+"""
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+os.environ['HOME'] = tempfile.mkdtemp(prefix='silverdict-benchmark-')
+REPOSITORY_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPOSITORY_ROOT, 'server'))
+
+from app.dicts.mdict.html_cleaner import HTMLCleaner
+from app.dicts.stardict.html_cleaner import HtmlCleaner
+
+WORDS = ['abandon', 'badly', 'care', 'deal', 'ease', 'fact', 'gain', 'habit', 'idea', 'jam', 'keen', 'lack', 'main']
+NUM_SOUNDS = 50
+
+
+def git(*args: str) -> str:
+	return subprocess.run(['git', *args], cwd=REPOSITORY_ROOT, capture_output=True, text=True, check=True).stdout
+
+
+def load_module_at_revision(revision: str, path: str, package: str) -> types.ModuleType:
+	"""
+	Loads a module of the app as it was at the revision, into its package so that its relative imports work.
+	"""
+	module = types.ModuleType(f'{package}._at_{revision}')
+	module.__package__ = package
+	exec(compile(git('show', f'{revision}:{path}'), path, 'exec'), module.__dict__)
+	return module
+
+
+def collins_article(num_senses: int) -> str:
+	buf = ['<link rel="stylesheet" type="text/css" href="r.css"><div class="entry_container"><div class="page">']
+	buf.append(f'<h2 class="h2_entry"><span class="orth">{random.choice(WORDS)}</span> <span class="pron">(<span class="ipa">ˈbædlɪ</span> '
+			   f'<a class="hwd_sound sound audio_play_button icon-volume-up ptr fa fa-volume-up" data-lang="en_GB" '
+			   f'href="sound://audio/{random.randrange(NUM_SOUNDS)}.mp3" title="Pronunciation for ">'
+			   f'<img class="soundpng" src="img/sound.png"></a>)</span></h2>')
+	for i in range(num_senses):
+		word = random.choice(WORDS)
+		buf.append(f'<div class="hom" id="{word}_{i}"><span class="sensenum">{i + 1}</span> '
+				   f'<span class="gramGrp"><span class="pos">adverb</span></span> <div class="sense"><span class="def">'
+				   f'in a poor &amp; unsatisfactory way; see <a class="ref" href="entry://{word}" title="Translation of {word}">'
+				   f'<span class="orth">{word}</span></a>, <a class="xr" href="entry://{random.choice(WORDS)}">'
+				   f'<span class="orth">{random.choice(WORDS)}</span><sup>2</sup></a> and <a href="entry://#{word}_{i}">above</a>'
+				   f'</span><div class="cit type-example"><span class="quote">He did <b>{word}</b> in the exam.</span> '
+				   f'<a href="sound://audio/{random.randrange(NUM_SOUNDS)}.mp3"><img src="file://img/spk.png"></a></div>'
+				   f'<img class="pic" src="img/{word}{i}.png" alt="{word}"></div></div>')
+	buf.append('</div></div>')
+	return ''.join(buf)
+
+
+def oxford_article(num_senses: int) -> str:
+	buf = ['<div class="top-container"><div class="webtop"><h1 class="headword">oath</h1> <span class="pos">noun</span></div>']
+	for i in range(num_senses):
+		buf.append(f"<li class='sense' sensenum='{i}'><span class='def'>a solemn promise</span> "
+				   f"<span class='xrefs'><span class='prefix'>see also</span> "
+				   + ', '.join(f'<a class="Ref" href="entry://{random.choice(WORDS)}"><span class="xh">{random.choice(WORDS)}</span></a>'
+							   for _ in range(3))
+				   + f"</span><ul class='examples'><li><span class='x'>to take an oath</span></li></ul><img src=\"pic/{i}.jpg\"></li>")
+	buf.append('</div>')
+	return ''.join(buf)
+
+
+def stardict_article(num_senses: int) -> str:
+	buf = ['<div class="article"><link rel="stylesheet" href="style.css">']
+	for i in range(num_senses):
+		word = random.choice(WORDS)
+		buf.append(f'<span class="lemma"><a href="{word}">{word}</a></span> <b>n.</b> '
+				   f'<a href="bword://{random.choice(WORDS)}">{random.choice(WORDS)}</a> <img src="img/{i}.png"> '
+				   f'<a href="pics/{word}.jpg">picture</a> <a href="http://example.com/{word}">web</a> '
+				   f'<audio controls><source src="snd/{i}.ogg"></audio><p>{word} sense {i}</p>')
+	buf.append('</div>')
+	return ''.join(buf)
+
+
+def milliseconds(clean, article: str, repeat: int) -> float:
+	times = []
+	for _ in range(repeat):
+		time_start = time.perf_counter()
+		clean(article)
+		times.append(time.perf_counter() - time_start)
+	return statistics.median(times) * 1000
+
+
+def main() -> None:
+	revision = sys.argv[1] if len(sys.argv) > 1\
+		else git('log', '--diff-filter=A', '--format=%h', '--', 'server/app/dicts/html_rewriter.py').split()[-1] + '^'
+	random.seed(25)
+	directory = tempfile.mkdtemp(prefix='silverdict-benchmark-')
+	dictionary_filename = os.path.join(directory, 'r.mdx')
+	resources_dir = os.path.join(directory, 'r')
+	os.makedirs(os.path.join(resources_dir, 'audio'))
+	for i in range(0, NUM_SOUNDS, 2): # half the sounds are there
+		open(os.path.join(resources_dir, 'audio', f'{i}.mp3'), 'w').close()
+
+	MDictCleanerBefore = load_module_at_revision(revision,
+												 'server/app/dicts/mdict/html_cleaner.py',
+												 'app.dicts.mdict').HTMLCleaner
+	StarDictCleanerBefore = load_module_at_revision(revision,
+													'server/app/dicts/stardict/html_cleaner.py',
+													'app.dicts.stardict').HtmlCleaner
+	mdict_cleans = [cleaner.clean for cleaner in (MDictCleanerBefore(dictionary_filename, 'r', resources_dir),
+												   HTMLCleaner(dictionary_filename, 'r', resources_dir))]
+	stardict_cleans = [lambda html, clean=cleaner.clean: clean(html, 'h')
+					   for cleaner in (StarDictCleanerBefore('s', directory, os.path.join(directory, 's_before')),
+									   HtmlCleaner('s', directory, os.path.join(directory, 's')))]
+
+	print(f'Cleaners before: {revision}')
+	print(f'{"article":24}{"before (ms)":>14}{"now (ms)":>12}')
+	for label, generate_article, (clean_before, clean_now) in (('Collins', collins_article, mdict_cleans),
+															   ('Oxford', oxford_article, mdict_cleans),
+															   ('StarDict', stardict_article, stardict_cleans)):
+		for num_senses in (10, 100, 400):
+			article = generate_article(num_senses)
+			print(f'{f"{label} {len(article) // 1024} KiB":24}'
+				  f'{milliseconds(clean_before, article, 5):14.2f}'
+				  f'{milliseconds(clean_now, article, 20):12.2f}')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,101 @@
+"""
+Compares rendering in the threads of a query (render_in_processes: false) with rendering in the pool of worker
+processes (render_in_processes: true): latency and throughput of queries over several DSL dictionaries.
+
+Usage: python benchmarks/render_pool_throughput.py [number of dictionaries] [number of queries]
+
+The records are generated, so that reading them costs nothing and only the rendering and the IPC are measured.
+On a single core only the overhead of the processes shows; the gain grows with min(cores, dictionaries).
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ['HOME'] = tempfile.mkdtemp(prefix='silverdict-benchmark-')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from app.dicts.base_reader import BaseReader
+from app.dicts.dsl import DSLConverter
+from app.render_pool import RenderPool
+from app.utils import run_in_thread_pool
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'epsilon']
+NUM_RECORDS = 3
+NUM_SENSES = 40 # three lines each
+
+
+def dsl_article(num_senses: int) -> str:
+	lines = []
+	for i in range(num_senses):
+		lines.append(f'\t[m1][b]{i}.[/b] [p]n.[/p] [trn]{" ".join(random.choices(WORDS, k=12))}[/trn][/m]')
+		lines.append(f'\t[m2][ex][lang id=1033]{" ".join(random.choices(WORDS, k=8))}[/lang]'
+					 f' — [ref]{random.choice(WORDS)}[/ref][/ex][/m]')
+		lines.append(f'\t[m2][c gray]see also[/c] <<{random.choice(WORDS)}>> [s]sound.wav[/s][/m]')
+	return '\n'.join(lines)
+
+
+class GeneratedDSLReader(BaseReader):
+	def __init__(self, name: str, directory: str) -> None:
+		super().__init__(name, os.path.join(directory, f'{name}.dsl'), name)
+		resources_dir = os.path.join(directory, name)
+		os.makedirs(resources_dir, exist_ok=True)
+		self.renderer = DSLConverter(self.filename, name, resources_dir, True)
+		self._records = [(dsl_article(NUM_SENSES), f'word{i}', i) for i in range(NUM_RECORDS)]
+
+	def get_records_by_locations(self, locations: list[tuple[str, int, int]]) -> list:
+		return self._records
+
+	def get_definition_by_key(self, entry: str) -> str:
+		raise NotImplementedError
+
+	def get_definition_by_word(self, headword: str) -> str:
+		raise NotImplementedError
+
+
+def main() -> None:
+	num_dictionaries = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+	num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+	random.seed(15)
+	directory = tempfile.mkdtemp(prefix='silverdict-benchmark-')
+	readers = [GeneratedDSLReader(f'd{i}', directory) for i in range(num_dictionaries)]
+	render_pool = RenderPool(os.cpu_count() or 1)
+	render_pool.start()
+	locations_of_entries = [[('word', 0, 0)]]
+
+	def query_in_threads() -> list[str]:
+		return run_in_thread_pool(lambda reader: reader.get_definitions_by_locations(locations_of_entries),
+								  readers,
+								  num_max_workers=len(readers),
+								  stage='benchmark')
+
+	def query_in_processes() -> list[str]:
+		return run_in_thread_pool(lambda reader: render_pool.get_definitions_by_locations(reader, locations_of_entries),
+								  readers,
+								  num_max_workers=len(readers),
+								  stage='benchmark')
+
+	assert query_in_threads() == query_in_processes()
+	for _ in range(3):
+		query_in_processes() # every worker has unpickled the renderers
+
+	print(f'{os.cpu_count()} CPUs, {num_dictionaries} dictionaries, {num_queries} queries')
+	print(f'{"":12}{"p50 (ms)":>10}{"p90 (ms)":>10}{"queries/s":>11}')
+	for label, query in (('threads', query_in_threads), ('processes', query_in_processes)):
+		latencies = []
+		time_start = time.perf_counter()
+		for _ in range(num_queries):
+			time_query_start = time.perf_counter()
+			query()
+			latencies.append((time.perf_counter() - time_query_start) * 1000)
+		throughput = num_queries / (time.perf_counter() - time_start)
+		latencies.sort()
+		print(f'{label:12}'
+			  f'{latencies[len(latencies) // 2]:10.1f}'
+			  f'{latencies[len(latencies) * 9 // 10]:10.1f}'
+			  f'{throughput:11.1f}')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,107 @@
+"""
+Compares the FTS5 trigram table with the ngram table as the substring index of both-sides suggestions:
+build time, size on disk, and latency of substring and wildcard queries.
+
+Usage: python benchmarks/trigram_vs_ngram.py [number of entries]
+
+Runs against a synthetic database in a temporary home directory, so the real one is left alone.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ['HOME'] = tempfile.mkdtemp(prefix='silverdict-benchmark-')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from app import db_manager
+
+SYLLABLES = ['ka', 'ro', 'ten', 'mi', 'sha', 'lo', 'ber', 'gu', 'in', 'ex', 'tor', 've', 'al', 'un', 'ri', 'ped']
+DICTIONARY_NAMES = [f'd{i}' for i in range(5)]
+GROUP = DICTIONARY_NAMES[:3]
+NUM_SUGGESTIONS = 10
+
+
+def database_size() -> int:
+	db_manager.get_connection().commit()
+	cursor = db_manager.get_cursor()
+	cursor.execute('vacuum')
+	return cursor.execute('pragma page_count').fetchone()[0] * cursor.execute('pragma page_size').fetchone()[0]
+
+
+def milliseconds_per_query(function, queries: list[str], repeat: int) -> float:
+	for query in queries:
+		function(query) # warm-up
+	time_start = time.perf_counter()
+	for _ in range(repeat):
+		for query in queries:
+			function(query)
+	return (time.perf_counter() - time_start) / (repeat * len(queries)) * 1000
+
+
+def ngram_contains(key: str) -> list[str]:
+	return db_manager.select_entries_with_keys(db_manager.expand_key(key, False, GROUP), GROUP, [], NUM_SUGGESTIONS)
+
+
+def trigram_contains(key: str) -> list[str]:
+	return db_manager.select_entries_containing(key, GROUP, [], NUM_SUGGESTIONS)
+
+
+def main() -> None:
+	num_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+	random.seed(7)
+	db_manager.init_db()
+	keys_of_dictionaries = dict()
+	for name in DICTIONARY_NAMES:
+		keys = [''.join(random.choices(SYLLABLES, k=random.randint(2, 5)))
+				for _ in range(num_entries // len(DICTIONARY_NAMES))]
+		keys_of_dictionaries[name] = keys
+		with db_manager.EntrySink(name) as sink:
+			for i, key in enumerate(keys):
+				sink.add(key, key, i, 5)
+
+	size_entries = database_size()
+	time_start = time.perf_counter()
+	db_manager.create_ngram_table(False)
+	time_ngram = time.perf_counter() - time_start
+	size_ngram = database_size() - size_entries
+	db_manager.get_cursor().execute('drop table ngrams')
+	size_entries = database_size()
+	time_start = time.perf_counter()
+	if not db_manager.create_trigram_table():
+		sys.exit('SQLite lacks FTS5 or the trigram tokenizer')
+	time_trigram = time.perf_counter() - time_start
+	size_trigram = database_size() - size_entries
+	db_manager.create_ngram_table(False)
+
+	print(f'{num_entries} entries, {size_entries / 2**20:.1f} MiB without a substring index')
+	print(f'{"":24}{"build (s)":>12}{"size (MiB)":>12}')
+	print(f'{"ngram":24}{time_ngram:12.1f}{size_ngram / 2**20:12.1f}')
+	print(f'{"trigram":24}{time_trigram:12.1f}{size_trigram / 2**20:12.1f}')
+	print()
+
+	print(f'{"substring query (ms)":32}{"ngram":>10}{"trigram":>10}')
+	for queries in (['mis', 'gut', 'tor'], ['kami', 'sharo', 'berin', 'vealun'], ['tenmishal', 'pedriunal'],
+					['zzz', 'kaxro']):
+		for query in queries:
+			expected = sorted({key for name in GROUP for key in keys_of_dictionaries[name] if query in key})
+			assert trigram_contains(query) == expected[:NUM_SUGGESTIONS], query
+		print(f'{" ".join(queries):32}'
+			  f'{milliseconds_per_query(ngram_contains, queries, 30):10.2f}'
+			  f'{milliseconds_per_query(trigram_contains, queries, 30):10.2f}')
+	print()
+
+	print(f'{"wildcard query (ms)":32}{"scan":>10}{"trigram":>10}')
+	for pattern in ['%mish%', 'ka%ro_', '%b_rin%', '%alun', '%kaxro%']:
+		def like(pattern: str, uses_trigram_table: bool = False) -> list[str]:
+			return db_manager.select_entries_like(pattern, GROUP, NUM_SUGGESTIONS, uses_trigram_table)
+
+		assert like(pattern) == like(pattern, True), pattern
+		print(f'{pattern:32}'
+			  f'{milliseconds_per_query(like, [pattern], 10):10.2f}'
+			  f'{milliseconds_per_query(lambda pattern: like(pattern, True), [pattern], 10):10.2f}')
+
+
+if __name__ == '__main__':
+	main()
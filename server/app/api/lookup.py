@@ -1,5 +1,7 @@
 from flask import current_app, jsonify, make_response, request, render_template, send_from_directory, Response
+import mimetypes
 import time
+from werkzeug.exceptions import NotFound
 from . import api
 from .. import db_manager
 from ..dictionaries import simplify
@@ -173,5 +175,15 @@ def full_text_search(query: str) -> Response:
 
 @api.route('/cache/<path:path_name>')
 def send_cached_resources(path_name: str) -> Response:
-	response = send_from_directory(current_app.extensions['dictionaries'].settings.CACHE_ROOT, path_name)
+	dicts = current_app.extensions['dictionaries']
+	try:
+		response = send_from_directory(dicts.settings.CACHE_ROOT, path_name)
+	except NotFound:
+		# Resources of MDict dictionaries are not extracted but read out of the .mdd files
+		dictionary_name, _, resource_filename = path_name.partition('/')
+		resource = dicts.get_resource(dictionary_name, resource_filename)
+		if resource is None:
+			raise
+		response = make_response(resource)
+		response.mimetype = mimetypes.guess_type(resource_filename)[0] or 'application/octet-stream'
 	return response
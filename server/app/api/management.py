@@ -1,6 +1,8 @@
 from flask import jsonify, current_app, request, Response
 from . import api
 from .. import db_manager # Perhaps it's a sin to directly query the database here...
+from ..block_cache import block_cache
+from ..utils import process_memory_stats, worker_pool
 import logging
 
 logger = logging.getLogger(__name__)
@@ -234,13 +236,34 @@ def create_ngram_table() -> Response:
 	if TRUSTED == False:
 		raise PermissionError
 	dicts = current_app.extensions['dictionaries']
-	db_manager.create_ngram_table(dicts.settings.preferences['ngram_stores_keys'])
-	logger.info('Recreated ngram table')
+	if dicts.settings.preferences['substring_index'] == 'trigram':
+		if not db_manager.create_trigram_table():
+			return jsonify({'success': False})
+		logger.info('Recreated trigram table')
+	else:
+		db_manager.create_ngram_table(dicts.settings.preferences['ngram_stores_keys'])
+		logger.info('Recreated ngram table')
 	dicts.settings.change_suggestions_mode_from_right_side_to_both_sides()
 	response = jsonify({'success': True})
 	return response
 
 
+@api.route('/management/stats')
+def get_stats() -> Response:
+	if TRUSTED == False:
+		raise PermissionError
+	response = jsonify({
+		'bloom_filters': db_manager.bloom_filter_stats(),
+		'worker_pool': worker_pool.stats(),
+		'block_cache': block_cache.stats(),
+		'memory': {
+			'process': process_memory_stats(),
+			'dictionaries': current_app.extensions['dictionaries'].memory_stats()
+		}
+	})
+	return response
+
+
 @api.route('/management/create_xapian_index')
 def create_xapian_index() -> Response:
 	if TRUSTED == False:
@@ -0,0 +1,103 @@
+"""
+A process-wide cache of decompressed blocks of dictionary files, shared by the MDict, StarDict and DSL readers.
+Neighbouring articles usually sit in the same compressed block, so the entries of a multi-entry key,
+cross-references and sequential walks would otherwise inflate (and for encrypted MDX, decrypt) the same block again
+for every record. The cache is bounded by the total size of the blocks it holds and evicts the least recently used.
+"""
+
+import os
+import threading
+import idzip
+from typing import Any, Hashable
+from .settings import Settings
+
+
+def file_key(filename: str) -> tuple[str, int, int]:
+	"""
+	Identifies a file by its path, modification time and size, so that blocks of a file replaced
+	under the same name (a dictionary re-added, a DSL recompressed) are never served.
+	"""
+	stat = os.stat(filename)
+	return filename, stat.st_mtime_ns, stat.st_size
+
+
+class BlockCache:
+	def __init__(self, max_size: int) -> None:
+		self.max_size = max_size
+		self._size = 0
+		# Python dicts keep the insertion order: the first block is the least recently used
+		self._blocks: dict[Hashable, bytes] = dict()
+		self._lock = threading.Lock()
+		self._hits = 0
+		self._misses = 0
+		self._evictions = 0
+
+	def get(self, key: Hashable) -> bytes | None:
+		with self._lock:
+			block = self._blocks.pop(key, None)
+			if block is None:
+				self._misses += 1
+				return None
+			self._blocks[key] = block
+			self._hits += 1
+			return block
+
+	def put(self, key: Hashable, block: bytes) -> None:
+		if len(block) > self.max_size // 8: # one huge block would flush everything else
+			return
+		with self._lock:
+			previous_block = self._blocks.pop(key, None)
+			if previous_block is not None:
+				self._size -= len(previous_block)
+			self._blocks[key] = block
+			self._size += len(block)
+			while self._size > self.max_size:
+				self._size -= len(self._blocks.pop(next(iter(self._blocks))))
+				self._evictions += 1
+
+	def clear(self) -> None:
+		with self._lock:
+			self._blocks.clear()
+			self._size = 0
+
+	def stats(self) -> dict[str, Any]:
+		with self._lock:
+			num_lookups = self._hits + self._misses
+			return {
+				'max_size': self.max_size,
+				'size': self._size,
+				'num_blocks': len(self._blocks),
+				'hits': self._hits,
+				'misses': self._misses,
+				'evictions': self._evictions,
+				'hit_rate': round(self._hits / num_lookups, 3) if num_lookups else None
+			}
+
+
+class IdzipChunkCache:
+	"""
+	Plugs the block cache into an idzip reader, in place of its own cache of the last chunk only.
+	"""
+	def __init__(self, cache: BlockCache, file_key: tuple[str, int, int]) -> None:
+		self._cache = cache
+		self._file_key = file_key
+
+	def get(self, chunk_index: int) -> bytes | None:
+		return self._cache.get((self._file_key, chunk_index))
+
+	def put(self, chunk_index: int, chunk: bytes) -> None:
+		self._cache.put((self._file_key, chunk_index), chunk)
+
+
+def open_idzip(filename: str, cache_key: tuple[str, int, int] | None = None) -> 'idzip.api.IdzipFile':
+	"""
+	Opens a dictzipped file whose decompressed chunks go through the block cache.
+	A plain gzip file is opened as usual, without the cache.
+	"""
+	f = idzip.open(filename)
+	if hasattr(f._impl, '_cache'):
+		f._impl._cache = IdzipChunkCache(block_cache, cache_key or file_key(filename))
+	return f
+
+
+block_cache = BlockCache(Settings.BLOCK_CACHE_SIZE)
@@ -0,0 +1,78 @@
+import os
+import struct
+import sys
+from array import array
+from hashlib import blake2b
+from typing import Iterable
+
+
+class BloomFilter:
+	"""
+	A blocked Bloom filter over strings: all the bits of an item lie in one 64-bit word,
+	so a membership test is a single array lookup and mask comparison.
+	Both the word and the mask come from one 256-bit BLAKE2b digest; the mask is the AND of three
+	64-bit slices of it, which sets eight bits on average without a loop.
+	Neither depends on the filter, so an item is hashed once and checked against any number of filters.
+	It may wrongly report that an item is present, but never that it is absent.
+	"""
+	_MAGIC = b'SDBF'
+	_VERSION = 1
+	_HEADER = struct.Struct('<4sBQ') # magic, version, number of 64-bit blocks
+	_MASK_64 = (1 << 64) - 1
+
+	def __init__(self, num_blocks: int, blocks: array | None = None) -> None:
+		self.num_blocks = max(num_blocks, 1)
+		self._blocks = blocks if blocks is not None else array('Q', bytes(8 * self.num_blocks))
+
+	@classmethod
+	def for_capacity(cls, num_items: int, num_bits_per_item: int) -> 'BloomFilter':
+		return cls((num_items * num_bits_per_item + 63) // 64)
+
+	@classmethod
+	def hashes(cls, item: str) -> tuple[int, int]:
+		"""
+		Returns (block hash, mask).
+		"""
+		digest = int.from_bytes(blake2b(item.encode('utf-8'), digest_size=32).digest(), 'little')
+		return digest >> 192, digest & (digest >> 64) & (digest >> 128) & cls._MASK_64
+
+	def add(self, item: str) -> None:
+		block_hash, mask = self.hashes(item)
+		self._blocks[block_hash % self.num_blocks] |= mask
+
+	def update(self, items: Iterable[str]) -> None:
+		for item in items:
+			self.add(item)
+
+	def __contains__(self, item: str) -> bool:
+		return self.contains_hashes(*self.hashes(item))
+
+	def contains_hashes(self, block_hash: int, mask: int) -> bool:
+		return self._blocks[block_hash % self.num_blocks] & mask == mask
+
+	def save(self, filename: str) -> None:
+		blocks = self._blocks
+		if sys.byteorder == 'big':
+			blocks = array('Q', blocks)
+			blocks.byteswap()
+		# Write to a temporary file first, so that a crash never leaves a truncated filter behind
+		temp_filename = filename + '.tmp'
+		with open(temp_filename, 'wb') as f:
+			f.write(self._HEADER.pack(self._MAGIC, self._VERSION, self.num_blocks))
+			f.write(blocks.tobytes())
+		os.replace(temp_filename, filename)
+
+	@classmethod
+	def load(cls, filename: str) -> 'BloomFilter':
+		with open(filename, 'rb') as f:
+			data = f.read()
+		if len(data) < cls._HEADER.size:
+			raise ValueError(f'{filename} is not a Bloom filter')
+		magic, version, num_blocks = cls._HEADER.unpack_from(data)
+		if magic != cls._MAGIC or version != cls._VERSION or len(data) - cls._HEADER.size != 8 * num_blocks:
+			raise ValueError(f'{filename} is not a Bloom filter')
+		blocks = array('Q')
+		blocks.frombytes(data[cls._HEADER.size:])
+		if sys.byteorder == 'big':
+			blocks.byteswap()
+		return cls(num_blocks, blocks)
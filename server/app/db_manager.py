@@ -7,9 +7,14 @@ After all, it is efficient, thread-safe, and easy to use.
 Performance note:
 dictionary_exists(): very good with idx_dictname
 get_entries(): very good with idx_key_dictname_word
-select_entries_like(): I don't care, GoldenDict is also quite slow in this respect
+select_entries_like(): planned from the literal parts of the pattern, see the function
 entry_exists_in_dictionary(), entry_exists_in_dictionaries(): very good with idx_key_dictname_word
 
+Dictionary names are now interned in the `dictionaries` table, and `entries` refers to them by integer ID,
+so the table and idx_key_dictid no longer repeat the name on every row. The rows of each dictionary are
+written as one contiguous run sorted by key, so an existence check only touches idx_key_dictid and the rows
+of a key lie next to one another. The table keeps its rowid because the ngram postings refer to it.
+
 If idx_dictname exists, select_entries_beginning_with() would use it instead of idx_key_dictname_word(), which slows things down. Anyway dictionary_exists() is only used when initialising a dictionary reader, so it is not a big deal.
 
 ---
@@ -22,13 +27,75 @@ select * from entries where key like "key%" => select * from entries where key >
 But now, experimentally, I am using a lazy approach: just key < "key𱍊" (U+3134A, decimal 201546)
 
 'Contains' search is now implemented with ngrams by J.F. Dockes. The performance is staggering.
+
+Alternatively, an FTS5 table with the trigram tokenizer can be built over entries.key (external content,
+so the keys are not stored twice). It also answers three-character inputs, and LIKE patterns with at least
+three consecutive literal characters, which makes wildcard queries fast as well.
 """
 
+import hashlib
+import logging
+import os
+import random
+import re
 import sqlite3
+import sys
 import threading
+import time
+from array import array
+from typing import Iterable
+from .bloom_filter import BloomFilter
+from .prefix_index import PrefixIndex
+from .spelling_index import SpellingIndex
 from .settings import Settings
 
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+try:
+	import numpy
+	numpy_found = True
+except ImportError:
+	numpy_found = False
+
 local_storage = threading.local()
+lock_merging = threading.Lock() # only one dictionary is merged into `entries` at a time
+
+# name -> ID, mirrors the `dictionaries` table
+_dictionary_ids: dict[str, int] = dict()
+# names of a group -> their IDs, as the same groups are looked up on every keystroke. Cleared along with any change above
+_ids_of_groups: dict[tuple[str, ...], list[int]] = dict()
+lock_dictionary_ids = threading.Lock()
+
+# ID -> Bloom filter over the keys of the dictionary, consulted before any SQL.
+# A dictionary without a filter (yet) is simply looked up in the database.
+_bloom_filters: dict[int, BloomFilter] = dict()
+_bloom_filter_stats = {
+	'probes': 0, # (key, dictionary) pairs checked against a filter
+	'skipped': 0, # probes ruled out by the filter, i.e. SQL queries saved
+	'false_positives': 0 # probes let through although the key is absent
+}
+lock_bloom_filter_stats = threading.Lock()
+
+# Fingerprint of a group's dictionary IDs -> prefix index, see prefix_index.py.
+# The fingerprint changes whenever a dictionary joins or leaves the group or is re-indexed,
+# so an index never needs to be invalidated: a new one is simply built.
+_prefix_indexes: dict[str, PrefixIndex] = dict()
+_prefix_index_fingerprints: dict[tuple[int, ...], str] = dict()
+_prefix_indexes_being_built: set[str] = set()
+lock_prefix_indexes = threading.Lock()
+
+# IDs of a group -> {short prefix -> first words}, filled as prefixes are typed.
+# Like the prefix indexes, it is keyed by IDs, so that adding a dictionary to a group or re-indexing it
+# makes a new entry; only removed dictionaries need purging.
+_short_prefix_cache: dict[tuple[int, ...], dict[str, list[str]]] = dict()
+lock_short_prefix_cache = threading.Lock()
+
+# ID -> spelling index, see spelling_index.py. Built in the background the first time it is needed
+_spelling_indexes: dict[int, SpellingIndex] = dict()
+_spelling_indexes_being_built: set[int] = set()
+lock_spelling_indexes = threading.Lock()
+lock_building_spelling_indexes = threading.Lock() # one at a time, as a group may need dozens
 
 # n-gram related helpers
 def _gen_ngrams(input: str, ngramlen: int) -> list[str]:
@@ -39,6 +106,43 @@ def _gen_ngrams(input: str, ngramlen: int) -> list[str]:
 	return ngrams
 
 
+# Postings are sorted rowids packed as little-endian unsigned 32-bit integers
+def _pack_postings(rowids: array) -> bytes:
+	if sys.byteorder == 'big':
+		rowids = array('I', rowids)
+		rowids.byteswap()
+	return rowids.tobytes()
+
+
+def _unpack_postings(blob: bytes) -> array:
+	rowids = array('I')
+	rowids.frombytes(blob)
+	if sys.byteorder == 'big':
+		rowids.byteswap()
+	return rowids
+
+
+def _intersect_postings(postings: list[bytes]) -> list[int]:
+	"""
+	Intersect the rowid postings, starting with the shortest one so that the candidate set is small from the outset.
+	"""
+	postings = sorted(postings, key=len)
+	if numpy_found:
+		result = numpy.frombuffer(postings[0], dtype='<u4')
+		for posting in postings[1:]:
+			if len(result) == 0:
+				break
+			result = numpy.intersect1d(result, numpy.frombuffer(posting, dtype='<u4'), assume_unique=True)
+		return result.tolist()
+	else:
+		result = _unpack_postings(postings[0])
+		for posting in postings[1:]:
+			if len(result) == 0:
+				break
+			result = sorted(set(result).intersection(_unpack_postings(posting)))
+		return list(result)
+
+
 def get_connection() -> sqlite3.Connection:
 	if not hasattr(local_storage, 'connection'):
 		local_storage.connection = sqlite3.connect(Settings.SQLITE_DB_FILE)
@@ -51,123 +155,516 @@ def get_cursor() -> sqlite3.Cursor:
 	return local_storage.cursor
 
 
+def _database_size() -> int:
+	cursor = get_cursor()
+	page_count = cursor.execute('pragma page_count').fetchone()[0]
+	page_size = cursor.execute('pragma page_size').fetchone()[0]
+	return page_count * page_size
+
+
+def _time_sample_lookups(keys: list[str], column: str, values: list[str | int]) -> float:
+	"""
+	Returns the mean time in microseconds of an existence check plus a prefix search over all dictionaries.
+	"""
+	cursor = get_cursor()
+	placeholders = ','.join('?' * len(values))
+	for key in keys: # warm up the page cache first
+		cursor.execute(f'select key from entries where key = ? and {column} in ({placeholders}) limit 1',
+					   (key, *values)).fetchone()
+	time_started = time.perf_counter()
+	for key in keys:
+		cursor.execute(f'select key from entries where key = ? and {column} in ({placeholders}) limit 1',
+					   (key, *values)).fetchone()
+		cursor.execute(f'''select distinct word from entries
+					   where key >= ? and key < ? and {column} in ({placeholders})
+					   order by key limit 10''',
+					   (key, key + '\U0003134A', *values)).fetchall()
+	return (time.perf_counter() - time_started) / max(len(keys), 1) * 1e6
+
+
+def _migrate_to_dictionary_ids() -> None:
+	"""
+	Rewrites the old layout (entries.dictionary_name text + headword_counts) into the compact one.
+	"""
+	conn = get_connection()
+	cursor = get_cursor()
+	logger.info('Migrating the database to integer dictionary IDs. This may take a while.')
+	time_started = time.perf_counter()
+
+	max_rowid = cursor.execute('select max(rowid) from entries').fetchone()[0] or 0
+	sample_rowids = random.sample(range(1, max_rowid + 1), min(max_rowid, 200))
+	sample_keys = [row[0] for row in cursor.execute(
+		f'select key from entries where rowid in ({",".join("?" * len(sample_rowids))})', sample_rowids)]
+	names = [row[0] for row in cursor.execute('select distinct dictionary_name from entries')]
+	size_before = _database_size()
+	latency_before = _time_sample_lookups(sample_keys, 'dictionary_name', names)
+
+	cursor.execute('''insert into dictionaries (name, headword_count)
+				select dictionary_name, count(*) from entries group by dictionary_name''')
+	cursor.execute('''create table entries_new (
+		key text,
+		dict_id integer,
+		word text,
+		offset integer,
+		size integer
+	)''')
+	cursor.execute('''insert into entries_new
+				select e.key, d.id, e.word, e.offset, e.size
+				from entries e join dictionaries d on d.name = e.dictionary_name
+				order by d.id, e.key''')
+	cursor.execute('drop table entries') # along with its indexes
+	cursor.execute('drop table if exists headword_counts')
+	cursor.execute('alter table entries_new rename to entries')
+	create_index()
+	# The ngram postings refer to the old rowids
+	had_ngrams = cursor.execute("select 1 from sqlite_master where name = 'ngrams'").fetchone() is not None
+	cursor.execute('drop table if exists ngrams')
+	conn.commit()
+	cursor.execute('vacuum')
+
+	ids = [row[0] for row in cursor.execute('select id from dictionaries')]
+	size_after = _database_size()
+	latency_after = _time_sample_lookups(sample_keys, 'dict_id', ids)
+	logger.info(f'Migration done in {time.perf_counter() - time_started:.1f} s. '
+				f'Database size: {size_before / 2**20:.1f} MiB -> {size_after / 2**20:.1f} MiB; '
+				f'mean lookup + prefix search over {len(sample_keys)} sampled keys: '
+				f'{latency_before:.0f} us -> {latency_after:.0f} us.')
+	if had_ngrams:
+		logger.warning('The ngram table has been dropped. Recreate it in the settings to use both-sides search.')
+
+
 def init_db() -> None:
 	cursor = get_cursor()
+	# AUTOINCREMENT: IDs are never reused, so anything cached under a dictionary's ID
+	# becomes stale automatically once the dictionary is re-indexed
+	cursor.execute('''create table if not exists dictionaries (
+		id integer primary key autoincrement,
+		name text unique not null, -- identifying name of the dictionary
+		headword_count integer
+	)''')
+	columns = [row[1] for row in cursor.execute('pragma table_info(entries)')]
+	if 'dictionary_name' in columns:
+		# For backwards compatibility
+		cursor.execute('drop index if exists idx_dictname')
+		cursor.execute('drop index if exists idx_key_dictname_word')
+		cursor.execute('drop index if exists idx_key')
+		####
+		_migrate_to_dictionary_ids()
 	cursor.execute('''create table if not exists entries (
 		key text, -- the entry in lowercase and without accents
-		dictionary_name text, -- identifying name of the dictionary
+		dict_id integer, -- ID of the dictionary in the table `dictionaries`
 		word text, -- the entry as it appears in the dictionary
 		offset integer, -- offset of the entry in the dictionary file
 		size integer -- size of the definition in bytes
 	)''')
-	cursor.execute('''create table if not exists headword_counts (
-		dictionary_name text primary key,
-		count integer
-	)''')
 	# Note: we shouldn't use triggers to update the table automatically,
 	# because it is statement-level rather than transaction-level,
 	# i.e., it would run after each insertion, which is not efficient.
+	if _ngram_table_stores_keys() is not None and\
+		'dict_id' not in [row[1] for row in cursor.execute('pragma table_info(ngrams)')]:
+		# Postings used to cover all dictionaries at once, and cannot be maintained per dictionary
+		cursor.execute('drop table ngrams')
+		logger.warning('The ngram table has been dropped. Recreate it in the settings to use both-sides search.')
+	# Write-ahead logging lets lookups go on while a new dictionary is being merged
+	cursor.execute('pragma journal_mode = wal')
+	create_index()
+	get_connection().commit()
+	_load_dictionary_ids()
+	_load_bloom_filters()
 
 
-def dictionary_exists(dictionary_name: str) -> bool:
-	cursor = get_cursor()
-	# cursor.execute('select count(*) from entries where dictionary_name = ?', (dictionary_name,))
-	# return cursor.fetchone()[0] > 0
-	cursor.execute('select key from entries where dictionary_name = ? limit 1', (dictionary_name,))
-	return cursor.fetchone() is not None  # This is faster
+def _load_dictionary_ids() -> None:
+	with lock_dictionary_ids:
+		_dictionary_ids.clear()
+		_dictionary_ids.update(get_cursor().execute('select name, id from dictionaries').fetchall())
+		_ids_of_groups.clear()
+
 
+def _bloom_filter_filename(dictionary_id: int) -> str:
+	return os.path.join(Settings.BLOOM_FILTERS_DIR, f'{dictionary_id}.bloom')
 
-def add_entry(key: str,
-			  dictionary_name: str,
-			  word: str,
-			  offset: int,
-			  size: int) -> None:
-	"Commit manually!"
+
+def _load_bloom_filters() -> None:
+	"""
+	Load the filter of each dictionary, building the missing ones from the database.
+	"""
+	os.makedirs(Settings.BLOOM_FILTERS_DIR, exist_ok=True)
+	ids_dictionaries = set(_dictionary_ids.values())
+	for filename in os.listdir(Settings.BLOOM_FILTERS_DIR):
+		stem = filename.removesuffix('.bloom')
+		if not stem.isdigit() or int(stem) not in ids_dictionaries: # removed or re-indexed dictionary
+			os.remove(os.path.join(Settings.BLOOM_FILTERS_DIR, filename))
+
+	_bloom_filters.clear()
 	cursor = get_cursor()
-	cursor.execute('insert into entries values (?, ?, ?, ?, ?)', (key, dictionary_name, word, offset, size))
+	for dictionary_id in ids_dictionaries:
+		try:
+			_bloom_filters[dictionary_id] = BloomFilter.load(_bloom_filter_filename(dictionary_id))
+		except (OSError, ValueError):
+			num_entries = cursor.execute('select headword_count from dictionaries where id = ?',
+										 (dictionary_id,)).fetchone()[0]
+			bloom_filter = BloomFilter.for_capacity(num_entries, Settings.BLOOM_FILTER_BITS_PER_KEY)
+			bloom_filter.update(row[0] for row in cursor.execute('select key from entries where dict_id = ?',
+																  (dictionary_id,)))
+			bloom_filter.save(_bloom_filter_filename(dictionary_id))
+			_bloom_filters[dictionary_id] = bloom_filter
+			logger.info(f'Built the Bloom filter of dictionary #{dictionary_id}')
+
+
+def _ids_possibly_containing(key: str, ids_dictionaries: list[int]) -> list[int]:
+	block_hash, mask = BloomFilter.hashes(key)
+	ids_possible = []
+	num_probes = 0
+	for dictionary_id in ids_dictionaries:
+		bloom_filter = _bloom_filters.get(dictionary_id)
+		if bloom_filter is None:
+			ids_possible.append(dictionary_id)
+		else:
+			num_probes += 1
+			if bloom_filter.contains_hashes(block_hash, mask):
+				ids_possible.append(dictionary_id)
+	with lock_bloom_filter_stats:
+		_bloom_filter_stats['probes'] += num_probes
+		_bloom_filter_stats['skipped'] += len(ids_dictionaries) - len(ids_possible)
+	return ids_possible
+
+
+def _count_bloom_filter_false_positives(ids_dictionaries: Iterable[int]) -> None:
+	"""
+	Counts the dictionaries let through although the key is absent, leaving out those without a filter yet
+	(while the filters are loaded, or just after the dictionary is added), which were not probed.
+	"""
+	num_false_positives = sum(1 for dictionary_id in ids_dictionaries if dictionary_id in _bloom_filters)
+	with lock_bloom_filter_stats:
+		_bloom_filter_stats['false_positives'] += num_false_positives
 
 
-def commit_new_entries(dictionary_name: str) -> None:
-	conn = get_connection()
-	conn.commit()
-	
+def bloom_filter_stats() -> dict[str, int]:
+	with lock_bloom_filter_stats:
+		stats = dict(_bloom_filter_stats)
+	bloom_filters = list(_bloom_filters.values())
+	stats['num_filters'] = len(bloom_filters)
+	stats['size_bytes'] = sum(8 * bloom_filter.num_blocks for bloom_filter in bloom_filters)
+	return stats
+
+
+def _id_of_dictionary(dictionary_name: str) -> int | None:
+	return _dictionary_ids.get(dictionary_name)
+
+
+def _ids_of_dictionaries(names_dictionaries: list[str]) -> list[int]:
+	"""
+	The list returned is shared and must not be modified.
+	"""
+	names_dictionaries = tuple(names_dictionaries)
+	ids_dictionaries = _ids_of_groups.get(names_dictionaries)
+	if ids_dictionaries is None:
+		with lock_dictionary_ids:
+			ids_dictionaries = [_dictionary_ids[name] for name in names_dictionaries if name in _dictionary_ids]
+			if len(_ids_of_groups) >= 1000:
+				_ids_of_groups.clear()
+			_ids_of_groups[names_dictionaries] = ids_dictionaries
+	return ids_dictionaries
+
+
+def dictionary_exists(dictionary_name: str) -> bool:
+	# A dictionary is registered in the same transaction as its entries are merged
 	cursor = get_cursor()
-	cursor.execute('''insert or replace into headword_counts (dictionary_name, count)
-				select ?, count(*) from entries
-				where dictionary_name = ?''', (dictionary_name, dictionary_name))
-	conn.commit()
+	cursor.execute('select id from dictionaries where name = ?', (dictionary_name,))
+	return cursor.fetchone() is not None
 
 
-def create_ngram_table(stores_keys: bool) -> None:
+class EntrySink:
+	"""
+	Collects the entries of a dictionary being indexed and writes them with `executemany` in large batches.
+	Use it as a context manager:
+	with db_manager.EntrySink(name) as sink:
+		sink.add(key, word, offset, size)
+	The entries first go into a throwaway staging database attached to the connection,
+	which has neither indexes nor a journal. On leaving they are merged into `entries` in a single transaction,
+	so the indexes stay in place and lookups in the other dictionaries never fall back to a full table scan.
+	"""
+	_STAGING_PRAGMAS = {
+		'staging.journal_mode': 'off',
+		'staging.synchronous': 'off',
+		'staging.cache_size': -65536 # in KiB, i.e. 64 MiB
+	}
+	# These are per connection and restored afterwards
+	_MERGING_PRAGMAS = {
+		'cache_size': -65536,
+		'temp_store': 'memory'
+	}
+
+	def __init__(self, dictionary_name: str, batch_size: int = Settings.SQLITE_INSERT_BATCH_SIZE) -> None:
+		self._dictionary_name = dictionary_name
+		self._batch_size = batch_size
+		self._rows: list[tuple[str, str, int, int]] = []
+		self._saved_pragmas = dict()
+		self._staging_filename = os.path.join(Settings.APP_RESOURCES_ROOT, f'staging_{dictionary_name}.db')
+		self.num_entries = 0
+
+	def _apply_pragmas(self, pragmas: dict) -> None:
+		cursor = get_cursor()
+		for pragma, value in pragmas.items():
+			cursor.execute(f'pragma {pragma} = {value}')
+
+	def __enter__(self) -> 'EntrySink':
+		if os.path.isfile(self._staging_filename): # left over by an interrupted run
+			os.remove(self._staging_filename)
+		get_connection().commit() # cannot attach inside a transaction
+		cursor = get_cursor()
+		cursor.execute('attach database ? as staging', (self._staging_filename,))
+		self._apply_pragmas(self._STAGING_PRAGMAS)
+		cursor.execute('''create table staging.entries (
+			key text,
+			word text,
+			offset integer,
+			size integer
+		)''')
+		self._time_started = time.perf_counter()
+		return self
+
+	def add(self, key: str, word: str, offset: int, size: int) -> None:
+		self._rows.append((key, word, offset, size))
+		if len(self._rows) >= self._batch_size:
+			self.flush()
+
+	def flush(self) -> None:
+		if len(self._rows) > 0:
+			get_cursor().executemany('insert into staging.entries values (?, ?, ?, ?)', self._rows)
+			self.num_entries += len(self._rows)
+			self._rows.clear()
+
+	def _merge(self) -> None:
+		conn = get_connection()
+		cursor = get_cursor()
+		conn.commit()
+		for pragma in self._MERGING_PRAGMAS.keys():
+			self._saved_pragmas[pragma] = cursor.execute(f'pragma {pragma}').fetchone()[0]
+		self._apply_pragmas(self._MERGING_PRAGMAS)
+		bloom_filter = BloomFilter.for_capacity(self.num_entries, Settings.BLOOM_FILTER_BITS_PER_KEY)
+		bloom_filter.update(row[0] for row in cursor.execute('select key from staging.entries'))
+		# Readers keep seeing the old snapshot (WAL) until this transaction commits
+		with lock_merging:
+			cursor.execute('''insert into dictionaries (name, headword_count)
+					 select ?, count(*) from staging.entries''', (self._dictionary_name,))
+			dictionary_id = cursor.lastrowid
+			max_rowid = cursor.execute('select coalesce(max(rowid), 0) from main.entries').fetchone()[0]
+			# One contiguous run sorted by key, which also keeps the updates of idx_key_dictid local
+			cursor.execute('''insert into main.entries
+					 select key, ?, word, offset, size from staging.entries order by key''', (dictionary_id,))
+			# Keep the ngram table, if any, up to date for both-sides suggestions
+			stores_keys = _ngram_table_stores_keys()
+			if stores_keys is not None:
+				_insert_ngrams(stores_keys, max_rowid)
+			if trigram_table_exists():
+				cursor.execute('insert into entries_trigram (rowid, key) select rowid, key from main.entries where rowid > ?',
+							   (max_rowid,))
+			conn.commit()
+			os.makedirs(Settings.BLOOM_FILTERS_DIR, exist_ok=True)
+			bloom_filter.save(_bloom_filter_filename(dictionary_id))
+			_bloom_filters[dictionary_id] = bloom_filter
+			with lock_dictionary_ids:
+				_dictionary_ids[self._dictionary_name] = dictionary_id
+				_ids_of_groups.clear()
+		self._apply_pragmas(self._saved_pragmas)
+
+	def __exit__(self, exc_type, exc_value, traceback) -> None:
+		try:
+			if exc_type is None:
+				self.flush()
+				self._merge()
+				time_elapsed = time.perf_counter() - self._time_started
+				logger.info(f'{self.num_entries} entries of {self._dictionary_name} written in {time_elapsed:.1f} s '
+							f'({self.num_entries / max(time_elapsed, 1e-6):.0f} rows/s)')
+			else:
+				self._rows.clear()
+		finally:
+			get_connection().rollback() # no-op if merged
+			get_cursor().execute('detach database staging')
+			if os.path.isfile(self._staging_filename):
+				os.remove(self._staging_filename)
+
+
+# Rough memory cost of an ngram's posting besides its rowids: the dict slot, the key tuple and the array object
+_NGRAM_OVERHEAD_BYTES = 250
+
+
+def _write_ngram_postings(cursor: sqlite3.Cursor, postings: dict[tuple[int, str], array], appending: bool) -> None:
+	rows = ((dictionary_id, ngram, _pack_postings(postings[(dictionary_id, ngram)]))
+			for dictionary_id, ngram in sorted(postings.keys()))
+	if appending:
+		# || yields text, which is cast back to blob byte for byte
+		cursor.executemany('''insert into ngrams (dict_id, ngram, idxs) values (?, ?, ?)
+						   on conflict (dict_id, ngram) do update set idxs = cast(idxs || excluded.idxs as blob)''', rows)
+	else:
+		cursor.executemany('insert into ngrams (dict_id, ngram, idxs) values (?, ?, ?)', rows)
+
+
+def _insert_ngrams(stores_keys: bool, min_rowid: int) -> None:
+	"""
+	Index the entries whose rowid is greater than `min_rowid`. As each dictionary is given a new ID
+	and is merged as a contiguous run of rowids, its rows in `ngrams` are all new.
+	"""
 	cursor = get_cursor()
-	cursor.execute('drop index if exists ngrams_ngram')
-	cursor.execute('drop table if exists ngrams')
-	cursor.execute('create table ngrams (ngram text, idxs text)')
-	cursor.execute('create index ngrams_ngram on ngrams (ngram)')
+	time_start = time.perf_counter()
 
 	if stores_keys:
-		rows = cursor.execute('select distinct key from entries')
+		rows = cursor.execute('select distinct key, dict_id from entries where rowid > ?', (min_rowid,))
 
 		# Get another cursor for the ngrams table
 		c1 = get_connection().cursor()
+		batch = []
 		for row in rows:
 			key = row[0]
 			if len(key) >= Settings.NGRAM_LEN:
 				ngrams = _gen_ngrams(key, Settings.NGRAM_LEN)
 				for ngram in ngrams:
-					c1.execute('insert into ngrams (ngram, idxs) values (?, ?)', (ngram, key))
+					batch.append((row[1], ngram, key))
+				if len(batch) >= Settings.SQLITE_INSERT_BATCH_SIZE:
+					c1.executemany('insert into ngrams (dict_id, ngram, idxs) values (?, ?, ?)', batch)
+					batch.clear()
+		c1.executemany('insert into ngrams (dict_id, ngram, idxs) values (?, ?, ?)', batch)
 	else:
-		# Walk the whole entries table. For each row, generate ngrams from the key, and either create a row
-		# in the ngrams table, with the ngram and rowid, or append the rowid to an existing ngram record
-		# This is relatively slow (maybe 1/2 hour for a 5 million entries dict on a laptop).
-		rows = cursor.execute('select key, rowid from entries')
+		# Walk the entries in rowid order, and collect the rowids of each ngram of each dictionary in memory,
+		# where they stay sorted. Each ngram is then written once. Should the postings outgrow the
+		# memory budget, they are flushed and later chunks appended to the rows, which also keeps them sorted.
+		num_entries = cursor.execute('select count(*) from entries where rowid > ?', (min_rowid,)).fetchone()[0]
+		rows = cursor.execute('select key, dict_id, rowid from entries where rowid > ? order by rowid', (min_rowid,))
 
 		# Get another cursor for the ngrams table
 		c1 = get_connection().cursor()
-		for row in rows:
+		postings : dict[tuple[int, str], array] = dict()
+		num_rowids_in_memory = 0
+		has_spilled = False
+		for i, row in enumerate(rows, 1):
 			key = row[0]
-			rowid = str(row[1])
+			dictionary_id = row[1]
+			rowid = row[2]
 			if len(key) >= Settings.NGRAM_LEN:
-				ngrams = _gen_ngrams(key, Settings.NGRAM_LEN)
-				for ngram in ngrams:
-					c1.execute('select idxs from ngrams where ngram = ?', (ngram,))
-					row = c1.fetchone()
-					if row:
-						idxs = row[0]
-						idxs += "," + rowid
-						c1.execute('update ngrams set idxs = ? where ngram = ?', (idxs, ngram))
+				for ngram in set(_gen_ngrams(key, Settings.NGRAM_LEN)):
+					posting = postings.get((dictionary_id, ngram))
+					if posting is None:
+						postings[(dictionary_id, ngram)] = array('I', (rowid,))
 					else:
-						c1.execute('insert into ngrams (idxs, ngram) values (?, ?)', (rowid, ngram))
+						posting.append(rowid)
+					num_rowids_in_memory += 1
+				if num_rowids_in_memory * 4 + len(postings) * _NGRAM_OVERHEAD_BYTES > Settings.NGRAM_BUILD_MEMORY_BUDGET:
+					_write_ngram_postings(c1, postings, has_spilled)
+					postings.clear()
+					num_rowids_in_memory = 0
+					has_spilled = True
+			if i % Settings.NGRAM_BUILD_PROGRESS_INTERVAL == 0:
+				logger.info('Ngram table: %d/%d entries processed in %.1f seconds' % (i, num_entries, time.perf_counter() - time_start))
+		_write_ngram_postings(c1, postings, has_spilled)
+
+	logger.info('Ngram table updated in %.1f seconds' % (time.perf_counter() - time_start))
+
 
+def create_ngram_table(stores_keys: bool) -> None:
+	cursor = get_cursor()
+	cursor.execute('drop index if exists ngrams_ngram')
+	cursor.execute('drop table if exists ngrams')
+	cursor.execute('create table ngrams (ngram text, dict_id integer, idxs)')
+	# With the dictionary ID first, the index serves both lookups and the removal of a dictionary.
+	# Whether it is unique tells the two modes apart, see _ngram_table_stores_keys()
+	if stores_keys:
+		cursor.execute('create index ngrams_ngram on ngrams (dict_id, ngram)')
+	else:
+		cursor.execute('create unique index ngrams_ngram on ngrams (dict_id, ngram)')
+	_insert_ngrams(stores_keys, 0)
+	get_connection().commit()
+
+
+def create_trigram_table() -> bool:
+	"""
+	Returns False if SQLite is built without FTS5 or is too old for the trigram tokenizer (3.34).
+	"""
+	cursor = get_cursor()
+	time_start = time.perf_counter()
+	cursor.execute('drop table if exists entries_trigram')
+	try:
+		cursor.execute('''create virtual table entries_trigram
+				 using fts5(key, content='entries', content_rowid='rowid', tokenize='trigram')''')
+	except sqlite3.OperationalError as e:
+		logger.error(f'Could not create the trigram table: {e}')
+		return False
+	cursor.execute("insert into entries_trigram (entries_trigram) values ('rebuild')")
 	get_connection().commit()
+	logger.info('Trigram table created in %.1f seconds' % (time.perf_counter() - time_start))
+	return True
+
+
+def trigram_table_exists() -> bool:
+	return get_cursor().execute("select 1 from sqlite_master where name = 'entries_trigram'").fetchone() is not None
+
+
+def _ngram_table_stores_keys() -> bool | None:
+	"""
+	Returns None if there is no ngram table.
+	"""
+	for row in get_cursor().execute('pragma index_list(ngrams)'):
+		if row[1] == 'ngrams_ngram':
+			return not row[2]
+	return None
+
+
+def ngram_table_exists() -> bool:
+	return _ngram_table_stores_keys() is not None
 
 
 def get_entries(key: str, dictionary_name: str) -> list[tuple[str, int, int]]:
 	"""
 	Returns a list of (word, offset, size).
 	"""
+	dictionary_id = _id_of_dictionary(dictionary_name)
+	if dictionary_id is None or not _ids_possibly_containing(key, [dictionary_id]):
+		return []
 	cursor = get_cursor()
-	cursor.execute('select word, offset, size from entries where key = ? and dictionary_name = ?',
-				   (key, dictionary_name))
-	return cursor.fetchall()
+	cursor.execute('select word, offset, size from entries where key = ? and dict_id = ?',
+				   (key, dictionary_id))
+	locations = cursor.fetchall()
+	if not locations:
+		_count_bloom_filter_false_positives([dictionary_id])
+	return locations
+
 
+def get_entries_of_dictionaries(keys: list[str],
+								names_dictionaries: list[str]) -> dict[str, dict[str, list[tuple[str, int, int]]]]:
+	"""
+	Returns {dictionary name: {key: [(word, offset, size)]}} for the keys found in the dictionaries,
+	with a single query instead of one per key and dictionary.
+	"""
+	names_of_ids = {_id_of_dictionary(name): name for name in names_dictionaries}
+	names_of_ids.pop(None, None)
+	# Only ask SQLite about the (key, dictionary) pairs the Bloom filters do not rule out
+	pairs_possible = {(key, dictionary_id)
+					  for key in keys
+					  for dictionary_id in _ids_possibly_containing(key, list(names_of_ids.keys()))}
+	if len(pairs_possible) == 0:
+		return dict()
+	keys_possible = {key for key, dictionary_id in pairs_possible}
+	ids_possible = {dictionary_id for key, dictionary_id in pairs_possible}
+	cursor = get_cursor()
+	cursor.execute(
+		f'''select dict_id, key, word, offset, size from entries
+			where key in ({','.join('?' * len(keys_possible))})
+			and dict_id in ({','.join('?' * len(ids_possible))})''',
+		(*keys_possible, *ids_possible))
+	locations = dict()
+	pairs_found = set()
+	for dictionary_id, key, word, offset, size in cursor:
+		locations.setdefault(names_of_ids[dictionary_id], dict()).setdefault(key, []).append((word, offset, size))
+		pairs_found.add((key, dictionary_id))
+	_count_bloom_filter_false_positives(dictionary_id for key, dictionary_id in pairs_possible - pairs_found)
+	return locations
 
-lock_headword_counts = threading.Lock()
 
 def headword_count_of_dictionary(dictionary_name: str) -> int:
 	cursor = get_cursor()
-	cursor.execute('select count from headword_counts where dictionary_name = ?', (dictionary_name,))
-	cached_count = cursor.fetchone()
-	if cached_count:
-		return cached_count[0]
-	else:
-		cursor.execute('select count(*) from entries where dictionary_name = ?', (dictionary_name,))
-		count = cursor.fetchone()[0]
-		with lock_headword_counts:
-			cursor.execute('insert into headword_counts (dictionary_name, count) values (?, ?)',
-							(dictionary_name, count))
-			get_connection().commit()
-		return count
+	cursor.execute('select headword_count from dictionaries where name = ?', (dictionary_name,))
+	row = cursor.fetchone()
+	return row[0] if row else 0
 
 
 def get_entries_with_headword(word: str, dictionary_name: str) -> list[tuple[int, int]]:
@@ -175,8 +672,8 @@ def get_entries_with_headword(word: str, dictionary_name: str) -> list[tuple[int
 	Returns a list of (offset, size)
 	"""
 	cursor = get_cursor()
-	cursor.execute('select offset, size from entries where word = ? and dictionary_name = ?',
-				   (word, dictionary_name))
+	cursor.execute('select offset, size from entries where word = ? and dict_id = ?',
+				   (word, _id_of_dictionary(dictionary_name)))
 	return cursor.fetchall()
 
 
@@ -185,128 +682,377 @@ def get_entries_all(dictionary_name: str) -> list[tuple[str, str, int, int]]:
 	Returns a list of (key, word, offset, size).
 	"""
 	cursor = get_cursor()
-	cursor.execute('select key, word, offset, size from entries where dictionary_name = ? order by offset',
-				   (dictionary_name,))
+	cursor.execute('select key, word, offset, size from entries where dict_id = ? order by offset',
+				   (_id_of_dictionary(dictionary_name),))
 	return cursor.fetchall()
 
 
 def delete_dictionary(dictionary_name: str) -> None:
+	dictionary_id = _id_of_dictionary(dictionary_name)
+	if dictionary_id is None:
+		return
 	cursor = get_cursor()
-	cursor.execute('delete from entries where dictionary_name = ?', (dictionary_name,))
-	cursor.execute('delete from headword_counts where dictionary_name = ?', (dictionary_name,))
+	if trigram_table_exists():
+		# An external content table must be told the exact values being removed
+		cursor.execute('''insert into entries_trigram (entries_trigram, rowid, key)
+				 select 'delete', rowid, key from entries where dict_id = ?''', (dictionary_id,))
+	cursor.execute('delete from entries where dict_id = ?', (dictionary_id,))
+	if _ngram_table_stores_keys() is not None:
+		cursor.execute('delete from ngrams where dict_id = ?', (dictionary_id,))
+	cursor.execute('delete from dictionaries where id = ?', (dictionary_id,))
 	get_connection().commit()
+	with lock_dictionary_ids:
+		_dictionary_ids.pop(dictionary_name, None)
+		_ids_of_groups.clear()
+	_bloom_filters.pop(dictionary_id, None)
+	if os.path.isfile(_bloom_filter_filename(dictionary_id)):
+		os.remove(_bloom_filter_filename(dictionary_id))
+	with lock_prefix_indexes:
+		for fingerprint, prefix_index in list(_prefix_indexes.items()):
+			if dictionary_id in prefix_index.ids_dictionaries:
+				_prefix_indexes.pop(fingerprint)
+	with lock_short_prefix_cache:
+		for ids_dictionaries in list(_short_prefix_cache.keys()):
+			if dictionary_id in ids_dictionaries:
+				_short_prefix_cache.pop(ids_dictionaries)
+	with lock_spelling_indexes:
+		_spelling_indexes.pop(dictionary_id, None)
+		if os.path.isfile(_spelling_index_filename(dictionary_id)):
+			os.remove(_spelling_index_filename(dictionary_id))
 
 
 def create_index() -> None:
 	cursor = get_cursor()
 	# cursor.execute('create index idx_dictname on entries (dictionary_name)') # This helps with dictionary_exists()
-	cursor.execute('create index idx_key_dictname on entries (key, dictionary_name)')
+	cursor.execute('create index if not exists idx_key_dictid on entries (key, dict_id)')
 	# cursor.execute('create index idx_key on entries (key)')
 	# cursor.execute('create index idx_key_dictname_word on entries (key, dictionary_name, word)')
-	cursor.execute('create index idx_word_dictname on entries (word, dictionary_name)')
+	cursor.execute('create index if not exists idx_word_dictid on entries (word, dict_id)')
 
 
-def drop_index() -> None:
+def select_words_of_dictionary(dictionary_name: str) -> list[str]:
 	cursor = get_cursor()
-	# For backwards compatibility
-	cursor.execute('drop index if exists idx_dictname')
-	cursor.execute('drop index if exists idx_key_dictname_word')
-	cursor.execute('drop index if exists idx_key')
-	####
-	cursor.execute('drop index if exists idx_key_dictname')
-	cursor.execute('drop index if exists idx_word_dictname')
+	cursor.execute('select distinct word from entries where dict_id = ?', (_id_of_dictionary(dictionary_name),))
+	return [row[0] for row in cursor.fetchall()]
 
 
-def select_words_of_dictionary(dictionary_name: str) -> list[str]:
+def _prefix_index_filename(fingerprint: str) -> str:
+	return os.path.join(Settings.PREFIX_INDEXES_DIR, f'{fingerprint}.idx')
+
+
+def _collect_prefix_index_garbage() -> None:
+	"""
+	Remove the files covering a dictionary that no longer exists or has been re-indexed, and leftovers of interrupted builds.
+	"""
+	ids_existing = set(_dictionary_ids.values())
+	for filename in os.listdir(Settings.PREFIX_INDEXES_DIR):
+		fingerprint = filename.split('.')[0]
+		if fingerprint in _prefix_indexes_being_built:
+			continue
+		full_filename = os.path.join(Settings.PREFIX_INDEXES_DIR, filename)
+		if filename.endswith('.idx'):
+			ids_dictionaries = PrefixIndex.ids_of_dictionaries_in_file(full_filename)
+			if ids_dictionaries is not None and set(ids_dictionaries) <= ids_existing:
+				continue
+		os.remove(full_filename)
+
+
+def _build_prefix_index(ids_dictionaries: list[int], fingerprint: str) -> None:
+	time_start = time.perf_counter()
+	try:
+		# This runs in its own thread, hence with its own connection
+		cursor = get_cursor()
+		rows = cursor.execute(
+			f'''select distinct key, word from entries
+				where dict_id in ({','.join('?' * len(ids_dictionaries))})
+				order by key, word''',
+			ids_dictionaries)
+		num_rows = PrefixIndex.write(_prefix_index_filename(fingerprint), ids_dictionaries, rows)
+		with lock_prefix_indexes:
+			_prefix_indexes[fingerprint] = PrefixIndex(_prefix_index_filename(fingerprint))
+			_prefix_indexes_being_built.discard(fingerprint)
+			_collect_prefix_index_garbage()
+		logger.info(f'Prefix index {fingerprint} of {len(ids_dictionaries)} dictionaries ({num_rows} entries) '
+					f'built in {time.perf_counter() - time_start:.1f} s')
+	except Exception as e:
+		logger.error(f'Failed to build prefix index {fingerprint}: {e}')
+		with lock_prefix_indexes:
+			_prefix_indexes_being_built.discard(fingerprint)
+
+
+def _prefix_index_of(ids_dictionaries: list[int]) -> PrefixIndex | None:
+	"""
+	Returns the prefix index of these dictionaries if it is ready. Otherwise, it is loaded from disk,
+	or built in the background while the caller falls back to SQL.
+	"""
+	ids_dictionaries = tuple(ids_dictionaries)
+	fingerprint = _prefix_index_fingerprints.get(ids_dictionaries)
+	if fingerprint is None:
+		fingerprint = hashlib.sha1(','.join(str(i) for i in sorted(ids_dictionaries)).encode()).hexdigest()[:16]
+		if len(_prefix_index_fingerprints) >= 1000:
+			_prefix_index_fingerprints.clear()
+		_prefix_index_fingerprints[ids_dictionaries] = fingerprint
+	prefix_index = _prefix_indexes.get(fingerprint)
+	if prefix_index is not None:
+		return prefix_index
+	with lock_prefix_indexes:
+		if fingerprint in _prefix_indexes_being_built:
+			return None
+		if fingerprint in _prefix_indexes:
+			return _prefix_indexes[fingerprint]
+		try:
+			prefix_index = _prefix_indexes[fingerprint] = PrefixIndex(_prefix_index_filename(fingerprint))
+			return prefix_index
+		except (OSError, ValueError):
+			pass
+		os.makedirs(Settings.PREFIX_INDEXES_DIR, exist_ok=True)
+		_prefix_indexes_being_built.add(fingerprint)
+	threading.Thread(target=_build_prefix_index, args=(list(ids_dictionaries), fingerprint), daemon=True).start()
+	return None
+
+
+def _select_words_beginning_with(key: str,
+								 ids_dictionaries: list[int],
+								 words_excluded: list[str],
+								 limit: int,
+								 prefix_index: PrefixIndex | None) -> list[str]:
+	if prefix_index is not None:
+		return prefix_index.words_beginning_with(key, words_excluded, limit)
 	cursor = get_cursor()
-	cursor.execute('select distinct word from entries where dictionary_name = ?', (dictionary_name,))
+	cursor.execute(
+		f'''select distinct word from entries
+			where key >= ? and key < ?
+			and dict_id in ({','.join('?' * len(ids_dictionaries))})
+			and word not in ({','.join('?' * len(words_excluded))})
+			order by key
+			limit ?''',
+		(key, key + '\U0003134A', *ids_dictionaries, *words_excluded, limit))
 	return [row[0] for row in cursor.fetchall()]
 
 
+def _words_beginning_with_short_prefix(key: str,
+									   ids_dictionaries: list[int],
+									   prefix_index: PrefixIndex | None) -> list[str]:
+	"""
+	Returns the first SHORT_PREFIX_CACHE_SIZE words beginning with key, or all of them if there are fewer.
+	They are looked up once per group and prefix, which are few; the first keystrokes scan the largest key ranges.
+	"""
+	ids_dictionaries = tuple(ids_dictionaries)
+	words_of_prefixes = _short_prefix_cache.get(ids_dictionaries)
+	if words_of_prefixes is not None and (words := words_of_prefixes.get(key)) is not None:
+		return words
+	words = _select_words_beginning_with(key, list(ids_dictionaries), [], Settings.SHORT_PREFIX_CACHE_SIZE, prefix_index)
+	with lock_short_prefix_cache:
+		if ids_dictionaries not in _short_prefix_cache:
+			if len(_short_prefix_cache) >= Settings.SHORT_PREFIX_CACHE_MAX_GROUPS:
+				_short_prefix_cache.pop(next(iter(_short_prefix_cache)))
+			_short_prefix_cache[ids_dictionaries] = dict()
+		_short_prefix_cache[ids_dictionaries][key] = words
+	return words
+
+
 def select_entries_beginning_with(keys: list[str],
 								  names_dictionaries: list[str],
 								  words_already_found: list[str],
-								  limit: int) -> list[str]:
+								  limit: int,
+								  uses_prefix_index: bool = False) -> list[str]:
 	"""
 	Return the first ten entries (word) in the dictionaries that begin with the given keys.
 	"""
 	limit -= len(words_already_found)
-	cursor = get_cursor()
+	ids_dictionaries = _ids_of_dictionaries(names_dictionaries)
+	prefix_index = None
+	if uses_prefix_index and len(ids_dictionaries) > 0:
+		prefix_index = _prefix_index_of(ids_dictionaries)
 	result = []
 	for key in keys:
-		cursor.execute(
-			f'''select distinct word from entries
-				where key >= ? and key < ?
-				and dictionary_name in ({','.join('?' * len(names_dictionaries))})
-				and word not in ({','.join('?' * len(words_already_found))})
-				order by key
-				limit ?''',
-			(key, key + '\U0003134A', *names_dictionaries, *words_already_found, limit))
-		result.extend([row[0] for row in cursor.fetchall()])
-		limit = limit - len(result)
-		if limit <= 0:
+		num_words = limit - len(result)
+		if num_words <= 0:
 			break
+		words_excluded = words_already_found + result
+		if len(key) <= Settings.SHORT_PREFIX_MAX_LENGTH:
+			words = _words_beginning_with_short_prefix(key, ids_dictionaries, prefix_index)
+			words_new = [word for word in words if word not in words_excluded]
+			# Unless the cached words run out before enough are found, which only means there are more in the database
+			if len(words_new) >= num_words or len(words) < Settings.SHORT_PREFIX_CACHE_SIZE:
+				result.extend(words_new[:num_words])
+				continue
+		result.extend(_select_words_beginning_with(key, ids_dictionaries, words_excluded, num_words, prefix_index))
 	return result
 
 
+def _spelling_index_filename(dictionary_id: int) -> str:
+	return os.path.join(Settings.SPELLING_INDEXES_DIR, f'{dictionary_id}.spell')
+
+
+def _build_spelling_index(dictionary_id: int) -> None:
+	try:
+		with lock_building_spelling_indexes:
+			time_start = time.perf_counter()
+			# This runs in its own thread, hence with its own connection
+			rows = get_cursor().execute('select distinct key from entries where dict_id = ?', (dictionary_id,))
+			num_keys = SpellingIndex.write(_spelling_index_filename(dictionary_id), (row[0] for row in rows))
+			with lock_spelling_indexes:
+				_spelling_indexes[dictionary_id] = SpellingIndex(_spelling_index_filename(dictionary_id))
+				_spelling_indexes_being_built.discard(dictionary_id)
+				# Remove the files of dictionaries no longer present, and leftovers of interrupted builds
+				ids_existing = set(_dictionary_ids.values())
+				for filename in os.listdir(Settings.SPELLING_INDEXES_DIR):
+					stem = filename.removesuffix('.spell')
+					if not stem.isdigit() or (int(stem) not in ids_existing and int(stem) not in _spelling_indexes_being_built):
+						os.remove(os.path.join(Settings.SPELLING_INDEXES_DIR, filename))
+			logger.info(f'Spelling index of dictionary #{dictionary_id} ({num_keys} keys) '
+						f'built in {time.perf_counter() - time_start:.1f} s')
+	except Exception as e:
+		logger.error(f'Failed to build the spelling index of dictionary #{dictionary_id}: {e}')
+		with lock_spelling_indexes:
+			_spelling_indexes_being_built.discard(dictionary_id)
+
+
+def _spelling_index_of(dictionary_id: int) -> SpellingIndex | None:
+	"""
+	Returns the spelling index of the dictionary if it is ready. Otherwise, it is loaded from disk,
+	or built in the background.
+	"""
+	spelling_index = _spelling_indexes.get(dictionary_id)
+	if spelling_index is not None:
+		return spelling_index
+	with lock_spelling_indexes:
+		if dictionary_id in _spelling_indexes_being_built:
+			return None
+		if dictionary_id in _spelling_indexes:
+			return _spelling_indexes[dictionary_id]
+		try:
+			spelling_index = _spelling_indexes[dictionary_id] = SpellingIndex(_spelling_index_filename(dictionary_id))
+			return spelling_index
+		except (OSError, ValueError):
+			pass
+		os.makedirs(Settings.SPELLING_INDEXES_DIR, exist_ok=True)
+		_spelling_indexes_being_built.add(dictionary_id)
+	threading.Thread(target=_build_spelling_index, args=(dictionary_id,), daemon=True).start()
+	return None
+
+
+def select_entries_similar_to(key: str, names_dictionaries: list[str], limit: int) -> list[str]:
+	"""
+	Return up to `limit` words whose keys are within Settings.SPELLING_MAX_EDIT_DISTANCE of key
+	(one edit for keys of up to five characters), the closest first.
+	Dictionaries whose spelling index is not ready yet are left out.
+	"""
+	# Two edits away from a short key is almost anything, and slow to collect
+	if len(key) < 3:
+		return []
+	max_distance = 1 if len(key) <= 5 else Settings.SPELLING_MAX_EDIT_DISTANCE
+	ids_dictionaries = _ids_of_dictionaries(names_dictionaries)
+	distances = dict()
+	for dictionary_id in ids_dictionaries:
+		spelling_index = _spelling_index_of(dictionary_id)
+		if spelling_index is not None:
+			for similar_key, distance in spelling_index.similar_keys(key, max_distance).items():
+				distances[similar_key] = min(distance, distances.get(similar_key, distance))
+	if len(distances) == 0:
+		return []
+
+	# Every key has at least one word
+	keys = sorted(distances.keys(), key=lambda similar_key: (distances[similar_key], similar_key))[:limit]
+	cursor = get_cursor()
+	cursor.execute(
+		f'''select key, word from entries
+			where key in ({','.join('?' * len(keys))})
+			and dict_id in ({','.join('?' * len(ids_dictionaries))})''',
+		(*keys, *ids_dictionaries))
+	words_of_keys = dict()
+	for similar_key, word in cursor.fetchall():
+		words_of_keys.setdefault(similar_key, []).append(word)
+	words = []
+	for similar_key in keys:
+		for word in words_of_keys.get(similar_key, []):
+			if word not in words:
+				words.append(word)
+	return words[:limit]
+
+
 def select_entries_containing(key: str,
 							  names_dictionaries: list[str],
 							  words_already_found: list[str],
 							  limit: int) -> list[str]:
 	"""
 	Return the first num_suggestions - len(words_already_found) entries (word)
-	in the dictionaries that contain key.
+	in the dictionaries that contain key. Requires the trigram table.
 	"""
+	if len(key) < 3: # shorter than a trigram
+		return []
 	num_words = limit - len(words_already_found)
+	ids_dictionaries = _ids_of_dictionaries(names_dictionaries)
 	cursor = get_cursor()
 	cursor.execute(
-		f'''select distinct word from entries
-			where key like ?
-			and dictionary_name in ({','.join('?' * len(names_dictionaries))})
-			and word not in ({','.join('?' * len(words_already_found))})
-			order by key
+		f'''select distinct entries.word from entries_trigram
+			join entries on entries.rowid = entries_trigram.rowid
+			where entries_trigram match ?
+			and entries.dict_id in ({','.join('?' * len(ids_dictionaries))})
+			and entries.word not in ({','.join('?' * len(words_already_found))})
+			order by entries.key
 			limit ?''',
-		(f'%{key}%', *names_dictionaries, *words_already_found, num_words))
+		('"%s"' % key.replace('"', '""'), *ids_dictionaries, *words_already_found, num_words))
 	return [row[0] for row in cursor.fetchall()]
 
 
-def expand_key(input: str, stores_keys: bool) -> list[str]:
-	ngrams = _gen_ngrams(input, Settings.NGRAM_LEN)
-	if len(ngrams) == 0:
-		return []
-
+def _keys_from_ngram_postings(ngrams: list[str],
+							  stores_keys: bool,
+							  ids_dictionaries: list[int],
+							  max_num_rowids: int | None = None) -> list[str]:
+	"""
+	Returns the keys in which all the ngrams occur.
+	At most max_num_rowids rows are looked up in rowid mode.
+	"""
 	cursor = get_cursor()
-	statement = f'select idxs from ngrams where ngram in ({",".join("?" * len(ngrams))})'
-	rows = cursor.execute(statement, ngrams)
-
 	if stores_keys:
-		selected_keys = list(set((row[0] for row in rows)))
-		selected_keys = [key for key in selected_keys if key.find(input) != -1]
-		if len(selected_keys) > Settings.SQLITE_LIMIT_VARIABLE_NUMBER:
-			selected_keys = selected_keys[:Settings.SQLITE_LIMIT_VARIABLE_NUMBER]
-	else:
-		# Intersect the lists yielded by the different ngrams
-		selected_idxs = None
-		for row in rows:
-			if selected_idxs is None:
-				selected_idxs = set(row[0].split(','))
-			else:
-				selected_idxs = selected_idxs & set(row[0].split(','))
-
-		if not selected_idxs:
-			return []
-
-		if len(selected_idxs) > Settings.SQLITE_LIMIT_VARIABLE_NUMBER:
-			selected_idxs = list(selected_idxs)[:Settings.SQLITE_LIMIT_VARIABLE_NUMBER]
-		# Get the keys corresponding to the selected rowids
-		statement = f'select key from entries where rowid in ({",".join("?" * len(selected_idxs))})'
-		rows = cursor.execute(statement, [int(idx) for idx in selected_idxs])
-		selected_keys = [row[0] for row in rows]
-
-		# Only select the keys where the input is found (ngrams contiguous in the right order)
-		# Actually this usually filters nothing
-		selected_keys = [key for key in selected_keys if key.find(input) != -1]
+		statement = f'''select ngram, idxs from ngrams
+			where dict_id in ({",".join("?" * len(ids_dictionaries))}) and ngram in ({",".join("?" * len(ngrams))})'''
+		keys_of_ngrams : dict[str, set[str]] = {ngram: set() for ngram in ngrams}
+		for row in cursor.execute(statement, (*ids_dictionaries, *ngrams)):
+			keys_of_ngrams[row[0]].add(row[1])
+		return list(set.intersection(*keys_of_ngrams.values()))
+
+	statement = f'''select dict_id, idxs from ngrams
+		where dict_id in ({",".join("?" * len(ids_dictionaries))}) and ngram in ({",".join("?" * len(ngrams))})'''
+	rows = cursor.execute(statement, (*ids_dictionaries, *ngrams))
+
+	# Intersect the postings yielded by the different ngrams, dictionary by dictionary
+	postings_of_dictionaries : dict[int, list[bytes]] = dict()
+	for row in rows:
+		postings_of_dictionaries.setdefault(row[0], []).append(row[1])
+	selected_idxs = []
+	for postings in postings_of_dictionaries.values():
+		if len(postings) == len(ngrams): # otherwise some ngram does not occur at all
+			selected_idxs.extend(_intersect_postings(postings))
+	if max_num_rowids is not None:
+		selected_idxs = selected_idxs[:max_num_rowids]
+
+	# Get the keys corresponding to the selected rowids
+	keys = []
+	for i in range(0, len(selected_idxs), Settings.SQLITE_LIMIT_VARIABLE_NUMBER):
+		chunk = selected_idxs[i:i + Settings.SQLITE_LIMIT_VARIABLE_NUMBER]
+		statement = f'select key from entries where rowid in ({",".join("?" * len(chunk))})'
+		keys.extend(row[0] for row in cursor.execute(statement, chunk))
+	return keys
+
+
+def expand_key(input: str, stores_keys: bool, names_dictionaries: list[str]) -> list[str]:
+	if _ngram_table_stores_keys() is None:
+		# Dropped by a migration and not recreated yet
+		return []
+	ngrams = list(set(_gen_ngrams(input, Settings.NGRAM_LEN)))
+	ids_dictionaries = _ids_of_dictionaries(names_dictionaries)
+	if len(ngrams) == 0 or len(ids_dictionaries) == 0:
+		return []
 
+	selected_keys = _keys_from_ngram_postings(ngrams, stores_keys, ids_dictionaries, Settings.SQLITE_LIMIT_VARIABLE_NUMBER)
+	# Only select the keys where the input is found (ngrams contiguous in the right order)
+	# Actually this usually filters nothing in rowid mode
+	selected_keys = [key for key in selected_keys if key.find(input) != -1]
+	if len(selected_keys) > Settings.SQLITE_LIMIT_VARIABLE_NUMBER:
+		selected_keys = selected_keys[:Settings.SQLITE_LIMIT_VARIABLE_NUMBER]
 	return selected_keys
 
 
@@ -315,57 +1061,158 @@ def select_entries_with_keys(keys: list[str],
 							 words_already_found: list[str],
 							 limit: int) -> list[str]:
 	num_words = limit - len(words_already_found)
+	ids_dictionaries = _ids_of_dictionaries(names_dictionaries)
 	cursor = get_cursor()
 	cursor.execute(
 		f'''select distinct word from entries
 			where key in ({','.join('?' * len(keys))})
-			and dictionary_name in ({','.join('?' * len(names_dictionaries))})
+			and dict_id in ({','.join('?' * len(ids_dictionaries))})
 			and word not in ({','.join('?' * len(words_already_found))})
 			order by key
 			limit ?''',
-		(*keys, *names_dictionaries, *words_already_found, num_words))
+		(*keys, *ids_dictionaries, *words_already_found, num_words))
 	return [row[0] for row in cursor.fetchall()]
 
 
-def select_entries_like(key: str, names_dictionaries: list[str], limit: int) -> list[str]:
+def _like_pattern_to_regex(pattern: str) -> re.Pattern:
 	"""
-	Return the first ten entries matched.
+	Compiles a LIKE pattern with the same semantics: % and _ match any string and character,
+	and only ASCII letters are case-insensitive.
 	"""
+	regex = ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern)
+	return re.compile(regex, re.DOTALL | re.IGNORECASE | re.ASCII)
+
+
+def _distinct_words_of_matching_rows(rows: Iterable[tuple[str, str]],
+									 regex: re.Pattern,
+									 limit: int,
+									 words: list[str] | None = None) -> list[str]:
+	"""
+	Appends to `words` the words of the rows whose key matches, until there are `limit` of them.
+	"""
+	words = words if words is not None else []
+	for key, word in rows:
+		if word not in words and regex.fullmatch(key):
+			words.append(word)
+			if len(words) >= limit:
+				break
+	return words
+
+
+def select_entries_like(key: str,
+						names_dictionaries: list[str],
+						limit: int,
+						uses_trigram_table: bool = False,
+						uses_prefix_index: bool = False) -> list[str]:
+	"""
+	Return the first `limit` words whose key matches the LIKE pattern `key`, in the order of keys.
+	The candidates are narrowed down, from the first applicable of:
+	- the literal prefix of the pattern, as a range of the prefix index or of idx_key_dictid;
+	- the trigram table, given three consecutive literal characters;
+	- the ngram postings of the literal infixes of at least NGRAM_LEN characters;
+	- failing all of them, the whole table.
+	"""
+	ids_dictionaries = _ids_of_dictionaries(names_dictionaries)
+	if len(ids_dictionaries) == 0:
+		return []
 	cursor = get_cursor()
+	literal_prefix = re.match(r'[^%_]*', key).group()
+	literal_infixes = re.findall(r'[^%_]+', key)
+
+	if literal_prefix:
+		# SQLite's LIKE is case-insensitive, so it never turns a prefix into a range of idx_key_dictid by itself.
+		# The keys are simplified, i.e. in lower case, so the range misses nothing
+		prefix_index = _prefix_index_of(ids_dictionaries) if uses_prefix_index else None
+		if prefix_index is not None:
+			return _distinct_words_of_matching_rows(prefix_index.rows_beginning_with(literal_prefix),
+													_like_pattern_to_regex(key),
+													limit)
+		cursor.execute(
+			f'''select distinct word from entries
+				where key >= ? and key < ? and key like ?
+				and dict_id in ({','.join('?' * len(ids_dictionaries))})
+				order by key
+				limit ?''',
+			(literal_prefix, literal_prefix + '\U0003134A', key, *ids_dictionaries, limit))
+		return [row[0] for row in cursor.fetchall()]
+
+	if uses_trigram_table and any(len(infix) >= 3 for infix in literal_infixes) and trigram_table_exists():
+		# FTS5 narrows the candidates down with the pattern's trigrams before evaluating LIKE
+		cursor.execute(
+			f'''select distinct entries.word from entries_trigram
+				join entries on entries.rowid = entries_trigram.rowid
+				where entries_trigram.key like ?
+				and entries.dict_id in ({','.join('?' * len(ids_dictionaries))})
+				order by entries.key
+				limit ?''',
+			(key, *ids_dictionaries, limit))
+		return [row[0] for row in cursor.fetchall()]
+
+	ngrams = list(set(ngram for infix in literal_infixes for ngram in _gen_ngrams(infix, Settings.NGRAM_LEN)))
+	stores_keys = _ngram_table_stores_keys() if ngrams else None
+	if stores_keys is not None:
+		regex = _like_pattern_to_regex(key)
+		keys = sorted(set(k for k in _keys_from_ngram_postings(ngrams, stores_keys, ids_dictionaries) if regex.fullmatch(k)))
+		words = []
+		# Every key has at least one word, so the first `limit` keys left are enough
+		while len(words) < limit and keys:
+			chunk, keys = keys[:limit], keys[limit:]
+			cursor.execute(
+				f'''select key, word from entries
+					where key in ({','.join('?' * len(chunk))})
+					and dict_id in ({','.join('?' * len(ids_dictionaries))})
+					order by key''',
+				(*chunk, *ids_dictionaries))
+			_distinct_words_of_matching_rows(cursor.fetchall(), regex, limit, words)
+		return words
+
 	cursor.execute(
 		f'''select distinct word from entries
 			where key like ?
-			and dictionary_name in ({','.join('?' * len(names_dictionaries))})
+			and dict_id in ({','.join('?' * len(ids_dictionaries))})
 			order by key
 			limit ?''',
-		(key, *names_dictionaries, limit))
+		(key, *ids_dictionaries, limit))
 	return [row[0] for row in cursor.fetchall()]
 
 
 def entry_exists_in_dictionary(key: str, dictionary_name: str) -> bool:
+	dictionary_id = _id_of_dictionary(dictionary_name)
+	if dictionary_id is None or not _ids_possibly_containing(key, [dictionary_id]):
+		return False
 	cursor = get_cursor()
 	# cursor.execute('select count(*) from entries where key = ? and dictionary_name = ?', (key, dictionary_name))
 	# return cursor.fetchone()[0] > 0
-	cursor.execute('select key from entries where key = ? and dictionary_name = ? limit 1',
-				   (key, dictionary_name))
-	return cursor.fetchone() is not None
+	cursor.execute('select key from entries where key = ? and dict_id = ? limit 1',
+				   (key, dictionary_id))
+	if cursor.fetchone() is None:
+		_count_bloom_filter_false_positives([dictionary_id])
+		return False
+	return True
 
 
 def headword_exists_in_dictionary(word: str, dictionary_name: str) -> bool:
 	cursor = get_cursor()
-	cursor.execute('select word from entries where word = ? and dictionary_name = ? limit 1',
-				   (word, dictionary_name))
+	cursor.execute('select word from entries where word = ? and dict_id = ? limit 1',
+				   (word, _id_of_dictionary(dictionary_name)))
 	return cursor.fetchone() is not None
 
 
 def entry_exists_in_dictionaries(key: str, names_dictionaries: list[str]) -> bool:
+	ids_dictionaries = _ids_possibly_containing(key, _ids_of_dictionaries(names_dictionaries))
+	if len(ids_dictionaries) == 0:
+		return False
 	cursor = get_cursor()
 	# cursor.execute('select count(*) from entries where key = ? and dictionary_name in (%s)' % ','.join('?' * len(names_dictionaries)), (key, *names_dictionaries))
 	# return cursor.fetchone()[0] > 0
 	cursor.execute(
 		f'''select key from entries
 			where key = ?
-			and dictionary_name in ({','.join('?' * len(names_dictionaries))})
+			and dict_id in ({','.join('?' * len(ids_dictionaries))})
 			limit 1''',
-		(key, *names_dictionaries))
-	return cursor.fetchone() is not None
+		(key, *ids_dictionaries))
+	if cursor.fetchone() is None:
+		# Every dictionary let through was a false positive
+		_count_bloom_filter_false_positives(ids_dictionaries)
+		return False
+	return True
@@ -1,5 +1,6 @@
 from flask import Flask
 import concurrent.futures
+import functools
 import logging
 import os
 import shutil
@@ -8,9 +9,10 @@ import threading # FIXME: lock all list operations in case of the GIL being ditc
 from . import db_manager
 from . import transformation
 from .dicts import BaseReader, DSLReader, StarDictReader, MDictReader
-from .langs import is_lang, transliterate, stem, spelling_suggestions, orthographic_forms, convert_chinese
+from .langs import is_lang, transliterate, stem, spelling_suggestions, orthographic_forms, convert_chinese, convert_chinese_article
+from .render_pool import render_pool
 from .settings import Settings
-from .utils import run_in_thread_pool
+from .utils import run_in_thread_pool, worker_pool
 
 
 logger = logging.getLogger(__name__)
@@ -44,8 +46,6 @@ class Dictionaries:
 	_re_illegal_css_selector_chars =\
 		re.compile('[\\~!@\\$%\\^\\&\\*\\(\\)\\+=,\\./\';:"\\?><\\[\\]\\\\\\{\\}\\|`\\#]')
 	_re_legacy_lookup_api = re.compile(r'api/lookup/([^/]+)/([^/]+)')
-	_re_cache_api = re.compile(r'api/cache/([^/]+)/([^/]+)')
-	_REPLACEMENT_TEXT = '!!@@SUBSTITUTION@@!!'
 	_re_img = re.compile(r'<img[^>]*>')
 	_re_audio = re.compile(r'<audio.*?>.*?</audio>')
 	_re_video = re.compile(r'<video.*?>.*?</video>')
@@ -125,6 +125,16 @@ class Dictionaries:
 		self.settings = Settings()
 
 		db_manager.init_db()
+		if self.settings.preferences['suggestions_mode'] == 'both-sides'\
+			and not db_manager.ngram_table_exists()\
+			and not (self.settings.preferences['substring_index'] == 'trigram' and db_manager.trigram_table_exists()):
+			# The ngram table has been dropped by a migration of the database
+			self.settings.change_suggestions_mode_from_both_sides_to_right_side()
+			logger.warning('Suggestions mode switched to right-side, as there is no ngram table.')
+		# The workers open their SQLite connections once and for all
+		worker_pool.start(db_manager.get_cursor)
+		if self.settings.preferences['render_in_processes']:
+			render_pool.start()
 
 		self._dictionaries: dict[str, BaseReader] = dict()
 		# on HDD it would confuse the I/O scheduler to load the dictionaries in parallel
@@ -132,7 +142,7 @@ class Dictionaries:
 			for dictionary_info in self.settings.dictionaries_list:
 				self._load_dictionary(dictionary_info)
 		else:
-			run_in_thread_pool(self._load_dictionary, self.settings.dictionaries_list)
+			run_in_thread_pool(self._load_dictionary, self.settings.dictionaries_list, stage='load_dictionary')
 
 		logger.info('Dictionaries loaded.')
 
@@ -172,9 +182,18 @@ class Dictionaries:
 		self.settings.add_dictionary(dictionary_info)
 		logger.info('Added dictionary %s' % dictionary_info['dictionary_name'])
 
+	def get_resource(self, dictionary_name: str, resource_filename: str) -> bytes | None:
+		if dictionary_name not in self._dictionaries:
+			return None
+		return self._dictionaries[dictionary_name].get_resource(resource_filename)
+
+	def memory_stats(self) -> dict[str, dict]:
+		return {name: reader.memory_stats() for name, reader in self._dictionaries.items()}
+
 	def remove_dictionary(self, dictionary_info: dict) -> None:
 		self.settings.remove_dictionary(dictionary_info)
 		self._dictionaries.pop(dictionary_info['dictionary_name'])
+		render_pool.forget(dictionary_info['dictionary_name'])
 		db_manager.delete_dictionary(dictionary_info['dictionary_name'])
 		logger.info('Removed dictionary %s' % dictionary_info['dictionary_name'])
 
@@ -317,7 +336,7 @@ class Dictionaries:
 				
 				self.settings.add_to_history(word)
 		
-		run_in_thread_pool(extract_article, matches)
+		run_in_thread_pool(extract_article, matches, stage='query_xapian')
 		
 		xapian_db.close()
 
@@ -327,17 +346,7 @@ class Dictionaries:
 		return articles
 
 	def _safely_convert_chinese_article(self, article: str) -> str:
-		"""
-		A direct call to convert_chinese() converts things like API references.
-		Now only cache API calls are protected.
-		"""
-		# First replace all API calls with the substitution string, then convert the article, and finally restore the API calls
-		matches = self._re_cache_api.findall(article)
-		article = self._re_cache_api.sub(self._REPLACEMENT_TEXT, article)
-		article = convert_chinese(article, self.settings.preferences['chinese_preference'])
-		for match in matches:
-			article = article.replace(self._REPLACEMENT_TEXT, 'api/cache/%s/%s' % match, 1)
-		return article
+		return convert_chinese_article(article, self.settings.preferences['chinese_preference'])
 
 	def suggestions(self, group_name: str, key: str) -> list[str]:
 		"""
@@ -356,7 +365,9 @@ class Dictionaries:
 			key_simplified = Settings.transform_wildcards(key_simplified)
 			suggestions = db_manager.select_entries_like(key_simplified,
 														 names_dictionaries_of_group,
-														 self.settings.misc_configs['num_suggestions'])
+														 self.settings.misc_configs['num_suggestions'],
+														 self.settings.preferences['substring_index'] == 'trigram',
+														 self.settings.preferences['prefix_index'])
 		else:
 			keys = self._transliterate_key(key_simplified, group_lang)
 
@@ -376,18 +387,37 @@ class Dictionaries:
 			suggestions.extend(db_manager.select_entries_beginning_with(keys,
 															   			names_dictionaries_of_group,
 																		suggestions,
-																		self.settings.misc_configs['num_suggestions']))
+																		self.settings.misc_configs['num_suggestions'],
+																		self.settings.preferences['prefix_index']))
 			
 			if self.settings.preferences['suggestions_mode'] == 'both-sides' and\
 				len(suggestions) < self.settings.misc_configs['num_suggestions']:
-				keys_expanded = []
+				if self.settings.preferences['substring_index'] == 'trigram' and db_manager.trigram_table_exists():
+					for key_simplified in keys:
+						if len(suggestions) >= self.settings.misc_configs['num_suggestions']:
+							break
+						suggestions.extend(db_manager.select_entries_containing(key_simplified,
+																				names_dictionaries_of_group,
+																				suggestions,
+																				self.settings.misc_configs['num_suggestions']))
+				else:
+					keys_expanded = []
+					for key_simplified in keys:
+						keys_expanded.extend(db_manager.expand_key(key_simplified,
+																   self.settings.preferences['ngram_stores_keys'],
+																   names_dictionaries_of_group))
+					suggestions.extend(db_manager.select_entries_with_keys(keys_expanded,
+																		   names_dictionaries_of_group,
+																		   suggestions,
+																		   self.settings.misc_configs['num_suggestions']))
+			if len(suggestions) == 0 and self.settings.preferences['spelling_index']:
+				# Headwords of the dictionaries themselves that are a typo or two away
 				for key_simplified in keys:
-					keys_expanded.extend(db_manager.expand_key(key_simplified,
-															   self.settings.preferences['ngram_stores_keys']))
-				suggestions.extend(db_manager.select_entries_with_keys(keys_expanded,
-														   			   names_dictionaries_of_group,
-																	   suggestions,
-																	   self.settings.misc_configs['num_suggestions']))
+					suggestions = db_manager.select_entries_similar_to(key_simplified,
+																	   names_dictionaries_of_group,
+																	   self.settings.misc_configs['num_suggestions'])
+					if len(suggestions) > 0:
+						break
 			if len(suggestions) == 0:
 				# Now try some spelling suggestions, which is slower than the above
 				suggestions = self.get_spelling_suggestions(group_name, key)
@@ -418,13 +448,24 @@ class Dictionaries:
 		def replace_legacy_lookup_api(match: re.Match) -> str:
 			return 'api/query/%s/%s' % (group_name, match.group(2))
 
+		# Locate all the keys in all the dictionaries of the group at once
+		locations_of_dictionaries = db_manager.get_entries_of_dictionaries(keys, names_dictionaries_of_group)
+
 		def extract_articles_from_dictionary(dictionary_name: str) -> None:
 			nonlocal autoplay_found
-			keys_found = [key for key in keys if db_manager.entry_exists_in_dictionary(key, dictionary_name)]
-			article = self._dictionaries[dictionary_name].get_definitions_by_keys(keys_found)
-			if article:
-				if 'zh' in group_lang:
+			locations_of_keys = locations_of_dictionaries[dictionary_name]
+			locations_of_entries = [locations_of_keys[key] for key in keys if key in locations_of_keys]
+			if self.settings.preferences['render_in_processes']:
+				article = render_pool.get_definitions_by_locations(
+					self._dictionaries[dictionary_name],
+					locations_of_entries,
+					functools.partial(convert_chinese_article, preference=self.settings.preferences['chinese_preference'])
+					if 'zh' in group_lang else None)
+			else:
+				article = self._dictionaries[dictionary_name].get_definitions_by_locations(locations_of_entries)
+				if article and 'zh' in group_lang:
 					article = self._safely_convert_chinese_article(article)
+			if article:
 				article = self._re_legacy_lookup_api.sub(replace_legacy_lookup_api, article)
 				if dictionary_name in transformation.transform.keys():
 					article = transformation.transform[dictionary_name](article)
@@ -443,11 +484,13 @@ class Dictionaries:
 	   					self.settings.display_name_of_dictionary(dictionary_name),
 						article.replace('autoplay', '')))
 
-		run_in_thread_pool(
-			extract_articles_from_dictionary,
-			names_dictionaries_of_group,
-			num_max_workers=len(names_dictionaries_of_group)
-		)
+		if len(locations_of_dictionaries) > 0:
+			run_in_thread_pool(
+				extract_articles_from_dictionary,
+				locations_of_dictionaries.keys(),
+				num_max_workers=len(locations_of_dictionaries),
+				stage='query'
+			)
 
 		if len(articles) > 0:
 			self.settings.add_to_history(key)
@@ -491,7 +534,8 @@ class Dictionaries:
 		run_in_thread_pool(
 			extract_article_from_dictionary,
 			names_dictionaries_of_group,
-			num_max_workers=len(names_dictionaries_of_group)
+			num_max_workers=len(names_dictionaries_of_group),
+			stage='query_anki'
 		)
 
 		# Sort the articles by the order of dictionaries in the group (only the articles are preserved)
@@ -1,14 +1,46 @@
 import abc
+import mmap
+import os
+import shutil
 import unicodedata
+import idzip
+from typing import Any
 from ..settings import Settings
 
 
+class BaseRenderer(abc.ABC):
+	"""
+	Abstract base class for turning the records read from a dictionary into HTML articles.
+	It neither queries the database nor reads the dictionary file, and all its state is picklable,
+	so that it can run in a worker process (see render_pool.py).
+	"""
+	# Incremented when the state changes after loading, so that the copies in worker processes are replaced
+	state_version: int = 0
+
+	def refresh(self) -> None:
+		"""
+		Brings the state up to date with the files it depends on. Called before rendering in the process that loaded
+		the dictionary, also when the rendering itself is done in a worker process.
+		"""
+		pass
+
+	@abc.abstractmethod
+	def render(self, records: list[Any]) -> list[str]:
+		"""
+		:param records: as returned by the reader's get_records_by_locations()
+		:return: the articles, in the order they are to be displayed
+		"""
+		pass
+
+
 class BaseReader(abc.ABC):
 	"""
 	Abstract base class for reading dictionaries.
 	"""
 	_CACHE_ROOT = Settings.CACHE_ROOT
 	_ARTICLE_SEPARATOR = '\n<hr />\n'
+	renderer: BaseRenderer
+	_loaded_content_into_memory: bool = False
 
 	@staticmethod
 	def strip_diacritics(text: str) -> str:
@@ -51,6 +83,59 @@ class BaseReader(abc.ABC):
 		self.name = name
 		self.filename = filename
 		self.display_name = display_name
+		self._mappings: list[mmap.mmap] = []
+
+	def _map_file(self, filename: str, preload: bool) -> mmap.mmap:
+		"""
+		Maps a file read-only. Its pages stay in the OS page cache, shared by all the processes that read the file,
+		instead of being copied into the heap of each. With preload, the OS is asked to read the whole file ahead.
+		"""
+		with open(filename, 'rb') as f:
+			content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		if preload and hasattr(mmap, 'MADV_WILLNEED'):
+			content.madvise(mmap.MADV_WILLNEED)
+		self._mappings.append(content)
+		return content
+
+	def _decompressed_copy_filename(self) -> str:
+		return os.path.join(self._CACHE_ROOT, self.name + '.decompressed')
+
+	def _decompressed_copy(self, filename_dz: str) -> str:
+		"""
+		Returns the path of a decompressed copy of a dictzipped file, to be mapped.
+		The copy carries the modification time of the file and is written again when they differ.
+		"""
+		copy_filename = self._decompressed_copy_filename()
+		time_modified = os.stat(filename_dz).st_mtime_ns
+		if not os.path.isfile(copy_filename) or os.stat(copy_filename).st_mtime_ns != time_modified:
+			temp_filename = f'{copy_filename}.{os.getpid()}.tmp'
+			with idzip.open(filename_dz) as f_dz, open(temp_filename, 'wb') as f:
+				shutil.copyfileobj(f_dz, f, 1 << 24)
+			os.utime(temp_filename, ns=(time_modified, time_modified))
+			os.replace(temp_filename, copy_filename)
+		return copy_filename
+
+	def _remove_decompressed_copy(self) -> None:
+		if os.path.isfile(self._decompressed_copy_filename()):
+			os.remove(self._decompressed_copy_filename())
+
+	def memory_stats(self) -> dict[str, Any]:
+		"""
+		Whether the dictionary is in the group loaded into memory, and how many bytes of it are mapped.
+		The resident part of a mapping is shared with other processes and can be reclaimed by the OS.
+		"""
+		return {
+			'loaded_into_memory': self._loaded_content_into_memory,
+			'access': 'mmap' if self._mappings else 'file',
+			'mapped_bytes': sum(len(mapping) for mapping in self._mappings)
+		}
+
+	def get_resource(self, resource_filename: str) -> bytes | None:
+		"""
+		:param resource_filename: the path of a resource relative to the dictionary's cache directory
+		:return: the resource, for those not extracted to the cache directory, or None if there is no such resource.
+		"""
+		return None
 
 	@abc.abstractmethod
 	def get_definition_by_key(self, entry: str) -> str:
@@ -60,6 +145,29 @@ class BaseReader(abc.ABC):
 		"""
 		pass
 
+	@abc.abstractmethod
+	def get_records_by_locations(self, locations: list[tuple[str, int, int]]) -> list[Any]:
+		"""
+		:param locations: the (word, offset, size) of the entries to look up, as stored in the database
+		:return: the raw records of these entries, to be rendered by self.renderer.
+		"""
+		pass
+
+	def get_definition_by_locations(self, locations: list[tuple[str, int, int]]) -> str:
+		"""
+		:param locations: the (word, offset, size) of the entries to look up, as stored in the database
+		:return: the definition made up of these entries.
+		"""
+		return self._ARTICLE_SEPARATOR.join(self.renderer.render(self.get_records_by_locations(locations)))
+
+	def get_definitions_by_locations(self, locations_of_entries: list[list[tuple[str, int, int]]]) -> str:
+		"""
+		:param locations_of_entries: the locations of each entry, e.g. as fetched by db_manager.get_entries_of_dictionaries()
+		:return: the definitions of the given entries.
+		"""
+		return self._ARTICLE_SEPARATOR.join([self.get_definition_by_locations(locations)
+											 for locations in locations_of_entries])
+
 	def get_definitions_by_keys(self, entries: list[str]) -> list[str]:
 		"""
 		:param entries: the entries to look up, must be simplified
@@ -3,6 +3,7 @@ import shutil
 import concurrent.futures
 from zipfile import ZipFile
 from ...utils import run_in_thread_pool
+from ..base_reader import BaseRenderer
 import logging
 
 logger = logging.getLogger(__name__)
@@ -76,7 +77,7 @@ except ImportError:
 	def make_a_href(s: str, href_root: str) -> str:
 		return f'<a href={quoteattr(href_root + s)}>{escape(s)}</a>'
 
-class DSLConverter:
+class DSLConverter(BaseRenderer):
 	if not dsl_module_found:
 		re_brackets_blocks = re.compile(r'\{\{[^}]*\}\}')
 		re_lang_open = re.compile(r'(?<!\\)\[lang[^\]]*\]')
@@ -269,7 +270,8 @@ class DSLConverter:
 					zip_file.extract,
 					files_to_be_extracted,
 					[self._resources_dir] * len(files_to_be_extracted),
-					num_max_workers=len(files_to_be_extracted)
+					num_max_workers=len(files_to_be_extracted),
+					stage='extract_dsl_resources'
 				)
 
 	def convert(self, record: tuple[str, str, int]) -> tuple[str, int]:
@@ -286,3 +288,8 @@ class DSLConverter:
 			text, files_to_be_extracted = self._clean_html('\n'.join(definition_html))
 		self._extract_files(files_to_be_extracted)
 		return '<h3 class="headword">%s</h3>' % headword + text, offset_in_dsl
+
+	def render(self, records: list[tuple[str, str, int]]) -> list[str]:
+		# DSL parsing is expensive, so we'd better parallelise it
+		articles = run_in_thread_pool(self.convert, records, num_max_workers=len(records), stage='convert_dsl')
+		return [article[0] for article in sorted(articles, key=lambda article: article[1])]
@@ -8,6 +8,7 @@ import concurrent.futures
 from .base_reader import BaseReader
 from .dsl import DSLConverter
 from .. import db_manager
+from ..block_cache import open_idzip
 from ..utils import run_in_thread_pool
 import logging
 
@@ -111,7 +112,6 @@ class DSLReader(BaseReader):
 			# !!! Back up before transformation
 			shutil.copyfile(filename, filename + '.old')
 			from idzip.command import _compress as idzip_compress, _decompress as idzip_decompress
-			db_manager.drop_index()
 			if is_compressed:
 				idzip_decompress(filename, Options)
 				# filename_no_extension is name.dsl
@@ -123,7 +123,7 @@ class DSLReader(BaseReader):
 				if performs_cleanup:
 					self._clean_up(filename)
 				f = open(filename, 'r', encoding='utf-8')
-			with f:
+			with f, db_manager.EntrySink(self.name) as sink:
 				headwords = []
 				while True:
 					offset = f.tell()
@@ -167,10 +167,8 @@ class DSLReader(BaseReader):
 						# print('#', content_end_offset, '\n##', f.tell(), '\nEND CONTENT')
 						size = content_end_offset - offset
 						for headword in headwords:
-							db_manager.add_entry(self.simplify(headword), self.name, headword, offset, size)
+							sink.add(self.simplify(headword), headword, offset, size)
 						headwords.clear()
-			db_manager.commit_new_entries(self.name)
-			db_manager.create_index()
 			logger.info(f'Entries of dictionary {self.name} added to database')
 			# Whether compressed originally or not, we need to compress it now
 			if is_compressed:
@@ -189,11 +187,13 @@ class DSLReader(BaseReader):
 								 	   self.name,
 									   os.path.join(self._CACHE_ROOT, self.name),
 									   extract_resources)
+		self.renderer = self._converter
 
 		self._loaded_content_into_memory = load_content_into_memory
 		if load_content_into_memory:
-			with idzip.open(self.filename) as f:
-				self._content = f.read()
+			self._content = self._map_file(self._decompressed_copy(self.filename), preload=True)
+		else:
+			self._remove_decompressed_copy()
 
 		if extract_resources:
 			from zipfile import ZipFile
@@ -219,7 +219,8 @@ class DSLReader(BaseReader):
 		return data.decode('utf-8')
 
 	def _get_record_from_cache(self, offset: int, size: int) -> str:
-		return self._content[offset:offset+size].decode('utf-8')
+		# Decoded straight from the mapping, without copying the bytes first
+		return str(memoryview(self._content)[offset:offset+size], 'utf-8')
 
 	def _get_records_in_batch(self, locations: list[tuple[str, int, int]]) -> list[tuple[str, str, int]]:
 		"""
@@ -242,26 +243,22 @@ class DSLReader(BaseReader):
 					)
 				),
 				locations,
-				num_max_workers=len(locations)
+				num_max_workers=len(locations),
+				stage='read_dsl_records'
 			)
 		else:
-			with idzip.open(self.filename) as f:
+			with open_idzip(self.filename) as f:
 				for word, offset, size in locations:
 					records.append((self._get_record(f, offset, size), word, offset))
 		return records
 
 	def get_definition_by_key(self, entry: str) -> str:
-		locations = db_manager.get_entries(entry, self.name)
-		records = self._get_records_in_batch(locations)
-		# records = [self._converter.convert(*record) for record in records]
-		# DSL parsing is expensive, so we'd better parallelise it
-		records = run_in_thread_pool(self._converter.convert, records, num_max_workers=len(records))
-		articles = [record[0] for record in sorted(records, key=lambda article: article[1])]
-		return self._ARTICLE_SEPARATOR.join(articles)
+		return self.get_definition_by_locations(db_manager.get_entries(entry, self.name))
+
+	def get_records_by_locations(self, locations: list[tuple[str, int, int]]) -> list[tuple[str, str, int]]:
+		return self._get_records_in_batch(locations)
 
 	def get_definition_by_word(self, headword: str) -> str:
 		locations = db_manager.get_entries_with_headword(headword, self.name)
 		records = self._get_records_in_batch([(headword, *location) for location in locations])
-		records = run_in_thread_pool(self._converter.convert, records, num_max_workers=len(records))
-		articles = [record[0] for record in records] # order shouldn't matter here
-		return self._ARTICLE_SEPARATOR.join(articles)
+		return self._ARTICLE_SEPARATOR.join(self.renderer.render(records))
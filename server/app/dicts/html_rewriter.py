@@ -0,0 +1,81 @@
+"""
+Rewrites the tags of an article in one scan, appending the pieces to a list joined at the end.
+The HTML cleaners used to make a pass per rule, each slicing the whole article at every match,
+which is quadratic in the size of link-heavy articles.
+"""
+import re
+from html import unescape
+from typing import Callable
+
+_re_tag = re.compile(r'<([A-Za-z][^\s/>]*)[^>]*>')
+_re_markup = re.compile(r'<!--.*?-->|<[A-Za-z/!?][^>]*>', re.DOTALL)
+
+
+def _attribute_span(tag: str, attribute: str) -> tuple[int, int] | None:
+	marker = f' {attribute}="'
+	start = tag.find(marker)
+	if start == -1:
+		return None
+	start += len(marker)
+	end = tag.find('"', start)
+	return start, end if end != -1 else len(tag)
+
+
+def attribute_value(tag: str, attribute: str) -> str | None:
+	"""
+	Returns the double-quoted value of the attribute, or None if the tag does not have it.
+	"""
+	span = _attribute_span(tag, attribute)
+	return tag[span[0]:span[1]] if span is not None else None
+
+
+def rewrite_attribute(tag: str, attribute: str, rewrite_value: Callable[[str], str]) -> str:
+	"""
+	Returns the tag with the double-quoted value of the attribute rewritten, or as it is if it does not have it.
+	"""
+	span = _attribute_span(tag, attribute)
+	if span is None:
+		return tag
+	start, end = span
+	return tag[:start] + rewrite_value(tag[start:end]) + tag[end:]
+
+
+def text_of(html: str) -> str:
+	"""
+	The text of an HTML fragment: without tags and comments, character references resolved.
+	"""
+	if '<' not in html and '&' not in html:
+		return html
+	return unescape(_re_markup.sub('', html))
+
+
+def rewrite(html: str,
+			rewrite_tag: Callable[[str, str, int], str],
+			rewrite_anchor: Callable[[str, str], str] | None = None) -> str:
+	"""
+	:param rewrite_tag: (name, tag, position of the tag in html) -> the tag rewritten, called for each start tag in order
+	:param rewrite_anchor: (start tag rewritten, text) -> the element rewritten. If given, the markup inside each
+	<a> element is dropped, keeping the text, and the element is rewritten as a whole.
+	"""
+	buf = []
+	position = 0 # html before it is in buf
+	for m in _re_tag.finditer(html):
+		if m.start() < position:
+			# Inside an anchor flattened
+			continue
+		name = m.group(1)
+		tag = m.group()
+		new_tag = rewrite_tag(name, tag, m.start())
+		if rewrite_anchor is not None and name == 'a'\
+			and (closing_tag_position := html.find('</a>', m.end())) != -1:
+			buf.append(html[position:m.start()])
+			buf.append(rewrite_anchor(new_tag, text_of(html[m.end():closing_tag_position])))
+			position = closing_tag_position + len('</a>')
+		elif new_tag != tag:
+			buf.append(html[position:m.start()])
+			buf.append(new_tag)
+			position = m.end()
+	if position == 0:
+		return html
+	buf.append(html[position:])
+	return ''.join(buf)
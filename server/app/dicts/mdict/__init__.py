@@ -1,3 +1,5 @@
 from .readmdict import MDD, MDX
+from .mdx_index import MDXIndex
+from .resource_index import ResourceIndex
 from .html_cleaner import HTMLCleaner
 from . import lzo
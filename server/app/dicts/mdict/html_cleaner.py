@@ -1,32 +1,38 @@
-import inspect
 import os
 import re
 import shutil
+import threading
+import time
 from pathlib import Path
-from html.parser import HTMLParser
 from ... import utils
+from .. import html_rewriter
+from ..base_reader import BaseRenderer
+from .resource_index import ResourceIndex
 
 
-class HTMLCleaner:
-	class _Concatenator(HTMLParser):
-		def __init__(self) -> None:
-			super().__init__()
-			self._buf = []
-		
-		def handle_data(self, data: str) -> None:
-			self._buf.append(data)
-		
-		def get_text(self) -> str:
-			return ''.join(self._buf)
-
+class HTMLCleaner(BaseRenderer):
 	_re_non_printing_chars = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]')
 	_re_compact_html_index = re.compile(r'`(\d+)`')
 	_re_single_quotes = re.compile(r"=\'([^']*)\'(?=[ >])")
+	_LINKED_FILE_EXTENSIONS = ('.css', '.js')
+	_LINKED_FILES_CHECK_INTERVAL = 1 # seconds
 
-	def __init__(self, filename: str, dict_name: str, resources_dir: str, styles: str = '') -> None:
+	def __init__(self, filename: str, dict_name: str, resources_dir: str, styles: str = '', resource_index_filename: str = '') -> None:
 		self._filename = filename
 		self._id = f'#{dict_name}'
 		self._resources_dir = resources_dir
+		self._resource_index_filename = resource_index_filename
+		self._resource_index: ResourceIndex | None | bool = False # not loaded yet
+		# Case-folded name -> name in the resources directory, of the stylesheets and scripts
+		self._linked_files: dict[str, str] = dict()
+		# Modification times of what the map was built from, see _linked_files_signature()
+		self._linked_files_directories: list[str] = []
+		self._linked_files_beside: list[str] = []
+		self._linked_files_signature_indexed: tuple[int, ...] | None = None
+		self._linked_files_time_checked = 0.0
+		# Held while the map is rebuilt in the background. Copies in render-pool workers leave that to the original.
+		self._lock_linked_files = threading.Lock()
+		self._refreshes_linked_files = True
 		self._href_root_dir = 'api/cache/' + dict_name + '/'
 		self._lookup_url_root = 'api/lookup/' + dict_name + '/'
 		self._has_styles = False
@@ -41,6 +47,26 @@ class HTMLCleaner:
 				else:
 					self._compact_html_rules[index] = (prefix, line)
 
+	def __getstate__(self) -> dict:
+		# The mapped index is loaded again where the cleaner is unpickled
+		state = self.__dict__.copy()
+		state['_resource_index'] = False
+		del state['_lock_linked_files']
+		state['_refreshes_linked_files'] = False
+		return state
+
+	def __setstate__(self, state: dict) -> None:
+		self.__dict__.update(state)
+		self._lock_linked_files = threading.Lock()
+
+	def _resource_exists(self, resource_filename: str) -> bool:
+		if os.path.isfile(os.path.join(self._resources_dir, resource_filename)):
+			return True
+		if self._resource_index is False:
+			self._resource_index = ResourceIndex.load(self._resource_index_filename)\
+				if self._resource_index_filename else None
+		return self._resource_index is not None and self._resource_index.locate(resource_filename) is not None
+
 	def _expand_compact_html(self, compact_html: str) -> str:
 		buf = []
 		pos = 0
@@ -61,67 +87,102 @@ class HTMLCleaner:
 	def _convert_single_quotes_to_double(self, html: str) -> str:
 		return self._re_single_quotes.sub('="\\1"', html)
 
+	def index_linked_files(self) -> None:
+		"""
+		Maps the case-folded names of the stylesheets and scripts in the resources directory to their actual names,
+		so that links to them are fixed without touching the file system. Those beside the dictionary file
+		are copied into the resources directory first, unless the copy there is newer.
+		To be called once the resources are in place; the map is then rebuilt when they change (see refresh()).
+		"""
+		linked_files: dict[str, str] = dict()
+		directories = {self._resources_dir, os.path.dirname(self._filename)}
+		for directory, subdirectories, filenames in os.walk(self._resources_dir):
+			for filename in filenames:
+				if os.path.splitext(filename)[1].lower() in self._LINKED_FILE_EXTENSIONS:
+					name = os.path.relpath(os.path.join(directory, filename), self._resources_dir).replace(os.sep, '/')
+					linked_files[name.casefold()] = name
+					directories.add(directory)
+		files_beside = []
+		for entry in os.scandir(os.path.dirname(self._filename)):
+			if os.path.splitext(entry.name)[1].lower() in self._LINKED_FILE_EXTENSIONS and entry.is_file():
+				name = linked_files.setdefault(entry.name.casefold(), entry.name)
+				new_filename = os.path.join(self._resources_dir, name)
+				if not os.path.isfile(new_filename) or entry.stat().st_mtime > os.path.getmtime(new_filename):
+					Path(self._resources_dir).mkdir(parents=True, exist_ok=True)
+					shutil.copy(entry.path, new_filename)
+				files_beside.append(entry.path)
+		self._linked_files = linked_files
+		self._linked_files_directories = sorted(directories)
+		self._linked_files_beside = files_beside
+		self._linked_files_signature_indexed = self._linked_files_signature()
+		self._linked_files_time_checked = time.monotonic()
+
+	def _linked_files_signature(self) -> tuple[int, ...] | None:
+		"""
+		The modification times of the directories holding the stylesheets and scripts, which change when files
+		are added, removed or renamed, and of those beside the dictionary file, which may be overwritten in place.
+		"""
+		try:
+			return tuple(os.stat(path).st_mtime_ns for path in self._linked_files_directories + self._linked_files_beside)
+		except OSError:
+			return None
+
+	def refresh(self) -> None:
+		"""
+		Starts rebuilding the map in the background if the files have changed. Rendering goes on with the current map,
+		which is replaced as a whole once the new one is ready.
+		"""
+		if not self._refreshes_linked_files\
+			or time.monotonic() - self._linked_files_time_checked < self._LINKED_FILES_CHECK_INTERVAL:
+			return
+		self._linked_files_time_checked = time.monotonic()
+		if self._linked_files_signature() == self._linked_files_signature_indexed\
+			or not self._lock_linked_files.acquire(blocking=False):
+			return
+
+		def reindex() -> None:
+			try:
+				self.index_linked_files()
+				self.isolate_css()
+				self.state_version += 1
+			finally:
+				self._lock_linked_files.release()
+
+		threading.Thread(target=reindex, name='linked-files-indexer', daemon=True).start()
+
 	def _fix_file_path(self, definition_html: str, file_extension: str) -> str:
+		buf = []
+		position = 0
 		extension_position = 0
 		while (extension_position := definition_html.find(file_extension, extension_position)) != -1:
+			extension_position += len(file_extension)
 			filename_position = definition_html.rfind('"', 0, extension_position) + 1
-			filename = definition_html[filename_position:extension_position + len(file_extension)]
+			if filename_position < position:
+				continue
+			name = self._linked_files.get(definition_html[filename_position:extension_position].casefold())
+			if name is not None:
+				buf.append(definition_html[position:filename_position])
+				buf.append(self._href_root_dir)
+				buf.append(name)
+				position = extension_position
+		if len(buf) > 0:
+			buf.append(definition_html[position:])
+			return ''.join(buf)
+		else:
+			return definition_html
 
-			# Check if `Path.glob` supports the `case_sensitive` argument
-			if inspect.signature(Path.glob).parameters.get('case_sensitive'):
-				kwargs = {'case_sensitive': False}
-			else:
-				kwargs = {}
-
-			file_path_on_disk = next(Path(os.path.dirname(self._filename)).glob(filename, **kwargs), '')
-			new_file_path_on_disk = next(Path(self._resources_dir).glob(filename, **kwargs), '')
-			fixed_filename = filename
-			if new_file_path_on_disk:
-				fixed_filename = str(new_file_path_on_disk.relative_to(Path(self._resources_dir)))
-			elif file_path_on_disk:
-				fixed_filename = str(file_path_on_disk.relative_to(Path(os.path.dirname(self._filename))))
-			if not os.path.isfile(new_file_path_on_disk):
-				if os.path.isfile(file_path_on_disk):
-					Path(self._resources_dir).mkdir(parents=True, exist_ok=True)
-					shutil.copy(file_path_on_disk, new_file_path_on_disk)
-					definition_html = definition_html[:filename_position] + \
-						self._href_root_dir + fixed_filename + \
-						definition_html[filename_position+len(filename):]
-			else:
-				if os.path.isfile(file_path_on_disk):
-					if os.path.getmtime(file_path_on_disk) > os.path.getmtime(new_file_path_on_disk):
-						shutil.copy(file_path_on_disk, new_file_path_on_disk)
-				definition_html = definition_html[:filename_position] + \
-					self._href_root_dir + fixed_filename + \
-					definition_html[filename_position+len(filename):]
-			extension_position += len(file_extension)
-		return definition_html
-	
-	def _isolate_css(self) -> None:
-		for filename in os.listdir(self._resources_dir):
-			if filename.endswith('.css') or filename.endswith('.CSS'):
-				utils.isolate_css(os.path.join(self._resources_dir, filename), self._id)
+	def isolate_css(self) -> None:
+		"""
+		Isolates the stylesheets in the resources directory, to be called once they are in place.
+		"""
+		utils.isolate_css_files(self._resources_dir, self._id, self._resources_dir + '.css_manifest')
+		# Isolating replaces the stylesheets, which is no change to the linked files
+		self._linked_files_signature_indexed = self._linked_files_signature()
 
 	def _fix_internal_href(self, definition_html: str) -> str:
 		# That is, links like entry://#81305a5747ca42b28f2b50de9b762963_nav2
 		return definition_html.replace('entry://#', '#')
 
-	def _flatten_nested_a(self, definition_html: str) -> str:
-		# Sometimes there're multiple inner elements inside the <a> element, which should be removed
-		# For example, in my Fr-En En-Fr Collins Dictionary, there's a <span> element inside the <a> element
-		# The text within the <span> should be preserved, though
-		# <a class="ref" href="/lookup/collinse22f/badly" title="Translation of badly"><span class="orth">badly</span></a>
-		a_closing_tag_pos = 0
-		while (a_tag_start_pos := definition_html.find('<a', a_closing_tag_pos)) != -1:
-			a_tag_end_pos = definition_html.find('>', a_tag_start_pos)
-			a_closing_tag_pos = definition_html.find('</a>', a_tag_end_pos)
-			a_inner_html = definition_html[a_tag_end_pos+1:a_closing_tag_pos]
-			concatenator = self._Concatenator()
-			concatenator.feed(a_inner_html)
-			a_inner_text = concatenator.get_text()
-			definition_html = definition_html[:a_tag_end_pos+1] + a_inner_text + definition_html[a_closing_tag_pos:]
-		return definition_html
-
 	def _fix_entry_cross_ref(self, definition_html: str) -> str:
 		if definition_html.startswith('@@@LINK='): # strange special case
 			last_non_whitespace_position = len(definition_html) - 1
@@ -130,48 +191,41 @@ class HTMLCleaner:
 			entry_linked = definition_html[len('@@@LINK='):last_non_whitespace_position+1]
 			return f'<a href="{self._lookup_url_root + entry_linked}">{entry_linked}</a>'
 		else:
-			definition_html = definition_html.replace('entry://', self._lookup_url_root)
-			return self._flatten_nested_a(definition_html)
-
-	def _fix_sound_link(self, definition_html: str) -> str:
-		# Use HTML sound element instead of the original <a> element, which looks like this:
-		# <a class="hwd_sound sound audio_play_button icon-volume-up ptr fa fa-volume-up" data-lang="en_GB" data-src-mp3="https://www.collinsdictionary.com/sounds/hwd_sounds/EN-GB-W0020530.mp3" href="sound://audio/ef/7650.mp3" title="Pronunciation for "><img class="soundpng" src="api/cache/collinse22f/img/sound.png"></a>
+			return definition_html.replace('entry://', self._lookup_url_root)
+
+	def _rewrite_tags(self, definition_html: str) -> str:
+		"""
+		In a single scan:
+		- Sometimes there're multiple inner elements inside the <a> element, which should be removed.
+		For example, in my Fr-En En-Fr Collins Dictionary, there's a <span> element inside the <a> element.
+		The text within the <span> should be preserved, though:
+		<a class="ref" href="/lookup/collinse22f/badly" title="Translation of badly"><span class="orth">badly</span></a>
+		- Use HTML sound element instead of the original <a> element, which looks like this:
+		<a class="hwd_sound sound audio_play_button icon-volume-up ptr fa fa-volume-up" data-lang="en_GB" data-src-mp3="https://www.collinsdictionary.com/sounds/hwd_sounds/EN-GB-W0020530.mp3" href="sound://audio/ef/7650.mp3" title="Pronunciation for "><img class="soundpng" src="api/cache/collinse22f/img/sound.png"></a>
+		The first sound found plays automatically.
+		- Images are served from the cache directory.
+		"""
 		autoplay_string = 'autoplay'
-		sound_element_template = '<audio controls %s src="%s">%s</audio>'
-		not_found_fallback = '<span>%s</span>'
-		while (sound_link_start_pos := definition_html.find('sound://')) != -1:
-			sound_link_end_pos = definition_html.find('"', sound_link_start_pos)
-			original_sound_link = definition_html[sound_link_start_pos:sound_link_end_pos]
-			sound_link = original_sound_link.replace('sound://', self._href_root_dir)
-			sound_path = os.path.join(self._resources_dir, sound_link[len(self._href_root_dir):])
-
-			inner_html_start_pos = definition_html.find('>', sound_link_end_pos) + 1
-			inner_html_end_pos = definition_html.find('</a>', inner_html_start_pos)
-			inner_html = definition_html[inner_html_start_pos:inner_html_end_pos]
-			outer_html_start_pos = definition_html.rfind('<a', 0, sound_link_start_pos)
-			outer_html_end_pos = definition_html.find('</a>', inner_html_end_pos) + len('</a>')
-
-			if os.path.isfile(sound_path):
-				sound_html = sound_element_template % (autoplay_string, sound_link, inner_html)
+
+		def rewrite_tag(name: str, tag: str, position: int) -> str:
+			if name == 'img':
+				return html_rewriter.rewrite_attribute(tag, 'src', lambda src: self._href_root_dir + src.replace('file://', ''))
+			return tag
+
+		def rewrite_anchor(start_tag: str, text: str) -> str:
+			nonlocal autoplay_string
+			if (sound_link_start_pos := start_tag.find('sound://')) == -1:
+				return f'{start_tag}{text}</a>'
+			sound_link_end_pos = start_tag.find('"', sound_link_start_pos)
+			sound_link = start_tag[sound_link_start_pos:sound_link_end_pos].replace('sound://', self._href_root_dir)
+			if self._resource_exists(sound_link[len(self._href_root_dir):]):
+				sound_html = f'<audio controls {autoplay_string} src="{sound_link}">{text}</audio>'
 				autoplay_string = ''
+				return sound_html
 			else:
-				sound_html = not_found_fallback % inner_html
-
-			definition_html = definition_html[:outer_html_start_pos] + sound_html +\
-				definition_html[outer_html_end_pos:]
+				return f'<span>{text}</span>'
 
-		return definition_html
-
-	def _fix_img_src(self, definition_html: str) -> str:
-		img_tag_end_pos = 0
-		while (img_tag_start_pos := definition_html.find('<img', img_tag_end_pos)) != -1:
-			img_tag_end_pos = definition_html.find('>', img_tag_start_pos)
-			img_src_start_pos = definition_html.find(' src="', img_tag_start_pos, img_tag_end_pos) + len(' src="')
-			img_src_end_pos = definition_html.find('"', img_src_start_pos, img_tag_end_pos)
-			img_src = definition_html[img_src_start_pos:img_src_end_pos]
-			img_src = self._href_root_dir + img_src.replace('file://', '')
-			definition_html = definition_html[:img_src_start_pos] + img_src + definition_html[img_src_end_pos:]
-		return definition_html
+		return html_rewriter.rewrite(definition_html, rewrite_tag, rewrite_anchor)
 
 	def clean(self, definition_html: str) -> str:
 		definition_html = self._re_non_printing_chars.sub('', definition_html)
@@ -179,10 +233,12 @@ class HTMLCleaner:
 			definition_html = self._expand_compact_html(definition_html)
 		definition_html = self._convert_single_quotes_to_double(definition_html)
 		definition_html = self._fix_file_path(definition_html, '.css')
-		self._isolate_css()
 		definition_html = self._fix_file_path(definition_html, '.js')
 		definition_html = self._fix_internal_href(definition_html)
 		definition_html = self._fix_entry_cross_ref(definition_html)
-		definition_html = self._fix_sound_link(definition_html)
-		definition_html = self._fix_img_src(definition_html)
-		return definition_html
+		return self._rewrite_tags(definition_html)
+
+	def render(self, records: list[str]) -> list[str]:
+		self.refresh()
+		# Cleaning up HTML actually takes some time to complete
+		return utils.run_in_thread_pool(self.clean, records, num_max_workers=len(records), stage='clean_html')
@@ -0,0 +1,247 @@
+import bisect
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from typing import BinaryIO
+try:
+	import lzo
+	lzo_is_c = True
+except ImportError:
+	from . import lzo
+	lzo_is_c = False
+from .readmdict import MDict
+from ...block_cache import block_cache
+
+
+class MDXIndex:
+	"""
+	What looking up records in an MDX takes, read once from the MDX and kept in a sidecar file:
+	the header, the encoding, the engine version, the encryption key and the record block table.
+	The table has three columns: the offset at which each block starts once decompressed
+	(followed by the total decompressed size), the position of each compressed block in the file and its size.
+	Layout: header struct, the key/value pairs of the MDX header, the encoding, the encryption key, padding,
+	then the three columns as native 64-bit integers, which are mapped and used as they are,
+	so loading does not depend on the number of blocks.
+	The MDX file's size and modification time are recorded to tell when the sidecar is stale.
+	"""
+	_MAGIC = b'SDMX'
+	_VERSION = 1
+	_BYTEORDER = {'little': 1, 'big': 2}[sys.byteorder]
+	# magic, version, byte order, MDX engine version, MDX size, MDX modification time, number of header pairs,
+	# length of the encoding, length of the encryption key (-1 if none), number of blocks
+	_HEADER = struct.Struct('=4sBBxxdQqIIiQ')
+	_LENGTH = struct.Struct('=I')
+
+	@staticmethod
+	def _read_record_block_table(mdx: MDict) -> tuple[array, array, array]:
+		decompressed_offsets = array('Q', [0])
+		compressed_offsets = array('Q')
+		compressed_sizes = array('Q')
+		with open(mdx._fname, 'rb') as f:
+			f.seek(mdx._record_block_offset)
+			if mdx._version >= 3:
+				# Each block is preceded by its sizes
+				num_record_blocks = mdx._read_int32(f)
+				for i in range(num_record_blocks):
+					decompressed_size = mdx._read_int32(f)
+					compressed_size = mdx._read_int32(f)
+					decompressed_offsets.append(decompressed_offsets[-1] + decompressed_size)
+					compressed_offsets.append(f.tell())
+					compressed_sizes.append(compressed_size)
+					f.seek(compressed_size, 1)
+			else:
+				# The sizes of all the blocks come first, then the blocks
+				num_record_blocks = mdx._read_number(f)
+				num_entries = mdx._read_number(f)
+				assert (num_entries == mdx._num_entries)
+				record_block_info_size = mdx._read_number(f)
+				mdx._read_number(f)
+				compressed_offset = f.tell() + record_block_info_size
+				for i in range(num_record_blocks):
+					compressed_size = mdx._read_number(f)
+					decompressed_size = mdx._read_number(f)
+					decompressed_offsets.append(decompressed_offsets[-1] + decompressed_size)
+					compressed_offsets.append(compressed_offset)
+					compressed_sizes.append(compressed_size)
+					compressed_offset += compressed_size
+		return decompressed_offsets, compressed_offsets, compressed_sizes
+
+	@classmethod
+	def write(cls, filename: str, mdx: MDict) -> None:
+		decompressed_offsets, compressed_offsets, compressed_sizes = cls._read_record_block_table(mdx)
+		stat = os.stat(mdx._fname)
+		encoding = mdx._encoding.encode('utf-8')
+		encrypted_key = mdx._encrypted_key or b''
+		temp_filename = f'{filename}.{os.getpid()}.tmp'
+		with open(temp_filename, 'wb') as f:
+			f.write(cls._HEADER.pack(cls._MAGIC,
+									 cls._VERSION,
+									 cls._BYTEORDER,
+									 mdx._version,
+									 stat.st_size,
+									 stat.st_mtime_ns,
+									 len(mdx.header),
+									 len(encoding),
+									 -1 if mdx._encrypted_key is None else len(encrypted_key),
+									 len(compressed_offsets)))
+			for key, value in mdx.header.items():
+				f.write(cls._LENGTH.pack(len(key)) + key + cls._LENGTH.pack(len(value)) + value)
+			f.write(encoding)
+			f.write(encrypted_key)
+			f.write(b'\0' * (-f.tell() % 8))
+			f.write(decompressed_offsets.tobytes())
+			f.write(compressed_offsets.tobytes())
+			f.write(compressed_sizes.tobytes())
+		os.replace(temp_filename, filename)
+
+	@classmethod
+	def load(cls, filename: str, filename_mdx: str) -> 'MDXIndex | None':
+		"""
+		Returns None if the sidecar is missing, of another format, older than the MDX file, or damaged
+		(e.g. cut short by a full disk), so that it is written again.
+		"""
+		if not os.path.isfile(filename) or os.path.getsize(filename) < cls._HEADER.size:
+			return None
+		with open(filename, 'rb') as f:
+			content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, version, byteorder, mdx_version, mdx_size, mdx_time_modified, num_header_pairs, encoding_length,\
+			encrypted_key_length, num_record_blocks = cls._HEADER.unpack_from(content)
+		stat = os.stat(filename_mdx)
+		if magic != cls._MAGIC or version != cls._VERSION or byteorder != cls._BYTEORDER\
+			or mdx_size != stat.st_size or mdx_time_modified != stat.st_mtime_ns:
+			content.close()
+			return None
+		try:
+			return cls(filename_mdx, content, mdx_version, num_header_pairs, encoding_length, encrypted_key_length,
+					   num_record_blocks)
+		except (struct.error, ValueError):
+			content.close()
+			return None
+
+	def __init__(self,
+				 filename_mdx: str,
+				 content: mmap.mmap,
+				 mdx_version: float,
+				 num_header_pairs: int,
+				 encoding_length: int,
+				 encrypted_key_length: int,
+				 num_record_blocks: int) -> None:
+		self._fname = filename_mdx
+		self._version = mdx_version
+		stat = os.stat(filename_mdx)
+		self._block_cache_key = (filename_mdx, stat.st_mtime_ns, stat.st_size)
+		position = self._HEADER.size
+		self.header: dict[bytes, bytes] = dict()
+		for i in range(num_header_pairs):
+			key_length, = self._LENGTH.unpack_from(content, position)
+			key = content[position + 4:position + 4 + key_length]
+			position += 4 + key_length
+			value_length, = self._LENGTH.unpack_from(content, position)
+			self.header[key] = content[position + 4:position + 4 + value_length]
+			position += 4 + value_length
+		self._encoding = content[position:position + encoding_length].decode('utf-8')
+		position += encoding_length
+		if encrypted_key_length < 0:
+			self._encrypted_key = None
+		else:
+			self._encrypted_key = content[position:position + encrypted_key_length]
+			position += encrypted_key_length
+		position += -position % 8
+		if position + 8 * (3 * num_record_blocks + 1) > len(content):
+			raise ValueError('Record block table cut short')
+		columns = memoryview(content)[position:position + 8 * (3 * num_record_blocks + 1)].cast('Q')
+		self.record_block_table = (columns[:num_record_blocks + 1],
+								   columns[num_record_blocks + 1:2 * num_record_blocks + 1],
+								   columns[2 * num_record_blocks + 1:])
+
+	def block_of(self, offset: int) -> int:
+		"""
+		Returns the number of the block containing the decompressed offset.
+		"""
+		decompressed_offsets, compressed_offsets, compressed_sizes = self.record_block_table
+		return min(bisect.bisect_right(decompressed_offsets, offset), len(compressed_offsets)) - 1
+
+	def _locate_record_block(self, offset: int) -> tuple[int, int, int, int]:
+		"""
+		Returns the position and size of the compressed block containing the decompressed offset,
+		and the decompressed offset and size of the block.
+		"""
+		decompressed_offsets, compressed_offsets, compressed_sizes = self.record_block_table
+		i = self.block_of(offset)
+		return compressed_offsets[i],\
+			compressed_sizes[i],\
+			decompressed_offsets[i],\
+			decompressed_offsets[i + 1] - decompressed_offsets[i]
+
+	@staticmethod
+	def _decode_record_block_v1v2(block_compressed: bytes, decompressed_size: int) -> bytes:
+		block_type = block_compressed[:4]
+		adler32 = struct.unpack('>I', block_compressed[4:8])[0]
+		# no compression
+		if block_type == b'\x00\x00\x00\x00':
+			record_block = block_compressed[8:]
+		# lzo compression
+		elif block_type == b'\x01\x00\x00\x00':
+			# LZO compression is used for engine version < 2.0
+			if lzo_is_c:
+				header = b'\xf0' + struct.pack('>I', decompressed_size)
+				record_block = lzo.decompress(header + block_compressed[8:])
+			else:
+				record_block = lzo.decompress(block_compressed[8:], initSize=decompressed_size, blockSize=1308672)
+		# zlib compression
+		elif block_type == b'\x02\x00\x00\x00':
+			# decompress
+			record_block = zlib.decompress(block_compressed[8:])
+		# notice that adler32 return signed value
+		assert (adler32 == zlib.adler32(record_block) & 0xffffffff)
+		assert (len(record_block) == decompressed_size)
+		return record_block
+
+	def _decode_record_block(self, block_compressed: bytes, decompressed_size: int) -> bytes:
+		if self._version >= 3:
+			# MDX._decode_block() only needs the engine version and the encryption key, both of which are here
+			return MDict._decode_block(self, block_compressed, decompressed_size)
+		else:
+			return self._decode_record_block_v1v2(block_compressed, decompressed_size)
+
+	@staticmethod
+	def _slice_record(record_block: bytes, record_start: int, length: int) -> bytes:
+		if length > 0:
+			return record_block[record_start:record_start + length]
+		else:
+			return record_block[record_start:]
+
+	def read_record(self, content: mmap.mmap | BinaryIO, offset: int, length: int) -> bytes:
+		"""
+		Returns the record at the given decompressed offset, up to the end of its block if length is -1.
+		:param content: the file, either mapped or opened by the calling thread
+		"""
+		compressed_offset, compressed_size, decompressed_offset, decompressed_size = self._locate_record_block(offset)
+		block_key = (self._block_cache_key, compressed_offset)
+		record_block = block_cache.get(block_key)
+		if record_block is None:
+			if isinstance(content, mmap.mmap):
+				# Slicing rather than seek() and read(), as the mapping is shared by the threads
+				block_compressed = content[compressed_offset:compressed_offset + compressed_size]
+			else:
+				content.seek(compressed_offset)
+				block_compressed = content.read(compressed_size)
+			record_block = self._decode_record_block(block_compressed, decompressed_size)
+			block_cache.put(block_key, record_block)
+		return self._slice_record(record_block, offset - decompressed_offset, length)
+
+	def read_records_of_block(self, f: BinaryIO, block_number: int, locations: list[tuple[int, int]]) -> list[bytes]:
+		"""
+		Returns the records at the given (offset, length) locations, all in the given block, which is decoded once.
+		Meant for reading a file through: the block is read from f rather than the mapping,
+		so that it does not stay resident, and the block cache is neither used nor filled.
+		"""
+		decompressed_offsets, compressed_offsets, compressed_sizes = self.record_block_table
+		decompressed_offset = decompressed_offsets[block_number]
+		f.seek(compressed_offsets[block_number])
+		record_block = self._decode_record_block(f.read(compressed_sizes[block_number]),
+												 decompressed_offsets[block_number + 1] - decompressed_offset)
+		return [self._slice_record(record_block, offset - decompressed_offset, length) for offset, length in locations]
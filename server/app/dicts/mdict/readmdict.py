@@ -99,7 +99,7 @@ class MDict(object):
 	It has no public methods and serves only as code sharing base class.
 	"""
 
-	def __init__(self, fname, encoding='', passcode=None):
+	def __init__(self, fname, encoding='', passcode=None, load_keys=True):
 		self._fname = fname
 		self._encoding = encoding.upper()
 		self._encrypted_key = None
@@ -118,7 +118,10 @@ class MDict(object):
 			mid = (len(uuid) + 1) // 2
 			self._encrypted_key = xxh64_digest(uuid[:mid]) + xxh64_digest(uuid[mid:])
 
-		self._key_list = self._read_keys()
+		self._read_key_layout()
+		# Without load_keys, the keys are only available from iter_keys(), one key block at a time
+		if load_keys:
+			self._key_list = self._read_keys()
 
 	def __len__(self):
 		return self._num_entries
@@ -257,6 +260,7 @@ class MDict(object):
 			key_block_info_list += [(key_block_compressed_size, key_block_decompressed_size)]
 
 		# assert(num_entries == self._num_entries)
+		self._num_entries_of_key_block_info = num_entries
 
 		return key_block_info_list
 
@@ -361,18 +365,51 @@ class MDict(object):
 
 		return header_tag
 
-	def _read_keys(self):
+	def _read_key_layout(self):
+		"""
+		Locates the key blocks and the record section without decoding any key block.
+		"""
 		if self._version >= 3:
-			return self._read_keys_v3()
+			self._read_key_layout_v3()
 		else:
 			# if no regcode is given, try brutal force (only for engine <= 2)
 			if (self._encrypt & 0x01) and self._encrypted_key is None:
 				print("Try Brutal Force on Encrypted Key Blocks")
-				return self._read_keys_brutal()
+				self._read_key_layout_brutal()
 			else:
-				return self._read_keys_v1v2()
+				self._read_key_layout_v1v2()
 
-	def _read_keys_v3(self):
+	def _read_keys(self):
+		return list(self.iter_keys())
+
+	def iter_keys(self):
+		"""
+		Yield (record offset, key) for every key, in the order of the file, decoding one key block at a time,
+		so that only one of them is held in memory.
+		"""
+		num_entries = 0
+		with open(self._fname, 'rb') as f:
+			if self._version >= 3:
+				f.seek(self._key_data_offset)
+				number = self._read_int32(f)
+				total_size = self._read_number(f)
+				for i in range(number):
+					decompressed_size = self._read_int32(f)
+					compressed_size = self._read_int32(f)
+					key_block = self._decode_block(f.read(compressed_size), decompressed_size)
+					key_list = self._split_key_block(key_block)
+					num_entries += len(key_list)
+					yield from key_list
+			else:
+				f.seek(self._key_block_data_offset)
+				for compressed_size, decompressed_size in self._key_block_info_list:
+					key_block = self._decode_block(f.read(compressed_size), decompressed_size)
+					key_list = self._split_key_block(key_block)
+					num_entries += len(key_list)
+					yield from key_list
+		self._num_entries = num_entries
+
+	def _read_key_layout_v3(self):
 		f = open(self._fname, 'rb')
 		f.seek(self._key_block_offset)
 
@@ -402,23 +439,9 @@ class MDict(object):
 			else:
 				break
 
-		# read key data
-		f.seek(self._key_data_offset)
-		number = self._read_int32(f)
-		total_size = self._read_number(f)
-		key_list = []
-		for i in range(number):
-			decompressed_size = self._read_int32(f)
-			compressed_size = self._read_int32(f)
-			block_data = f.read(compressed_size)
-			decompressed_block_data = self._decode_block(block_data, decompressed_size)
-			key_list.extend(self._split_key_block(decompressed_block_data))
-
 		f.close()
-		self._num_entries = len(key_list)
-		return key_list
 
-	def _read_keys_v1v2(self):
+	def _read_key_layout_v1v2(self):
 		f = open(self._fname, 'rb')
 		f.seek(self._key_block_offset)
 
@@ -453,20 +476,15 @@ class MDict(object):
 
 		# read key block info, which indicates key block's compressed and decompressed size
 		key_block_info = f.read(key_block_info_size)
-		key_block_info_list = self._decode_key_block_info(key_block_info)
-		assert (num_key_blocks == len(key_block_info_list))
-
-		# read key block
-		key_block_compressed = f.read(key_block_size)
-		# extract key block
-		key_list = self._decode_key_block(key_block_compressed, key_block_info_list)
+		self._key_block_info_list = self._decode_key_block_info(key_block_info)
+		assert (num_key_blocks == len(self._key_block_info_list))
 
-		self._record_block_offset = f.tell()
+		# the key blocks follow, then the records
+		self._key_block_data_offset = f.tell()
+		self._record_block_offset = self._key_block_data_offset + key_block_size
 		f.close()
 
-		return key_list
-
-	def _read_keys_brutal(self):
+	def _read_key_layout_brutal(self):
 		f = open(self._fname, 'rb')
 		f.seek(self._key_block_offset)
 
@@ -497,20 +515,15 @@ class MDict(object):
 			else:
 				key_block_info += t
 
-		key_block_info_list = self._decode_key_block_info(key_block_info)
-		key_block_size = sum(list(zip(*key_block_info_list))[0])
-
-		# read key block
-		key_block_compressed = f.read(key_block_size)
-		# extract key block
-		key_list = self._decode_key_block(key_block_compressed, key_block_info_list)
+		self._key_block_info_list = self._decode_key_block_info(key_block_info)
+		key_block_size = sum(list(zip(*self._key_block_info_list))[0])
+		self._num_entries = self._num_entries_of_key_block_info
 
-		self._record_block_offset = f.tell()
+		# the key blocks follow, then the records
+		self._key_block_data_offset = f.tell()
+		self._record_block_offset = self._key_block_data_offset + key_block_size
 		f.close()
 
-		self._num_entries = len(key_list)
-		return key_list
-
 	def items(self):
 		"""Return a generator which in turn produce tuples in the form of (filename, content)
 		"""
@@ -615,8 +628,8 @@ class MDD(MDict):
 	... print filename, content[:10]
 	"""
 
-	def __init__(self, fname, passcode=None):
-		MDict.__init__(self, fname, encoding='UTF-16', passcode=passcode)
+	def __init__(self, fname, passcode=None, load_keys=True):
+		MDict.__init__(self, fname, encoding='UTF-16', passcode=passcode, load_keys=load_keys)
 
 
 class MDX(MDict):
@@ -629,8 +642,8 @@ class MDX(MDict):
 	... print key, value[:10]
 	"""
 
-	def __init__(self, fname, encoding='', substyle=False, passcode=None):
-		MDict.__init__(self, fname, encoding, passcode)
+	def __init__(self, fname, encoding='', substyle=False, passcode=None, load_keys=True):
+		MDict.__init__(self, fname, encoding, passcode, load_keys)
 		self._substyle = substyle
 
 	def _substitute_stylesheet(self, txt):
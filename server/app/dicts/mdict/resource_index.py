@@ -0,0 +1,115 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Iterable, Iterator
+
+
+class ResourceIndex:
+	"""
+	A read-only, memory-mapped table of the resources in the .mdd files of a dictionary, sorted by name,
+	so that a resource is read out of its .mdd when requested instead of being extracted beforehand.
+	Names are as in the URLs: slashes instead of backslashes, without the leading one.
+	Layout: header, offsets of the names, numbers of the .mdd files, offsets and lengths of the records
+	(-1 for up to the end of the block), then the UTF-8 names back to back.
+	All integers are native 64-bit, as the file is only ever read on the machine that wrote it.
+	"""
+	_MAGIC = b'SDRI'
+	_VERSION = 1
+	_BYTEORDER = {'little': 1, 'big': 2}[sys.byteorder]
+	_HEADER = struct.Struct('=4sBBxxIxxxxQ') # magic, version, byte order, number of .mdd files, number of resources
+
+	@staticmethod
+	def normalise_name(name: str) -> str:
+		name = name.replace('\\', '/')
+		if name.startswith('/'):
+			name = name[1:]
+		return name
+
+	@classmethod
+	def write(cls, filename: str, num_mdds: int, resources: Iterable[tuple[str, int, int, int]]) -> int:
+		"""
+		:param resources: (name, number of the .mdd, offset, length); of resources with the same name, the last one wins
+		:return: the number of resources written
+		"""
+		resources_of_names = {cls.normalise_name(name).encode('utf-8'): (number_mdd, offset, length)
+							  for name, number_mdd, offset, length in resources}
+		names = sorted(resources_of_names.keys())
+		name_offsets = array('Q', [0])
+		numbers_mdd = array('Q')
+		offsets = array('Q')
+		lengths = array('q')
+		for name in names:
+			number_mdd, offset, length = resources_of_names[name]
+			name_offsets.append(name_offsets[-1] + len(name))
+			numbers_mdd.append(number_mdd)
+			offsets.append(offset)
+			lengths.append(length)
+		temp_filename = f'{filename}.{os.getpid()}.tmp'
+		with open(temp_filename, 'wb') as f:
+			f.write(cls._HEADER.pack(cls._MAGIC, cls._VERSION, cls._BYTEORDER, num_mdds, len(names)))
+			for column in (name_offsets, numbers_mdd, offsets, lengths):
+				f.write(column.tobytes())
+			for name in names:
+				f.write(name)
+		os.replace(temp_filename, filename)
+		return len(names)
+
+	@classmethod
+	def load(cls, filename: str, num_mdds: int | None = None) -> 'ResourceIndex | None':
+		"""
+		Returns None if the file is missing, of another format, written for another number of .mdd files than num_mdds,
+		or cut short (e.g. by a full disk), so that it is written again.
+		"""
+		if not os.path.isfile(filename) or os.path.getsize(filename) < cls._HEADER.size:
+			return None
+		with open(filename, 'rb') as f:
+			content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, version, byteorder, num_mdds_indexed, num_resources = cls._HEADER.unpack_from(content)
+		if magic != cls._MAGIC or version != cls._VERSION or byteorder != cls._BYTEORDER or num_mdds not in (None, num_mdds_indexed):
+			content.close()
+			return None
+		# The four columns, then the names, which end at the last name offset
+		names_start = cls._HEADER.size + 8 * (4 * num_resources + 1)
+		if len(content) < names_start\
+			or len(content) < names_start + struct.unpack_from('=Q', content, names_start - 8 * (3 * num_resources + 1))[0]:
+			content.close()
+			return None
+		return cls(content, num_resources)
+
+	def __init__(self, content: mmap.mmap, num_resources: int) -> None:
+		self._mmap = content
+		self.num_resources = num_resources
+		position = self._HEADER.size
+		self._name_offsets = memoryview(content)[position:position + 8 * (num_resources + 1)].cast('Q')
+		position += 8 * (num_resources + 1)
+		self._numbers_mdd = memoryview(content)[position:position + 8 * num_resources].cast('Q')
+		position += 8 * num_resources
+		self._offsets = memoryview(content)[position:position + 8 * num_resources].cast('Q')
+		position += 8 * num_resources
+		self._lengths = memoryview(content)[position:position + 8 * num_resources].cast('q')
+		self._names_start = position + 8 * num_resources
+
+	def _name_at(self, i: int) -> bytes:
+		return self._mmap[self._names_start + self._name_offsets[i]:self._names_start + self._name_offsets[i + 1]]
+
+	def locate(self, name: str) -> tuple[int, int, int] | None:
+		"""
+		Returns (number of the .mdd, offset, length) of the resource, or None if there is no such resource.
+		"""
+		name_bytes = self.normalise_name(name).encode('utf-8')
+		low, high = 0, self.num_resources
+		while low < high:
+			middle = (low + high) // 2
+			if self._name_at(middle) < name_bytes:
+				low = middle + 1
+			else:
+				high = middle
+		if low < self.num_resources and self._name_at(low) == name_bytes:
+			return self._numbers_mdd[low], self._offsets[low], self._lengths[low]
+		return None
+
+	def names(self) -> Iterator[str]:
+		for i in range(self.num_resources):
+			yield self._name_at(i).decode('utf-8')
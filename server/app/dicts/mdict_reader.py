@@ -1,18 +1,13 @@
-import struct
-import zlib
+import mmap
 import os
+import queue
+import threading
+import time
 from pathlib import Path
-import pickle
-import io
-try:
-	import lzo
-	lzo_is_c = True
-except ImportError:
-	from .mdict import lzo
-	lzo_is_c = False
 import concurrent.futures
+from typing import BinaryIO, Iterator
 from .base_reader import BaseReader
-from .mdict import MDX, MDD, HTMLCleaner
+from .mdict import MDX, MDD, MDXIndex, ResourceIndex, HTMLCleaner
 from .. import db_manager
 from ..utils import run_in_thread_pool
 import logging
@@ -22,7 +17,8 @@ logger.setLevel(logging.INFO)
 
 
 class MDictReader(BaseReader):
-	FILENAME_MDX_PICKLE = 'mdx.pickle'
+	FILENAME_MDX_INDEX = 'mdx.index'
+	FILENAME_RESOURCE_INDEX = 'resources.index'
 
 	def _write_to_cache_dir(self, resource_filename: str, data: bytes) -> None:
 		absolute_path = os.path.join(self._resources_dir, resource_filename)
@@ -46,183 +42,222 @@ class MDictReader(BaseReader):
 		self._resources_dir = os.path.join(self._CACHE_ROOT, name)
 		Path(self._resources_dir).mkdir(parents=True, exist_ok=True)
 
-		filename_mdx_pickle = os.path.join(self._resources_dir, self.FILENAME_MDX_PICKLE)
-		if os.path.isfile(filename_mdx_pickle):
-			mdx_pickled = True
-			with open(filename_mdx_pickle, 'rb') as f:
-				self._mdict = pickle.load(f)
-			if self._mdict._fname != filename: # the pickle's off
-				self._mdict = MDX(filename)
-				mdx_pickled = False
-		else:
-			mdx_pickled = False
-			self._mdict = MDX(filename)
-
-		if not db_manager.dictionary_exists(self.name):
-			db_manager.drop_index()
-			for i in range(len(self._mdict._key_list)):
-				offset, key = self._mdict._key_list[i]
-				if i + 1 < len(self._mdict._key_list):
-					length = self._mdict._key_list[i + 1][0] - offset
-				else:
-					length = -1
-				db_manager.add_entry(self.simplify(key.decode('UTF-8')),
-						 			 self.name,
-									 key.decode('UTF-8'),
-									 offset,
-									 length)
-			db_manager.commit_new_entries(self.name)
-			db_manager.create_index()
-			logger.info(f'Entries of dictionary {self.name} added to database')
-
-		if not mdx_pickled:
-			del self._mdict._key_list # a hacky way to reduce memory usage without touching the library
-			with open(filename_mdx_pickle, 'wb') as f:
-				pickle.dump(self._mdict, f)
+		filename_mdx_index = os.path.join(self._resources_dir, self.FILENAME_MDX_INDEX)
+		self._mdict = MDXIndex.load(filename_mdx_index, filename)
+		if self._mdict is None or not db_manager.dictionary_exists(self.name):
+			mdx = MDX(filename, load_keys=False)
+			if not db_manager.dictionary_exists(self.name):
+				with db_manager.EntrySink(self.name) as sink:
+					# The length of a record is only known from the offset of the next key, which may be in the next block
+					previous_offset, previous_key = None, None
+					for offset, key in mdx.iter_keys():
+						if previous_key is not None:
+							sink.add(self.simplify(previous_key), previous_key, previous_offset, offset - previous_offset)
+						previous_offset, previous_key = offset, key.decode('UTF-8')
+					if previous_key is not None:
+						sink.add(self.simplify(previous_key), previous_key, previous_offset, -1)
+				logger.info(f'Entries of dictionary {self.name} added to database')
+			if self._mdict is None:
+				MDXIndex.write(filename_mdx_index, mdx)
+				self._mdict = MDXIndex.load(filename_mdx_index, filename)
+			del mdx
+		# Superseded by the index
+		if os.path.isfile(os.path.join(self._resources_dir, 'mdx.pickle')):
+			os.remove(os.path.join(self._resources_dir, 'mdx.pickle'))
 
 		styles = self._mdict.header.get(b'StyleSheet', b'')
-		self.html_cleaner = HTMLCleaner(filename, name, self._resources_dir, styles.decode('utf-8'))
+		self.html_cleaner = HTMLCleaner(filename,
+										name,
+										self._resources_dir,
+										styles.decode('utf-8'),
+										os.path.join(self._resources_dir, self.FILENAME_RESOURCE_INDEX))
+		self.renderer = self.html_cleaner
 
 		self._loaded_content_into_memory = load_content_into_memory
-		if load_content_into_memory:
-			with open(filename, 'rb') as f:
-				self._content = io.BytesIO(f.read())
-
-		# If the resources haven't been extracted, then there are the following possible files inside _resource_dir
-		# 1. mdx.pickle
-		# 2. CSS
-		# 3. JS
-		if extract_resources and all(os.path.splitext(f)[1] in ('.pickle', '.css', '.js')
-							   		 for f in os.listdir(self._resources_dir)):
-			# Load the resource files (.mdd), if any
-			# For example, for the dictionary collinse22f.mdx, there are four .mdd files:
-			# collinse22f.mdd, collinse22f.1.mdd, collinse22f.2.mdd, collinse22f.3.mdd
-			resources = []
-			mdd_base_filename = f'{filename_no_extension}.'
-			if os.path.isfile(mdd_filename := f'{mdd_base_filename}mdd')\
-				or os.path.isfile(mdd_filename := f'{mdd_base_filename}MDD'):
-				resources.append(MDD(mdd_filename))
-			i = 1
-			while os.path.isfile(mdd_filename := f'{mdd_base_filename}{i}.mdd')\
-				or os.path.isfile(mdd_filename := f'{mdd_base_filename}{i}.MDD'):
-				resources.append(MDD(mdd_filename))
-				i += 1
-
-			# Extract resource files into cache directory
-			for mdd in resources:
-				for resource_filename, resource_file in mdd.items():
-					resource_filename = resource_filename.decode('UTF-8').replace('\\', '/')
-					if resource_filename.startswith('/'):
-						resource_filename = resource_filename[1:]
-					self._write_to_cache_dir(resource_filename, resource_file)
+		# Only the memory group is mapped: mapping multi-gigabyte files can exhaust a 32-bit address space,
+		# and on Windows a mapped file cannot be replaced or deleted. The others are opened for each batch of reads.
+		self._content = self._map_file(filename, preload=True) if load_content_into_memory else None
 
+		self._resource_index = None
+		if extract_resources:
+			mdd_filenames = self._mdd_filenames(filename_no_extension)
 			if remove_resources_after_extraction:
-				for mdd in resources:
-					os.remove(mdd._fname)
-
-	def _get_record(self, mdict_fp, offset: int, length: int) -> str:
-		if self._mdict._version >= 3:
-			return self._get_record_v3(mdict_fp, offset, length)
-		else:
-			return self._get_record_v1v2(mdict_fp, offset, length)
-
-	def _get_record_v3(self, f, offset: int, length: int) -> str:
-		f.seek(self._mdict._record_block_offset)
-
-		num_record_blocks = self._mdict._read_int32(f)
-
-		decompressed_offset = 0
-		for j in range(num_record_blocks):
-			decompressed_size = self._mdict._read_int32(f)
-			compressed_size = self._mdict._read_int32(f)
-
-			if (decompressed_offset + decompressed_size) > offset:
-				break
-			decompressed_offset += decompressed_size
-			f.seek(compressed_size, 1)
-
-		block_compressed = f.read(compressed_size)
-		record_block = self._mdict._decode_block(block_compressed, decompressed_size)
-
-		record_start = offset - decompressed_offset
-		if length > 0:
-			record_null = record_block[record_start:record_start + length]
-		else:
-			record_null = record_block[record_start:]
-
-		return record_null.strip().decode(self._mdict._encoding)
-
-	def _get_record_v1v2(self, f, offset: int, length: int) -> str:
-		f.seek(self._mdict._record_block_offset)
-
-		num_record_blocks = self._mdict._read_number(f)
-		num_entries = self._mdict._read_number(f)
-		assert (num_entries == self._mdict._num_entries)
-		record_block_info_size = self._mdict._read_number(f)
-		self._mdict._read_number(f)
-
-		# record block info section
-		compressed_offset = f.tell() + record_block_info_size
-		decompressed_offset = 0
-		for i in range(num_record_blocks):
-			compressed_size = self._mdict._read_number(f)
-			decompressed_size = self._mdict._read_number(f)
-			if (decompressed_offset + decompressed_size) > offset:
-				break
-			decompressed_offset += decompressed_size
-			compressed_offset += compressed_size
-
-		f.seek(compressed_offset)
-		block_compressed = f.read(compressed_size)
-		block_type = block_compressed[:4]
-		adler32 = struct.unpack('>I', block_compressed[4:8])[0]
-		# no compression
-		if block_type == b'\x00\x00\x00\x00':
-			record_block = block_compressed[8:]
-		# lzo compression
-		elif block_type == b'\x01\x00\x00\x00':
-			# LZO compression is used for engine version < 2.0
-			if lzo_is_c:
-				header = b'\xf0' + struct.pack('>I', decompressed_size)
-				record_block = lzo.decompress(header + block_compressed[8:])
-			else:
-				record_block = lzo.decompress(block_compressed[8:], initSize=decompressed_size, blockSize=1308672)
-		# zlib compression
-		elif block_type == b'\x02\x00\x00\x00':
-			# decompress
-			record_block = zlib.decompress(block_compressed[8:])
-		# notice that adler32 return signed value
-		assert (adler32 == zlib.adler32(record_block) & 0xffffffff)
-		assert (len(record_block) == decompressed_size)
-
-		record_start = offset - decompressed_offset
-		if length > 0:
-			record_null = record_block[record_start:record_start + length]
-		else:
-			record_null = record_block[record_start:]
-		return record_null.strip().decode(self._mdict._encoding)
+				self._extract_resources(mdd_filenames)
+				for mdd_filename in mdd_filenames:
+					os.remove(mdd_filename)
+			elif len(mdd_filenames) > 0:
+				self._index_resources(mdd_filenames)
+		self.html_cleaner.index_linked_files()
+		self.html_cleaner.isolate_css()
+
+	@staticmethod
+	def _mdd_filenames(filename_no_extension: str) -> list[str]:
+		# For example, for the dictionary collinse22f.mdx, there are four .mdd files:
+		# collinse22f.mdd, collinse22f.1.mdd, collinse22f.2.mdd, collinse22f.3.mdd
+		mdd_filenames = []
+		mdd_base_filename = f'{filename_no_extension}.'
+		if os.path.isfile(mdd_filename := f'{mdd_base_filename}mdd')\
+			or os.path.isfile(mdd_filename := f'{mdd_base_filename}MDD'):
+			mdd_filenames.append(mdd_filename)
+		i = 1
+		while os.path.isfile(mdd_filename := f'{mdd_base_filename}{i}.mdd')\
+			or os.path.isfile(mdd_filename := f'{mdd_base_filename}{i}.MDD'):
+			mdd_filenames.append(mdd_filename)
+			i += 1
+		return mdd_filenames
+
+	@staticmethod
+	def _resources_of_mdd(mdd: MDD) -> Iterator[tuple[str, int, int]]:
+		"""
+		Yields (name, offset, length) of the resources of an .mdd; only the keys are read.
+		The length of a resource is known from the offset of the next one; that of the last one is -1.
+		"""
+		previous_offset, previous_name = None, None
+		for offset, name in mdd.iter_keys():
+			if previous_name is not None:
+				yield previous_name, previous_offset, offset - previous_offset
+			previous_offset, previous_name = offset, name.decode('UTF-8')
+		if previous_name is not None:
+			yield previous_name, previous_offset, -1
+
+	def _extract_resources(self, mdd_filenames: list[str]) -> None:
+		"""
+		Extracts the resources of the .mdd files into the cache directory.
+		Record blocks are decoded in the worker pool, and the resources of each are written by a single thread
+		fed through a bounded queue, so that only a few blocks are held in memory at a time.
+		An interrupted extraction is resumed by skipping the files already there with the right size.
+		"""
+		for i, mdd_filename in enumerate(mdd_filenames):
+			mdd = MDD(mdd_filename, load_keys=False)
+			filename_mdd_index = os.path.join(self._resources_dir, f'mdd.{i}.index')
+			mdd_index = MDXIndex.load(filename_mdd_index, mdd_filename)
+			if mdd_index is None:
+				MDXIndex.write(filename_mdd_index, mdd)
+				mdd_index = MDXIndex.load(filename_mdd_index, mdd_filename)
+
+			# Of resources with the same name, the last one wins
+			locations_of_paths = {os.path.join(self._resources_dir, ResourceIndex.normalise_name(name)): (offset, length)
+								  for name, offset, length in self._resources_of_mdd(mdd)}
+			num_resources = len(locations_of_paths)
+			decompressed_offsets = mdd_index.record_block_table[0]
+			paths_of_blocks: dict[int, list[str]] = dict()
+			for path, (offset, length) in locations_of_paths.items():
+				block_number = mdd_index.block_of(offset)
+				if length < 0:
+					length = decompressed_offsets[block_number + 1] - offset
+				try:
+					# A file cut short by an interruption is written again
+					if os.stat(path).st_size == length:
+						continue
+				except OSError:
+					pass
+				paths_of_blocks.setdefault(block_number, []).append(path)
+			num_extracted_before = num_resources - sum(len(paths) for paths in paths_of_blocks.values())
+			for directory in {os.path.dirname(path) for paths in paths_of_blocks.values() for path in paths}:
+				os.makedirs(directory, exist_ok=True)
+			if num_extracted_before > 0:
+				logger.info(f'{num_extracted_before} of {num_resources} resources of {mdd_filename} already extracted, resuming')
+
+			# The resources of a block each, None when all the blocks are decoded.
+			# Writing is the bottleneck, so a short queue is enough to keep the writer busy.
+			files: queue.Queue[list[tuple[str, bytes]] | None] = queue.Queue(maxsize=2)
+			errors: list[Exception] = []
+
+			def write_files() -> None:
+				num_extracted = num_extracted_before
+				time_logged = time.perf_counter()
+				while (batch := files.get()) is not None:
+					if errors:
+						continue # drained, so that the decoders are not blocked
+					try:
+						for path, data in batch:
+							with open(path, 'wb') as f:
+								f.write(data)
+					except Exception as e:
+						errors.append(e)
+						continue
+					num_extracted += len(batch)
+					if time.perf_counter() - time_logged > 10:
+						logger.info(f'{num_extracted} of {num_resources} resources of {mdd_filename} extracted')
+						time_logged = time.perf_counter()
+
+			def decode_block(block_number: int, paths: list[str]) -> None:
+				with open(mdd_filename, 'rb') as f:
+					records = mdd_index.read_records_of_block(f, block_number, [locations_of_paths[path] for path in paths])
+				files.put(list(zip(paths, records)))
+
+			writer = threading.Thread(target=write_files, name='resource-writer', daemon=True)
+			writer.start()
+			try:
+				run_in_thread_pool(decode_block, paths_of_blocks.keys(), paths_of_blocks.values(), stage='extract_resources')
+			finally:
+				files.put(None)
+				writer.join()
+			if errors:
+				raise errors[0]
+			logger.info(f'{num_resources} resources of {mdd_filename} extracted')
+
+	def _index_resources(self, mdd_filenames: list[str]) -> None:
+		"""
+		Indexes the resources of the .mdd files, so that they are read out of them when requested (see get_resource()).
+		Only stylesheets and scripts are extracted, as the HTML cleaner rewrites them in the cache directory.
+		"""
+		filenames_mdd_index = [os.path.join(self._resources_dir, f'mdd.{i}.index') for i in range(len(mdd_filenames))]
+		filename_resource_index = os.path.join(self._resources_dir, self.FILENAME_RESOURCE_INDEX)
+		self._mdd_indexes = [MDXIndex.load(filename_mdd_index, mdd_filename)
+							 for filename_mdd_index, mdd_filename in zip(filenames_mdd_index, mdd_filenames)]
+		self._resource_index = ResourceIndex.load(filename_resource_index, len(mdd_filenames))
+		self._mdd_filenames = mdd_filenames
+		self._mdd_contents = [self._map_file(mdd_filename, preload=False) if self._loaded_content_into_memory else None
+							  for mdd_filename in mdd_filenames]
+		if self._resource_index is not None and all(self._mdd_indexes):
+			return
+
+		def resources_of_mdds() -> Iterator[tuple[str, int, int, int]]:
+			for i, mdd in enumerate(mdds):
+				for name, offset, length in self._resources_of_mdd(mdd):
+					yield name, i, offset, length
+
+		mdds = [MDD(mdd_filename, load_keys=False) for mdd_filename in mdd_filenames]
+		for i, mdd in enumerate(mdds):
+			MDXIndex.write(filenames_mdd_index[i], mdd)
+			self._mdd_indexes[i] = MDXIndex.load(filenames_mdd_index[i], mdd_filenames[i])
+		num_resources = ResourceIndex.write(filename_resource_index, len(mdds), resources_of_mdds())
+		self._resource_index = ResourceIndex.load(filename_resource_index, len(mdds))
+		for resource_filename in self._resource_index.names():
+			if os.path.splitext(resource_filename)[1].lower() in ('.css', '.js'):
+				self._write_to_cache_dir(resource_filename, self.get_resource(resource_filename))
+		logger.info(f'{num_resources} resources of dictionary {self.name} indexed')
+
+	def get_resource(self, resource_filename: str) -> bytes | None:
+		if self._resource_index is None:
+			return None
+		location = self._resource_index.locate(resource_filename)
+		if location is None:
+			return None
+		number_mdd, offset, length = location
+		if self._mdd_contents[number_mdd] is not None:
+			return self._mdd_indexes[number_mdd].read_record(self._mdd_contents[number_mdd], offset, length)
+		with open(self._mdd_filenames[number_mdd], 'rb') as f:
+			return self._mdd_indexes[number_mdd].read_record(f, offset, length)
+
+	def _get_record(self, content: mmap.mmap | BinaryIO, offset: int, length: int) -> str:
+		return self._mdict.read_record(content, offset, length).strip().decode(self._mdict._encoding)
 
 	def _get_records_in_batch(self, locations: list[tuple[int, int]]) -> list[str]:
-		if self._loaded_content_into_memory:
-			mdict_fp = self._content
-		else:
-			mdict_fp = open(self.filename, 'rb')
-		records = [self._get_record(mdict_fp, offset, length) for offset, length in locations]
-		if not self._loaded_content_into_memory:
-			mdict_fp.close()
-		return records
+		if self._content is not None:
+			return [self._get_record(self._content, offset, length) for offset, length in locations]
+		with open(self.filename, 'rb') as f:
+			return [self._get_record(f, offset, length) for offset, length in locations]
 
 	def get_definition_by_key(self, entry: str) -> str:
-		locations = db_manager.get_entries(entry, self.name)
+		return self.get_definition_by_locations(db_manager.get_entries(entry, self.name))
+
+	def get_records_by_locations(self, locations: list[tuple[str, int, int]]) -> list[str]:
 		# word is not used in mdict, which is present in the article itself.
-		locations = [(offset, length) for word, offset, length in locations]
-		records = self._get_records_in_batch(locations)
-		# Cleaning up HTML actually takes some time to complete
-		records = run_in_thread_pool(self.html_cleaner.clean, records, num_max_workers=len(records))
-		return self._ARTICLE_SEPARATOR.join(records)
+		return self._get_records_in_batch([(offset, length) for word, offset, length in locations])
 
 	def get_definition_by_word(self, headword: str) -> str:
 		locations = db_manager.get_entries_with_headword(headword, self.name)
 		records = self._get_records_in_batch([(offset, length) for offset, length in locations])
-		records = run_in_thread_pool(self.html_cleaner.clean, records, num_max_workers=len(records))
-		return self._ARTICLE_SEPARATOR.join(records)
+		return self._ARTICLE_SEPARATOR.join(self.renderer.render(records))
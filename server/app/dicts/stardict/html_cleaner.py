@@ -2,6 +2,7 @@ import re
 import os
 import shutil
 from ... import utils
+from .. import html_rewriter
 
 
 class HtmlCleaner:
@@ -15,6 +16,7 @@ class HtmlCleaner:
 	_non_printing_chars_pattern = re.compile(r'[\x00-\x1f\x7f-\x9f]')
 	_single_quotes_pattern = re.compile(r"=\'([^']*)\'(?=[ >])")
 	_cross_ref_pattern = re.compile(r'href="bword://([^"]+)"')
+	_IMAGE_EXTENSIONS = ('.jpg', '.png', '.gif', '.svg', '.bmp', '.jpeg')
 
 	def __init__(self, dictionary_name: str, dictionary_path: str, resource_dir: str) -> None:
 		self._href_root = 'api/cache/' + dictionary_name + '/'
@@ -37,12 +39,8 @@ class HtmlCleaner:
 
 		self._resources_dir = resource_dir
 		self._cross_ref_replacement = 'href="' + self._lookup_url_root + r'\1"'
-	
-	def _isolate_css(self) -> None:
-		if os.path.exists(self._resources_dir):
-			for filename in os.listdir(self._resources_dir):
-				if filename.endswith('.css') or filename.endswith('.CSS'):
-					utils.isolate_css(os.path.join(self._resources_dir, filename), self._id)
+		# Once per load rather than per article
+		utils.isolate_css_files(self._resources_dir, self._id, self._resources_dir + '.css_manifest')
 
 	def _remove_non_printing_chars(self, html: str) -> str:
 		return self._non_printing_chars_pattern.sub('', html)
@@ -59,82 +57,51 @@ class HtmlCleaner:
 	def _fix_cross_ref(self, html: str) -> str:
 		return self._cross_ref_pattern.sub(self._cross_ref_replacement, html)
 
-	def _fix_lemma_href(self, html: str) -> str:
-		lemma_tag_end_pos = 0
-		while (lemma_tag_start_pos := html.find('<span class="lemma">', lemma_tag_end_pos)) != -1:
-			lemma_tag_end_pos = html.find('</span>', lemma_tag_start_pos)
-			href_start_pos = html.find(' href="', lemma_tag_start_pos, lemma_tag_end_pos) + len(' href="')
-			href_end_pos = html.find('"', href_start_pos, lemma_tag_end_pos)
-			href = html[href_start_pos:href_end_pos]
-			html = html[:href_start_pos] + self._lookup_url_root + href + html[href_end_pos:]
-		return html
-
-	def _fix_src_path(self, html: str) -> str:
-		img_tag_end_pos = 0
-		while (img_tag_start_pos := html.find('<img', img_tag_end_pos)) != -1:
-			img_tag_end_pos = html.find('>', img_tag_start_pos)
-			img_src_start_pos = html.find(' src="', img_tag_start_pos, img_tag_end_pos) + len(' src="')
-			img_src_end_pos = html.find('"', img_src_start_pos, img_tag_end_pos)
-			img_src = html[img_src_start_pos:img_src_end_pos]
-			# original_file_path_on_disk = os.path.join(self._original_res_dir, img_src)
-			# new_file_path_on_disk = os.path.join(self._new_res_dir, img_src)
-			# if not os.path.isfile(new_file_path_on_disk):
-			# 	if os.path.isfile(original_file_path_on_disk):
-			# 		Path(self._new_res_dir).mkdir(parents=True, exist_ok=True)
-			# 		shutil.copyfile(original_file_path_on_disk, new_file_path_on_disk)
-			# else:
-			# 	if os.path.getmtime(original_file_path_on_disk) > os.path.getmtime(new_file_path_on_disk):
-			# 		shutil.copyfile(original_file_path_on_disk, new_file_path_on_disk)
-			html = html[:img_src_start_pos] + self._href_root + img_src + html[img_src_end_pos:]
-		source_tag_end_pos = 0
-		while (source_tag_start_pos := html.find('<source', source_tag_end_pos)) != -1:
-			source_tag_end_pos = html.find('>', source_tag_start_pos)
-			source_src_start_pos = html.find(' src="', source_tag_start_pos, source_tag_end_pos) + len(' src="')
-			source_src_end_pos = html.find('"', source_src_start_pos, source_tag_end_pos)
-			source_src = html[source_src_start_pos:source_src_end_pos]
-			# original_file_path_on_disk = os.path.join(self._original_res_dir, source_src)
-			# if not os.path.isfile(new_file_path_on_disk):
-			# 	if os.path.isfile(original_file_path_on_disk):
-			# 		Path(self._new_res_dir).mkdir(parents=True, exist_ok=True)
-			# 		shutil.copyfile(original_file_path_on_disk, new_file_path_on_disk)
-			# else:
-			# 	if os.path.getmtime(original_file_path_on_disk) > os.path.getmtime(new_file_path_on_disk):
-			# 		shutil.copyfile(original_file_path_on_disk, new_file_path_on_disk)
-			html = html[:source_src_start_pos] + self._href_root + source_src + html[source_src_end_pos:]
-		return html
-
 	def _remove_outer_article_div(self, html: str) -> str:
 		if html.startswith('<div class="article">') and html.endswith('</div>'):
 			return html[len('<div class="article">'):-len('</div>')]
 		else:
 			return html
 
-	def _fix_img_link(self, html: str) -> str:
-		a_tag_end_pos = 0
-		while (a_tag_start_pos := html.find('<a href="', a_tag_end_pos)) != -1:
-			a_tag_end_pos = html.find('>', a_tag_start_pos)
-			href_start_pos = html.find(' href="', a_tag_start_pos, a_tag_end_pos) + len(' href="')
-			href_end_pos = html.find('"', href_start_pos, a_tag_end_pos)
-			href = html[href_start_pos:href_end_pos]
-			if href.endswith('.jpg')\
-				or href.endswith('.png')\
-				or href.endswith('.gif')\
-				or href.endswith('.svg')\
-				or href.endswith('.bmp')\
-				or href.endswith('.jpeg'):
-				html = html[:href_start_pos] + self._href_root + href + html[href_end_pos:]
-		return html
-	
-	def _fix_stylesheet_link(self, html: str) -> str:
-		link_tag_end_pos = 0
-		while (link_tag_start_pos := html.find('<link ', link_tag_end_pos)) != -1:
-			link_tag_end_pos = html.find('>', link_tag_start_pos)
-			if 'rel="stylesheet"' in html[link_tag_start_pos:link_tag_end_pos]:
-				href_start_pos = html.find(' href="', link_tag_start_pos, link_tag_end_pos) + len(' href="')
-				href_end_pos = html.find('"', href_start_pos, link_tag_end_pos)
-				href = html[href_start_pos:href_end_pos]
-				html = html[:href_start_pos] + self._href_root + href + html[href_end_pos:]
-		return html
+	def _rewrite_tags(self, html: str) -> str:
+		"""
+		In a single scan:
+		- fix hrefs defined inside lemma class spans (the first one of each)
+		- fix img and source src paths
+		- fix links to images
+		- fix stylesheet links
+		"""
+		lemma_tag_end_pos = -1
+		lemma_href_fixed = True
+
+		def prefix_href_root(value: str) -> str:
+			return self._href_root + value
+
+		def rewrite_tag(name: str, tag: str, position: int) -> str:
+			nonlocal lemma_tag_end_pos, lemma_href_fixed
+			if tag == '<span class="lemma">' and position > lemma_tag_end_pos:
+				lemma_tag_end_pos = html.find('</span>', position)
+				if lemma_tag_end_pos == -1:
+					lemma_tag_end_pos = len(html)
+				lemma_href_fixed = False
+				return tag
+			if not lemma_href_fixed and position < lemma_tag_end_pos and ' href="' in tag:
+				tag = html_rewriter.rewrite_attribute(tag, 'href', lambda href: self._lookup_url_root + href)
+				lemma_href_fixed = True
+			match name:
+				case 'img' | 'source':
+					return html_rewriter.rewrite_attribute(tag, 'src', prefix_href_root)
+				case 'a':
+					if tag.startswith('<a href="'):
+						href = html_rewriter.attribute_value(tag, 'href')
+						if href.endswith(self._IMAGE_EXTENSIONS):
+							return html_rewriter.rewrite_attribute(tag, 'href', prefix_href_root)
+				case 'link':
+					if 'rel="stylesheet"' in tag:
+						return html_rewriter.rewrite_attribute(tag, 'href', prefix_href_root)
+			return tag
+
+		return html_rewriter.rewrite(html, rewrite_tag)
 
 	def _add_headword(self, html: str, headword: str) -> str:
 		return f'<h3 class="headword">{headword}</h3>{html}'
@@ -144,10 +111,6 @@ class HtmlCleaner:
 		html = self._lower_html_tags(html)
 		html = self._convert_single_quotes_to_double(html)
 		html = self._fix_cross_ref(html)
-		html = self._fix_lemma_href(html)
-		html = self._fix_src_path(html)
 		html = self._remove_outer_article_div(html)
-		html = self._fix_img_link(html)
-		self._isolate_css()
-		html = self._fix_stylesheet_link(html)
+		html = self._rewrite_tags(html)
 		return self._add_headword(html, headword)
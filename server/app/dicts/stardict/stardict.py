@@ -8,8 +8,10 @@
 
 import struct
 import gzip
+import mmap
 import os
 import idzip
+from ...block_cache import open_idzip
 
 
 class IfoFileException(Exception):
@@ -244,7 +246,8 @@ class DictFileReader:
 				 filename: str,
 				 dict_ifo: IfoFileReader,
 				 dict_index: IdxFileReader,
-				 load_content_into_memory: bool = False) -> None:
+				 load_content_into_memory: bool = False,
+				 content: 'bytes | mmap.mmap | None' = None) -> None:
 		"""
 		Constructor.
 
@@ -252,6 +255,7 @@ class DictFileReader:
 		- `filename`: filename of .dict file.
 		- `dict_ifo`: IfoFileReader object.
 		- `dict_index`: IdxFileReader object.
+		- `content`: the decompressed content of the .dict file, e.g. mapped, if already at hand.
 		"""
 		self._dict_ifo = dict_ifo
 		self._dict_index = dict_index
@@ -259,7 +263,9 @@ class DictFileReader:
 		self._loaded_content_into_memory = load_content_into_memory
 		compressed = os.path.splitext(filename)[1] == '.dz'
 		if load_content_into_memory:
-			if compressed:
+			if content is not None:
+				self._content = content
+			elif compressed:
 				with idzip.open(filename) as f:
 					self._content = f.read()
 			else:
@@ -267,7 +273,7 @@ class DictFileReader:
 					self._content = f.read()
 		else:
 			if compressed:
-				self.fd = idzip.open(filename)
+				self.fd = open_idzip(filename)
 			else:
 				self.fd = open(filename, 'rb')
 
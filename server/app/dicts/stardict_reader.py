@@ -1,6 +1,6 @@
 import os
 import pickle
-from .base_reader import BaseReader
+from .base_reader import BaseReader, BaseRenderer
 from .. import db_manager
 from .stardict import IdxFileReader, IfoFileReader, SynFileReader, DictFileReader, HtmlCleaner
 import logging
@@ -18,6 +18,51 @@ except ImportError:
 	from .stardict import XdxfCleaner
 
 
+class StarDictRenderer(BaseRenderer):
+	def __init__(self, name: str, html_cleaner: HtmlCleaner) -> None:
+		self.name = name
+		self._html_cleaner = html_cleaner
+		if not xdxf2html_found:
+			self._xdxf_cleaner = XdxfCleaner()
+
+	def _clean_up_markup(self, record: tuple[str, str], headword: str) -> str:
+		"""
+		Cleans up the markup according the cttype and returns valid HTML.
+		"""
+		cttype, article = record
+		match cttype:
+			case 'm' | 't' | 'y':
+				# text, wrap in <p>
+				return f'<h3 class="headword">{headword}</h3>' +\
+					'<p>' + article.replace('\n', '<br/>') + '</p>'
+			case 'x':
+				if xdxf2html_found:
+					return xdxf2html.convert(
+						article,
+						f'api/cache/{self.name}/',
+						f'api/lookup/{self.name}/'
+					)
+				else:
+					return self._html_cleaner.clean(self._xdxf_cleaner.clean(article), headword)
+			case 'h' | 'g':
+				return self._html_cleaner.clean(article, headword)
+			case _:
+				raise ValueError(f'Unknown cttype {cttype}')
+
+	def render(self, records: list[tuple[str, str, str, str]]) -> list[str]:
+		"""
+		:param records: (cttype, article, headword, synonyms in HTML)
+		"""
+		articles = []
+		for cttype, article, headword, synonyms in records:
+			article = self._clean_up_markup((cttype, article), headword)
+			# Plain text gets no list of synonyms
+			if cttype not in ('m', 't', 'y'):
+				article += synonyms
+			articles.append(article)
+		return articles
+
+
 class StarDictReader(BaseReader):
 	"""
 	Adapted from stardictutils.py by J.F. Dockes.
@@ -48,15 +93,14 @@ class StarDictReader(BaseReader):
 		self._ifo_reader = IfoFileReader(self._ifofile)
 
 		if not db_manager.dictionary_exists(self.name):
-			db_manager.drop_index()
 			idx_reader = IdxFileReader(idxfile)
-			for word_str in idx_reader._word_idx:
-				spans = idx_reader.get_index_by_word(word_str)
-				word_decoded = word_str.decode('utf-8')
-				for offset, size in spans:
-					db_manager.add_entry(self.simplify(word_decoded), self.name, word_decoded, offset, size)
-			db_manager.commit_new_entries(self.name)
-			db_manager.create_index()
+			with db_manager.EntrySink(self.name) as sink:
+				for word_str in idx_reader._word_idx:
+					spans = idx_reader.get_index_by_word(word_str)
+					word_decoded = word_str.decode('utf-8')
+					key = self.simplify(word_decoded)
+					for offset, size in spans:
+						sink.add(key, word_decoded, offset, size)
 			logger.info(f'Entries of dictionary {self.name} added to database')
 
 			if display_name in filename:
@@ -88,12 +132,27 @@ class StarDictReader(BaseReader):
 
 		self._loaded_content_into_memory = load_content_into_memory
 		if load_content_into_memory:
-			self._content_dictfile = DictFileReader(self._dictfile, self._ifo_reader, None, True)
+			# Before mapping, as dictzipping removes the plain file
+			self._dictzip()
+			self._content_dictfile = DictFileReader(self._dictfile,
+													self._ifo_reader,
+													None,
+													True,
+													self._map_file(self._decompressed_copy(self._dictfile), preload=True))
+		else:
+			self._remove_decompressed_copy()
 
 		# The constructor of the html cleaner will link the resources directory
 		self._html_cleaner = HtmlCleaner(self.name, os.path.dirname(self.filename), self._resources_dir)
-		if not xdxf2html_found:
-			self._xdxf_cleaner = XdxfCleaner()
+		self.renderer = StarDictRenderer(self.name, self._html_cleaner)
+
+	def _dictzip(self) -> None:
+		if not os.path.isfile(self._dictfile): # it is possible that it is not dictzipped
+			from idzip.command import _compress
+			class Options:
+				suffix = '.dz'
+				keep = False
+			_compress(self._dictfile[:-len(Options.suffix)], Options)
 
 	def _get_records(self, dict_reader: DictFileReader, offset: int, size: int) -> list[tuple[str, str]]:
 		"""
@@ -125,38 +184,8 @@ class StarDictReader(BaseReader):
 									 			for synonym in self._synonyms[word]]) + '</div>'
 		return ''
 
-	def _clean_up_markup(self, record: tuple[str, str], headword: str) -> str:
-		"""
-		Cleans up the markup according the cttype and returns valid HTML.
-		"""
-		cttype, article = record
-		match cttype:
-			case 'm' | 't' | 'y':
-				# text, wrap in <p>
-				return f'<h3 class="headword">{headword}</h3>' +\
-					'<p>' + article.replace('\n', '<br/>') + '</p>'
-			case 'x':
-				if xdxf2html_found:
-					return xdxf2html.convert(
-						article,
-						f'api/cache/{self.name}/',
-						f'api/lookup/{self.name}/'
-					) + self._get_synonyms(headword)
-				else:
-					return self._html_cleaner.clean(self._xdxf_cleaner.clean(article), headword) +\
-						self._get_synonyms(headword)
-			case 'h' | 'g':
-				return self._html_cleaner.clean(article, headword) + self._get_synonyms(headword)
-			case _:
-				raise ValueError(f'Unknown cttype {cttype}')
-
-	def _get_records_in_batch(self, locations: list[tuple[str, int, int]]) -> list[str]:
-		if not os.path.isfile(self._dictfile): # it is possible that it is not dictzipped
-			from idzip.command import _compress
-			class Options:
-				suffix = '.dz'
-				keep = False
-			_compress(self._dictfile[:-len(Options.suffix)], Options)
+	def _get_records_in_batch(self, locations: list[tuple[str, int, int]]) -> list[tuple[str, str, str, str]]:
+		self._dictzip()
 		if self._loaded_content_into_memory:
 			dict_reader = self._content_dictfile
 		else:
@@ -165,7 +194,7 @@ class StarDictReader(BaseReader):
 		for word, offset, size in locations:
 			records.extend(
 				[
-					self._clean_up_markup(r, word)
+					(*r, word, self._get_synonyms(word))
 					for r in self._get_records(dict_reader, offset, size)
 				]
 			)
@@ -174,11 +203,12 @@ class StarDictReader(BaseReader):
 		return records
 
 	def get_definition_by_key(self, entry: str) -> str:
-		locations = db_manager.get_entries(entry, self.name)
-		records = self._get_records_in_batch(locations)
-		return self._ARTICLE_SEPARATOR.join(records)
+		return self.get_definition_by_locations(db_manager.get_entries(entry, self.name))
+
+	def get_records_by_locations(self, locations: list[tuple[str, int, int]]) -> list[tuple[str, str, str, str]]:
+		return self._get_records_in_batch(locations)
 
 	def get_definition_by_word(self, headword: str) -> str:
 		locations = db_manager.get_entries_with_headword(headword, self.name)
 		records = self._get_records_in_batch([(headword, *location) for location in locations])
-		return self._ARTICLE_SEPARATOR.join(records)
+		return self._ARTICLE_SEPARATOR.join(self.renderer.render(records))
@@ -3,7 +3,7 @@ from pathlib import Path
 from . import greek
 from . import arabic
 from . import chinese
-from .chinese import convert_chinese
+from .chinese import convert_chinese, convert_chinese_article
 from ..settings import Settings
 from ..dicts.base_reader import BaseReader
 
@@ -1,3 +1,4 @@
+import re
 import unicodedata
 
 
@@ -42,3 +43,21 @@ except ImportError:
 
 	def convert_chinese(text: str, preference: str) -> str:
 		return text
+
+
+_re_cache_api = re.compile(r'api/cache/([^/]+)/([^/]+)')
+_REPLACEMENT_TEXT = '!!@@SUBSTITUTION@@!!'
+
+
+def convert_chinese_article(article: str, preference: str) -> str:
+	"""
+	A direct call to convert_chinese() converts things like API references.
+	Now only cache API calls are protected.
+	"""
+	# First replace all API calls with the substitution string, then convert the article, and finally restore the API calls
+	matches = _re_cache_api.findall(article)
+	article = _re_cache_api.sub(_REPLACEMENT_TEXT, article)
+	article = convert_chinese(article, preference)
+	for match in matches:
+		article = article.replace(_REPLACEMENT_TEXT, 'api/cache/%s/%s' % match, 1)
+	return article
@@ -0,0 +1,142 @@
+import bisect
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Iterable, Iterator
+
+
+class PrefixIndex:
+	"""
+	A read-only, memory-mapped array of (key, word) pairs sorted by key, for prefix suggestions without SQLite.
+	Layout: header, IDs of the dictionaries covered, offsets of the keys, offsets of the words,
+	then the UTF-8 keys and words back to back. As UTF-8 preserves the order of code points,
+	the keys sort the same way as in SQLite, and a prefix search is a binary search on bytes.
+	All integers are native 64-bit, as the file is only ever read on the machine that wrote it.
+	There is no close(): the mapping goes away with the object, so a lookup still running in another thread
+	when the index is discarded is never left with a closed map.
+	"""
+	_MAGIC = b'SDPI'
+	_VERSION = 1
+	_BYTEORDER = {'little': 1, 'big': 2}[sys.byteorder]
+	_HEADER = struct.Struct('=4sBBxxIxxxxQ') # magic, version, byte order, number of dictionaries, number of rows
+	_SAMPLING_INTERVAL = 64 # every so many keys are kept in memory, so that most of the binary search runs in C
+
+	@classmethod
+	def write(cls, filename: str, ids_dictionaries: list[int], rows: Iterable[tuple[str, str]]) -> int:
+		"""
+		:param rows: (key, word) sorted by key
+		:return: the number of rows written, adjacent duplicates excluded
+		"""
+		key_offsets = array('Q', [0])
+		word_offsets = array('Q', [0])
+		temp_filename = filename + '.tmp'
+		# Keys and words go to temporary files first, as the offsets preceding them are only known at the end
+		with open(temp_filename + '.keys', 'w+b') as keys_file, open(temp_filename + '.words', 'w+b') as words_file:
+			previous_row = None
+			for row in rows:
+				if row == previous_row:
+					continue
+				previous_row = row
+				key_offsets.append(key_offsets[-1] + keys_file.write(row[0].encode('utf-8')))
+				word_offsets.append(word_offsets[-1] + words_file.write(row[1].encode('utf-8')))
+			num_rows = len(key_offsets) - 1
+			with open(temp_filename, 'wb') as f:
+				f.write(cls._HEADER.pack(cls._MAGIC, cls._VERSION, cls._BYTEORDER, len(ids_dictionaries), num_rows))
+				f.write(array('Q', ids_dictionaries).tobytes())
+				f.write(key_offsets.tobytes())
+				f.write(word_offsets.tobytes())
+				for blob_file in (keys_file, words_file):
+					blob_file.seek(0)
+					while chunk := blob_file.read(1 << 24):
+						f.write(chunk)
+		os.remove(temp_filename + '.keys')
+		os.remove(temp_filename + '.words')
+		os.replace(temp_filename, filename)
+		return num_rows
+
+	@classmethod
+	def ids_of_dictionaries_in_file(cls, filename: str) -> list[int] | None:
+		"""
+		Returns None if the file is not a valid prefix index.
+		"""
+		with open(filename, 'rb') as f:
+			header = f.read(cls._HEADER.size)
+			if len(header) < cls._HEADER.size:
+				return None
+			magic, version, byteorder, num_dictionaries, num_rows = cls._HEADER.unpack(header)
+			if magic != cls._MAGIC or version != cls._VERSION or byteorder != cls._BYTEORDER:
+				return None
+			return array('Q', f.read(8 * num_dictionaries)).tolist()
+
+	def __init__(self, filename: str) -> None:
+		with open(filename, 'rb') as f:
+			self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		if len(self._mmap) < self._HEADER.size:
+			self._mmap.close()
+			raise ValueError(f'{filename} is cut short')
+		magic, version, byteorder, num_dictionaries, self.num_rows = self._HEADER.unpack_from(self._mmap)
+		if magic != self._MAGIC or version != self._VERSION or byteorder != self._BYTEORDER:
+			self._mmap.close()
+			raise ValueError(f'{filename} is not a prefix index')
+		position = self._HEADER.size + 8 * num_dictionaries
+		# The offsets tables, then the keys and the words, which end at the last offset of each table
+		keys_start = position + 2 * 8 * (self.num_rows + 1)
+		if len(self._mmap) < keys_start\
+			or len(self._mmap) < keys_start + struct.unpack_from('=Q', self._mmap, keys_start - 8 * (self.num_rows + 2))[0]\
+			+ struct.unpack_from('=Q', self._mmap, keys_start - 8)[0]:
+			self._mmap.close()
+			raise ValueError(f'{filename} is cut short')
+		self.ids_dictionaries = array('Q', self._mmap[self._HEADER.size:self._HEADER.size + 8 * num_dictionaries]).tolist()
+		offsets = memoryview(self._mmap)[position:position + 2 * 8 * (self.num_rows + 1)].cast('Q')
+		self._key_offsets = offsets[:self.num_rows + 1]
+		self._word_offsets = offsets[self.num_rows + 1:]
+		self._keys_start = position + 2 * 8 * (self.num_rows + 1)
+		self._words_start = self._keys_start + self._key_offsets[self.num_rows]
+		self._sampled_keys = [self._key_at(i) for i in range(0, self.num_rows, self._SAMPLING_INTERVAL)]
+
+	def _key_at(self, i: int) -> bytes:
+		return self._mmap[self._keys_start + self._key_offsets[i]:self._keys_start + self._key_offsets[i + 1]]
+
+	def _word_at(self, i: int) -> str:
+		return self._mmap[self._words_start + self._word_offsets[i]:self._words_start + self._word_offsets[i + 1]].decode('utf-8')
+
+	def _first_row_not_below(self, prefix_bytes: bytes) -> int:
+		# The first key >= prefix lies after the last sampled key < prefix, and no later than the next sampled key
+		i_sample = bisect.bisect_left(self._sampled_keys, prefix_bytes)
+		low = max(i_sample - 1, 0) * self._SAMPLING_INTERVAL
+		high = min(i_sample * self._SAMPLING_INTERVAL, self.num_rows)
+		while low < high:
+			middle = (low + high) // 2
+			if self._key_at(middle) < prefix_bytes:
+				low = middle + 1
+			else:
+				high = middle
+		return low
+
+	def words_beginning_with(self, prefix: str, words_excluded: list[str], limit: int) -> list[str]:
+		"""
+		Return at most `limit` distinct words whose key begins with `prefix`, in the order of keys.
+		"""
+		prefix_bytes = prefix.encode('utf-8')
+		words = []
+		words_seen = set(words_excluded)
+		i = self._first_row_not_below(prefix_bytes)
+		while len(words) < limit and i < self.num_rows and self._key_at(i).startswith(prefix_bytes):
+			word = self._word_at(i)
+			if word not in words_seen:
+				words_seen.add(word)
+				words.append(word)
+			i += 1
+		return words
+
+	def rows_beginning_with(self, prefix: str) -> Iterator[tuple[str, str]]:
+		"""
+		Yield the (key, word) pairs whose key begins with `prefix`, in the order of keys.
+		"""
+		prefix_bytes = prefix.encode('utf-8')
+		i = self._first_row_not_below(prefix_bytes)
+		while i < self.num_rows and (key := self._key_at(i)).startswith(prefix_bytes):
+			yield key.decode('utf-8'), self._word_at(i)
+			i += 1
@@ -0,0 +1,153 @@
+"""
+Renders articles in worker processes, so that the CPU-bound Python of several dictionaries (DSL parsing,
+HTML cleaning, XDXF transformation, Chinese conversion) runs on several cores instead of taking turns on the GIL.
+The records are read in the main process; only they cross the process boundary with each request,
+along with the dictionary's name and the digest of its pickled renderer.
+Each worker keeps the renderer it has unpickled for each dictionary with that digest. The pickle itself is only sent
+to a worker that reports not having it, so a renderer is sent and unpickled once per process,
+and again when the dictionary is reloaded or the renderer's state changes.
+If a worker dies, the pool is started afresh by the next request, and the current ones render in their own threads.
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+from . import utils
+from .dicts.base_reader import BaseReader, BaseRenderer
+from .settings import Settings
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+# dictionary name -> (digest, renderer), in each worker process
+_renderers_of_worker: dict[str, tuple[str, BaseRenderer]] = dict()
+
+
+def _initialise_worker() -> None:
+	# The process is the unit of parallelism here, so the renderers run their items one after another
+	utils.worker_pool = utils.WorkerPool(0)
+
+
+def _warm_up() -> None:
+	pass
+
+
+def _join_definitions(renderer: BaseRenderer,
+					  records_of_entries: list[list[Any]],
+					  postprocess: Callable[[str], str] | None) -> str:
+	definition = BaseReader._ARTICLE_SEPARATOR.join([BaseReader._ARTICLE_SEPARATOR.join(renderer.render(records))
+													 for records in records_of_entries])
+	if postprocess is not None:
+		definition = postprocess(definition)
+	return definition
+
+
+def _render_definitions(name: str,
+						digest: str,
+						renderer_pickled: bytes | None,
+						records_of_entries: list[list[Any]],
+						postprocess: Callable[[str], str] | None) -> str | None:
+	"""
+	Returns None if the worker does not have the renderer with this digest and renderer_pickled is not given.
+	"""
+	entry = _renderers_of_worker.get(name)
+	if entry is None or entry[0] != digest:
+		if renderer_pickled is None:
+			return None
+		entry = _renderers_of_worker[name] = (digest, pickle.loads(renderer_pickled))
+	return _join_definitions(entry[1], records_of_entries, postprocess)
+
+
+class RenderPool:
+	def __init__(self, num_processes: int) -> None:
+		self.num_processes = num_processes
+		self._executor: ProcessPoolExecutor | None = None
+		self._lock = threading.Lock()
+		# dictionary name -> (renderer, its state version, digest, pickle)
+		self._renderers_pickled: dict[str, tuple[BaseRenderer, int, str, bytes]] = dict()
+
+	def _start_executor(self) -> ProcessPoolExecutor:
+		# Called with the lock held
+		if self._executor is None:
+			# Forking a process with threads running would copy their locks in whatever state they are
+			self._executor = ProcessPoolExecutor(self.num_processes,
+												 mp_context=multiprocessing.get_context('spawn'),
+												 initializer=_initialise_worker)
+			logger.info(f'Started {self.num_processes} rendering processes')
+		return self._executor
+
+	def start(self) -> None:
+		"""
+		Starts the worker processes ahead of the first request, which would otherwise wait for them to spawn.
+		"""
+		with self._lock:
+			executor = self._start_executor()
+			# Processes are spawned on demand, one per task submitted while none is idle
+			for _ in range(self.num_processes):
+				executor.submit(_warm_up)
+
+	def forget(self, name: str) -> None:
+		"""
+		Drops the pickled renderer of a removed dictionary.
+		"""
+		with self._lock:
+			self._renderers_pickled.pop(name, None)
+
+	def _pickle_renderer(self, reader: BaseReader) -> tuple[str, bytes]:
+		entry = self._renderers_pickled.get(reader.name)
+		if entry is None or entry[0] is not reader.renderer or entry[1] != reader.renderer.state_version:
+			renderer_pickled = pickle.dumps(reader.renderer)
+			entry = (reader.renderer,
+					 reader.renderer.state_version,
+					 hashlib.sha1(renderer_pickled).hexdigest(),
+					 renderer_pickled)
+			self._renderers_pickled[reader.name] = entry
+		return entry[2], entry[3]
+
+	def get_definitions_by_locations(self,
+									 reader: BaseReader,
+									 locations_of_entries: list[list[tuple[str, int, int]]],
+									 postprocess: Callable[[str], str] | None = None) -> str:
+		"""
+		Like reader.get_definitions_by_locations() followed by postprocess(), with the rendering done in a worker process.
+		postprocess must be picklable, e.g. a module-level function or a functools.partial of one.
+		"""
+		reader.renderer.refresh()
+		with self._lock:
+			executor = self._start_executor()
+			digest, renderer_pickled = self._pickle_renderer(reader)
+		# Reading the records is I/O and decompression, which the calling thread does better
+		records_of_entries = [reader.get_records_by_locations(locations) for locations in locations_of_entries]
+		try:
+			definition = executor.submit(_render_definitions,
+										 reader.name,
+										 digest,
+										 None,
+										 records_of_entries,
+										 postprocess).result()
+			if definition is None:
+				# The worker has not got this renderer yet
+				definition = executor.submit(_render_definitions,
+											 reader.name,
+											 digest,
+											 renderer_pickled,
+											 records_of_entries,
+											 postprocess).result()
+			return definition
+		except BrokenProcessPool:
+			with self._lock:
+				# Unless another request has already replaced it
+				if self._executor is executor:
+					logger.error('A rendering process died, restarting the pool')
+					self._executor = None
+					executor.shutdown(wait=False, cancel_futures=True)
+			return _join_definitions(reader.renderer, records_of_entries, postprocess)
+
+
+render_pool = RenderPool(Settings.RENDER_POOL_SIZE)
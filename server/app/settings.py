@@ -118,6 +118,18 @@ class Settings:
 
 	SQLITE_DB_FILE = os.path.join(APP_RESOURCES_ROOT, 'dictionaries.db')
 	SQLITE_LIMIT_VARIABLE_NUMBER = 30000 # The real limit seems to be an arbitrary number choosen by SQLite people: 0x7ffe
+	SQLITE_INSERT_BATCH_SIZE = 100000 # rows per executemany() when indexing a dictionary
+	WORKER_POOL_SIZE = min(32, (os.cpu_count() or 1) + 4) # the same default as ThreadPoolExecutor
+	RENDER_POOL_SIZE = os.cpu_count() or 1 # processes, if render_in_processes is on
+	BLOCK_CACHE_SIZE = 64 * 1024 * 1024 # bytes of decompressed dictionary blocks kept in memory
+	BLOOM_FILTERS_DIR = os.path.join(APP_RESOURCES_ROOT, 'bloom_filters') # one file per dictionary ID
+	BLOOM_FILTER_BITS_PER_KEY = 12 # about 1.5% false positives
+	PREFIX_INDEXES_DIR = os.path.join(APP_RESOURCES_ROOT, 'prefix_indexes') # one file per group composition
+	SHORT_PREFIX_MAX_LENGTH = 3 # suggestions for prefixes up to this length are cached
+	SHORT_PREFIX_CACHE_SIZE = 50 # words cached per prefix, more than shown so that words already found can be skipped
+	SHORT_PREFIX_CACHE_MAX_GROUPS = 64
+	SPELLING_INDEXES_DIR = os.path.join(APP_RESOURCES_ROOT, 'spelling_indexes') # one file per dictionary ID
+	SPELLING_MAX_EDIT_DISTANCE = 2
 
 	XAPIAN_DIR = os.path.join(APP_RESOURCES_ROOT, 'xapian')
 	XAPIAN_GROUP_NAME = 'Xapian'
@@ -126,6 +138,8 @@ class Settings:
 	WILDCARDS = {'^': '%', '+': '_'}
 
 	NGRAM_LEN = 4
+	NGRAM_BUILD_MEMORY_BUDGET = 512 * 1024 * 1024 # bytes of postings held in memory before spilling to the database
+	NGRAM_BUILD_PROGRESS_INTERVAL = 1000000 # log progress every this many entries
 
 	NAME_GROUP_LOADED_INTO_MEMORY = 'Memory'
 
@@ -216,6 +230,16 @@ class Settings:
 		preferences = preferences.replace('# suggestions_mode: both-sides', 'suggestions_mode: both-sides')
 		with open(self.PREFERENCES_FILE, 'w') as preferences_file:
 			preferences_file.write(preferences)
+
+	def change_suggestions_mode_from_both_sides_to_right_side(self) -> None:
+		self.preferences['suggestions_mode'] = 'right-side'
+		with open(self.PREFERENCES_FILE) as preferences_file:
+			preferences = preferences_file.read()
+		preferences = preferences.replace('# suggestions_mode: right-side', 'suggestions_mode: right-side')
+		preferences = preferences.replace('suggestions_mode: both-sides', '# suggestions_mode: both-sides')
+		preferences = preferences.replace('# # suggestions_mode: both-sides', '# suggestions_mode: both-sides')
+		with open(self.PREFERENCES_FILE, 'w') as preferences_file:
+			preferences_file.write(preferences)
 	
 	def _safe(func: Callable) -> Callable:
 		@functools.wraps(func)
@@ -235,6 +259,8 @@ stardict_load_syns: false # often useless, not exactly slow
 suggestions_mode: right-side # instantaneous
 # suggestions_mode: both-sides # slower
 ngram_stores_keys: false # the database size would almost double if set to true, but creation is faster
+substring_index: ngram # used by both-sides suggestions
+# substring_index: trigram # SQLite FTS5, also speeds up wildcard queries
 running_mode: normal # suitable for running locally
 # running_mode: preparation # use before deploying to a server
 # running_mode: server # to be used in a resource-constrained environment
@@ -243,7 +269,10 @@ running_mode: normal # suitable for running locally
 chinese_preference: none
 check_for_updates: false # Don't use if you can't access GitHub
 full_text_search_diacritic_insensitive: false
-autoplay_audio: true''')
+autoplay_audio: true
+prefix_index: false # memory-mapped index for faster suggestions, built in the background for each group
+spelling_index: true # suggest similar headwords when nothing matches; about 200 bytes per headword on disk
+render_in_processes: false # render the articles of different dictionaries on different CPU cores''')
 		self.preferences: dict[str, str] = self._read_settings_from_file(self.PREFERENCES_FILE)
 
 
@@ -253,6 +282,8 @@ autoplay_audio: true''')
 			self.preferences['suggestions_mode'] = 'right-side'
 		if 'ngram_stores_keys' not in self.preferences:
 			self.preferences['ngram_stores_keys'] = False
+		if 'substring_index' not in self.preferences:
+			self.preferences['substring_index'] = 'ngram'
 		if 'running_mode' not in self.preferences:
 			self.preferences['running_mode'] = 'normal'
 		if 'chinese_preference' not in self.preferences:
@@ -263,6 +294,12 @@ autoplay_audio: true''')
 			self.preferences['full_text_search_diacritic_insensitive'] = False
 		if 'autoplay_audio' not in self.preferences:
 			self.preferences['autoplay_audio'] = True
+		if 'prefix_index' not in self.preferences:
+			self.preferences['prefix_index'] = False
+		if 'spelling_index' not in self.preferences:
+			self.preferences['spelling_index'] = True
+		if 'render_in_processes' not in self.preferences:
+			self.preferences['render_in_processes'] = False
 
 		if not self._preferences_valid():
 			raise ValueError('Invalid preferences file.')
@@ -428,6 +465,12 @@ autoplay_audio: true''')
 		if os.path.isfile(os.path.join(self.CACHE_ROOT, dictionary_info['dictionary_name'] + '.syn')):
 			# StarDict .syn file converted to pickle
 			os.remove(os.path.join(self.CACHE_ROOT, dictionary_info['dictionary_name'] + '.syn'))
+		if os.path.isfile(os.path.join(self.CACHE_ROOT, dictionary_info['dictionary_name'] + '.decompressed')):
+			# Decompressed copy of a dictzipped dictionary loaded into memory
+			os.remove(os.path.join(self.CACHE_ROOT, dictionary_info['dictionary_name'] + '.decompressed'))
+		if os.path.isfile(os.path.join(self.CACHE_ROOT, dictionary_info['dictionary_name'] + '.css_manifest')):
+			# Record of the stylesheets isolated
+			os.remove(os.path.join(self.CACHE_ROOT, dictionary_info['dictionary_name'] + '.css_manifest'))
 
 	def saved_dictionary_modification_time(self, dictionary_name: str) -> float | None:
 		for m in self.dictionary_metadata:
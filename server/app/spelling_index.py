@@ -0,0 +1,141 @@
+import bisect
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from typing import Iterable
+
+
+def _deletes(word: str, max_distance: int) -> set[str]:
+	"""
+	All the strings obtained by deleting up to max_distance characters from word, word included.
+	"""
+	deletes = {word}
+	frontier = {word}
+	for _ in range(max_distance):
+		frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+		deletes.update(frontier)
+	return deletes
+
+
+def _hash(s: str) -> int:
+	return zlib.crc32(s.encode('utf-8'))
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+	"""
+	Optimal string alignment distance (Damerau-Levenshtein with adjacent transpositions),
+	or max_distance + 1 as soon as it is known to be larger than max_distance.
+	"""
+	if abs(len(a) - len(b)) > max_distance:
+		return max_distance + 1
+	previous_previous = None
+	previous = list(range(len(b) + 1))
+	for i in range(1, len(a) + 1):
+		current = [i] + [0] * len(b)
+		for j in range(1, len(b) + 1):
+			cost = 0 if a[i - 1] == b[j - 1] else 1
+			current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+			if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+				current[j] = min(current[j], previous_previous[j - 2] + 1)
+		if min(current) > max_distance:
+			return max_distance + 1
+		previous_previous, previous = previous, current
+	return previous[len(b)]
+
+
+class SpellingIndex:
+	"""
+	A SymSpell-style index over the keys of one dictionary, memory-mapped from disk.
+	Each key is stored under the hashes of its prefix with up to MAX_DISTANCE characters deleted,
+	and a query looks up the same deletes of the input's prefix: two strings within MAX_DISTANCE edits
+	always share one of them, so no candidate is missed. The candidates are then checked with edit_distance(),
+	so hash collisions and deletes shared by more distant strings do no harm.
+	Only the first PREFIX_LENGTH characters are indexed, which keeps the number of deletes small;
+	an error further on leaves the prefixes equal.
+	Layout: header, offsets of the keys, the UTF-8 keys, then the (hash, key number) pairs sorted by hash,
+	as two arrays of native 32-bit integers.
+	"""
+	PREFIX_LENGTH = 7
+	MAX_DISTANCE = 2
+	_MAGIC = b'SDSI'
+	_VERSION = 1
+	_BYTEORDER = {'little': 1, 'big': 2}[sys.byteorder]
+	_HEADER = struct.Struct('=4sBBxxQQ') # magic, version, byte order, number of keys, number of pairs
+	_NUM_BUCKETS = 256 # the pairs are sorted bucket by bucket, to keep the Python objects few
+
+	@classmethod
+	def write(cls, filename: str, keys: Iterable[str]) -> int:
+		"""
+		:param keys: distinct keys
+		:return: the number of keys written
+		"""
+		key_offsets = array('Q', [0])
+		buckets = [array('Q') for _ in range(cls._NUM_BUCKETS)]
+		temp_filename = filename + '.tmp'
+		with open(temp_filename + '.keys', 'w+b') as keys_file:
+			for key_number, key in enumerate(keys):
+				key_offsets.append(key_offsets[-1] + keys_file.write(key.encode('utf-8')))
+				for delete in _deletes(key[:cls.PREFIX_LENGTH], cls.MAX_DISTANCE):
+					h = _hash(delete)
+					buckets[h >> 24].append(h << 32 | key_number)
+			num_keys = len(key_offsets) - 1
+			num_pairs = sum(len(bucket) for bucket in buckets)
+			with open(temp_filename, 'wb') as f:
+				f.write(cls._HEADER.pack(cls._MAGIC, cls._VERSION, cls._BYTEORDER, num_keys, num_pairs))
+				f.write(key_offsets.tobytes())
+				keys_file.seek(0)
+				while chunk := keys_file.read(1 << 24):
+					f.write(chunk)
+				padding = -f.tell() % 4
+				f.write(b'\0' * padding)
+				for i, bucket in enumerate(buckets):
+					buckets[i] = array('Q', sorted(bucket))
+				for bucket in buckets:
+					f.write(array('I', (pair >> 32 for pair in bucket)).tobytes())
+				for bucket in buckets:
+					f.write(array('I', (pair & 0xffffffff for pair in bucket)).tobytes())
+		os.remove(temp_filename + '.keys')
+		os.replace(temp_filename, filename)
+		return num_keys
+
+	def __init__(self, filename: str) -> None:
+		with open(filename, 'rb') as f:
+			self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, version, byteorder, self.num_keys, num_pairs = self._HEADER.unpack_from(self._mmap)
+		if magic != self._MAGIC or version != self._VERSION or byteorder != self._BYTEORDER:
+			self._mmap.close()
+			raise ValueError(f'{filename} is not a spelling index')
+		position = self._HEADER.size
+		self._key_offsets = memoryview(self._mmap)[position:position + 8 * (self.num_keys + 1)].cast('Q')
+		self._keys_start = position + 8 * (self.num_keys + 1)
+		position = self._keys_start + self._key_offsets[self.num_keys]
+		position += -position % 4
+		self._hashes = memoryview(self._mmap)[position:position + 4 * num_pairs].cast('I')
+		position += 4 * num_pairs
+		self._key_numbers = memoryview(self._mmap)[position:position + 4 * num_pairs].cast('I')
+
+	def _key_at(self, i: int) -> str:
+		return self._mmap[self._keys_start + self._key_offsets[i]:self._keys_start + self._key_offsets[i + 1]].decode('utf-8')
+
+	def similar_keys(self, input: str, max_distance: int = MAX_DISTANCE) -> dict[str, int]:
+		"""
+		Returns {key: edit distance} for the keys within max_distance of input, input itself excluded.
+		max_distance is capped at MAX_DISTANCE.
+		"""
+		max_distance = min(max_distance, self.MAX_DISTANCE)
+		key_numbers = set()
+		for delete in _deletes(input[:self.PREFIX_LENGTH], max_distance):
+			h = _hash(delete)
+			i = bisect.bisect_left(self._hashes, h)
+			while i < len(self._hashes) and self._hashes[i] == h:
+				key_numbers.add(self._key_numbers[i])
+				i += 1
+		similar_keys = dict()
+		for key_number in key_numbers:
+			key = self._key_at(key_number)
+			if key != input and (distance := edit_distance(input, key, max_distance)) <= max_distance:
+				similar_keys[key] = distance
+		return similar_keys
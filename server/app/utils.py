@@ -1,9 +1,14 @@
-import functools
+import hashlib
+import json
 import logging
+import os
+import queue
 import re
+import threading
+import time
 import traceback
-from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, Any, Iterable
+from .settings import Settings
 
 
 logger = logging.getLogger(__name__)
@@ -16,6 +21,14 @@ _re_css_selectors = re.compile(r'[ \*\>\+\,;:\[\{\]]')
 _re_css_separators = re.compile(r'[,;{]')
 
 
+def _write_atomically(full_filename: str, text: str) -> None:
+	# Unique per thread, so that writers racing on the same file each replace it with a complete one
+	temp_filename = f'{full_filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+	with open(temp_filename, 'w') as f:
+		f.write(text)
+	os.replace(temp_filename, full_filename)
+
+
 def isolate_css(full_filename: str, id: str) -> None:
 	"""
 	Isolate different dictionaries' styles by prepending the article block's ID to each selector.
@@ -113,22 +126,204 @@ def isolate_css(full_filename: str, id: str) -> None:
 			current_pos += 1
 
 	new_css = f'{_ISOLATED_MARKER}{"".join(buf)}'
-	with open(full_filename, 'w') as f:
-		f.write(new_css)
+	_write_atomically(full_filename, new_css)
+
+
+def isolate_css_files(directory: str, id: str, manifest_filename: str) -> None:
+	"""
+	Isolate the stylesheets directly inside the directory, to be called at load and when they change.
+	The manifest records the modification time, size and SHA-1 of each stylesheet once isolated,
+	and the stylesheets it still matches are not read again.
+	As stylesheets are replaced atomically and isolating one twice changes nothing,
+	loaders racing on the same directory end up with the same files.
+	"""
+	if not os.path.isdir(directory):
+		return
+	try:
+		with open(manifest_filename) as f:
+			manifest = json.load(f)
+	except (OSError, ValueError):
+		manifest = dict()
+
+	new_manifest = dict()
+	for entry in os.scandir(directory):
+		if not entry.name.lower().endswith('.css') or not entry.is_file():
+			continue
+		stat = entry.stat()
+		recorded = manifest.get(entry.name)
+		if recorded is not None and recorded[:2] == [stat.st_mtime_ns, stat.st_size]:
+			new_manifest[entry.name] = recorded
+			continue
+		isolate_css(entry.path, id)
+		stat = os.stat(entry.path)
+		with open(entry.path, 'rb') as f:
+			new_manifest[entry.name] = [stat.st_mtime_ns, stat.st_size, hashlib.sha1(f.read()).hexdigest()]
+
+	if new_manifest != manifest:
+		_write_atomically(manifest_filename, json.dumps(new_manifest))
+
+
+class _Batch:
+	"""
+	The items of one call to run_in_thread_pool(), claimed one by one by the caller and the workers.
+	"""
+	def __init__(self, func: Callable[..., Any], args_of_items: list[tuple[Any, ...]], stage: str) -> None:
+		self.func = func
+		self.args_of_items = args_of_items
+		self.stage = stage
+		self.results: list[Any] = [None] * len(args_of_items)
+		self.exceptions: list[Exception | None] = [None] * len(args_of_items)
+		self.time_submitted = time.perf_counter()
+		self._next_item = 0
+		self._num_items_done = 0
+		self._lock = threading.Lock()
+		self._all_done = threading.Event()
+
+	def claim(self) -> int | None:
+		with self._lock:
+			if self._next_item >= len(self.args_of_items):
+				return None
+			self._next_item += 1
+			return self._next_item - 1
+
+	def run(self, i: int) -> None:
+		try:
+			self.results[i] = self.func(*self.args_of_items[i])
+		except Exception as e:
+			logger.error(f'Error in thread pool: {e}\n{traceback.format_exc()}')
+			self.exceptions[i] = e
+		with self._lock:
+			self._num_items_done += 1
+			if self._num_items_done == len(self.args_of_items):
+				self._all_done.set()
+
+	def wait(self) -> None:
+		self._all_done.wait()
+
+
+class WorkerPool:
+	"""
+	A process-wide, bounded pool of long-lived threads. As db_manager keeps one SQLite connection per thread,
+	the connections of the workers stay open between calls instead of being opened by every short-lived thread.
+	The caller of run() works on its own items too and only ever waits for items already being run by a worker,
+	so fanning out again from inside a worker cannot deadlock however small the pool is.
+	"""
+	def __init__(self, num_workers: int) -> None:
+		self.num_workers = num_workers
+		self._queue: queue.SimpleQueue[_Batch] = queue.SimpleQueue()
+		self._lock = threading.Lock()
+		self._threads: list[threading.Thread] = []
+		self._initializer: Callable[[], Any] | None = None
+		# stage -> {items, items_run_by_caller, queue_time, max_queue_time, run_time}, times in seconds
+		self._stats: dict[str, dict[str, float]] = dict()
+
+	def start(self, initializer: Callable[[], Any] | None = None) -> None:
+		"""
+		Start the workers, which first call initializer(), if given. Otherwise, they are started on first use.
+		"""
+		with self._lock:
+			if self._threads:
+				return
+			self._initializer = initializer
+			for i in range(self.num_workers):
+				thread = threading.Thread(target=self._work, name=f'worker-{i}', daemon=True)
+				thread.start()
+				self._threads.append(thread)
+
+	def _work(self) -> None:
+		if self._initializer is not None:
+			try:
+				self._initializer()
+			except Exception as e:
+				logger.error(f'Failed to initialise a worker: {e}')
+		while True:
+			self._run_items_of(self._queue.get(), False)
+
+	def _run_items_of(self, batch: _Batch, run_by_caller: bool) -> None:
+		while (i := batch.claim()) is not None:
+			time_started = time.perf_counter()
+			batch.run(i)
+			self._record(batch.stage, time_started - batch.time_submitted, time.perf_counter() - time_started, run_by_caller)
+
+	def _record(self, stage: str, queue_time: float, run_time: float, run_by_caller: bool) -> None:
+		with self._lock:
+			stats = self._stats.setdefault(stage, {'items': 0, 'items_run_by_caller': 0, 'queue_time': 0.0, 'max_queue_time': 0.0, 'run_time': 0.0})
+			stats['items'] += 1
+			stats['items_run_by_caller'] += run_by_caller
+			stats['queue_time'] += queue_time
+			stats['max_queue_time'] = max(stats['max_queue_time'], queue_time)
+			stats['run_time'] += run_time
+
+	def run(self, func: Callable[..., Any], args_of_items: list[tuple[Any, ...]], num_max_workers: int | None, stage: str) -> list[Any]:
+		if not self._threads:
+			self.start()
+		batch = _Batch(func, args_of_items, stage)
+		# Each worker woken up keeps claiming items until there are none left; the caller is one of them
+		num_helpers = min(len(args_of_items), num_max_workers or self.num_workers, self.num_workers + 1) - 1
+		for _ in range(num_helpers):
+			self._queue.put(batch)
+		self._run_items_of(batch, True)
+		batch.wait()
+		for e in batch.exceptions:
+			if e is not None:
+				raise e
+		return batch.results
+
+	def stats(self) -> dict[str, Any]:
+		"""
+		Per stage: the number of items, how many of them the caller ran itself, and the average and maximum time
+		they waited before being started and the average time they ran, in milliseconds.
+		"""
+		with self._lock:
+			return {
+				'num_workers': self.num_workers,
+				'num_queued': self._queue.qsize(),
+				'stages': {
+					stage: {
+						'items': stats['items'],
+						'items_run_by_caller': stats['items_run_by_caller'],
+						'avg_queue_time_ms': round(1000 * stats['queue_time'] / stats['items'], 3),
+						'max_queue_time_ms': round(1000 * stats['max_queue_time'], 3),
+						'avg_run_time_ms': round(1000 * stats['run_time'] / stats['items'], 3)
+					} for stage, stats in self._stats.items()
+				}
+			}
+
+
+worker_pool = WorkerPool(Settings.WORKER_POOL_SIZE)
 
 
 def run_in_thread_pool(
 	func: Callable[..., Any],
 	*iterables: Iterable[Any],
-	num_max_workers: int | None = None
+	num_max_workers: int | None = None,
+	stage: str | None = None
 ) -> list[Any]:
-	@functools.wraps(func)
-	def wrapper(*args: Any) -> Any:
-		try:
-			return func(*args)
-		except Exception as e:
-			logger.error(f'Error in thread pool: {e}\n{traceback.format_exc()}')
-			raise
-	
-	with ThreadPoolExecutor(num_max_workers) as executor:
-		return list(executor.map(wrapper, *iterables))
+	"""
+	Like ThreadPoolExecutor.map(), but on the shared worker_pool; num_max_workers caps how many threads,
+	the caller's included, work on these items at once. `stage` names the call in the pool's stats,
+	which defaults to the function's qualified name.
+	"""
+	args_of_items = list(zip(*iterables))
+	if len(args_of_items) == 0:
+		return []
+	return worker_pool.run(func, args_of_items, num_max_workers, stage or getattr(func, '__qualname__', repr(func)))
+
+
+def process_memory_stats() -> dict[str, int]:
+	"""
+	The resident memory of this process in bytes: in total, anonymous (the heap, private to the process)
+	and file-backed (mapped files, shared with the other processes mapping them).
+	Only Linux tells them apart; elsewhere this is empty.
+	"""
+	stats = dict()
+	fields = {'VmRSS': 'resident', 'RssAnon': 'resident_anonymous', 'RssFile': 'resident_file_backed'}
+	try:
+		with open('/proc/self/status') as f:
+			for line in f:
+				field, _, value = line.partition(':')
+				if field in fields:
+					stats[fields[field]] = int(value.split()[0]) * 1024 # in kB
+	except OSError:
+		pass
+	return stats